@@ -1,10 +1,13 @@
 """The SolarEdge rs485 Integration."""
 import asyncio
 import logging
+import time
 from datetime import timedelta
 from typing import Any
 
 import async_timeout
+import homeassistant.helpers.config_validation as cv
+import voluptuous as vol
 from homeassistant.config_entries import ConfigEntry
 from homeassistant.const import (
     CONF_HOST,
@@ -13,15 +16,17 @@ from homeassistant.const import (
     CONF_SCAN_INTERVAL,
     Platform,
 )
-from homeassistant.core import HomeAssistant
+from homeassistant.core import HomeAssistant, ServiceCall, callback
 from homeassistant.helpers.device_registry import DeviceEntry
 from homeassistant.helpers.update_coordinator import DataUpdateCoordinator, UpdateFailed
 
-from .const import DOMAIN,  ConfDefaultInt
-# ConfDefaultFlag,
-from .const import RetrySettings
-#ConfName, 
+from .const import DOMAIN,  ConfDefaultInt, ConfName
+from .const import ConfDefaultFlag
+from .const import PartialReadSettings, PublishSettings, RetrySettings
+from .const import ATTR_CYCLES, ATTR_TRACE_MEMORY, SERVICE_PROFILE, ProfileSettings
 from .hub import DataUpdateFailed, HubInitFailed, SolarEdgers485MultiHub
+from .profiler import async_profile_cycles
+from .registers import REGISTERS, exceeds_deadband
 
 _LOGGER = logging.getLogger(__name__)
 _LOGGER.setLevel(logging.DEBUG)
@@ -30,6 +35,15 @@ PLATFORMS: list[str] = [
     Platform.SENSOR,
 ]
 
+PROFILE_SCHEMA = vol.Schema(
+    {
+        vol.Optional(ATTR_CYCLES, default=ProfileSettings.Cycles): vol.All(
+            vol.Coerce(int), vol.Range(min=1, max=ProfileSettings.MaxCycles)
+        ),
+        vol.Optional(ATTR_TRACE_MEMORY, default=False): cv.boolean,
+    }
+)
+
 
 async def async_setup_entry(hass: HomeAssistant, entry: ConfigEntry) -> bool:
     """Set up an Energy Meter."""
@@ -49,6 +63,16 @@ async def async_setup_entry(hass: HomeAssistant, entry: ConfigEntry) -> bool:
         entry.data[CONF_NAME],
         entry.data[CONF_HOST],
         entry.data[CONF_PORT],
+        medium_poll_cycles=entry.options.get(
+            ConfName.MEDIUM_POLL_CYCLES, ConfDefaultInt.MEDIUM_POLL_CYCLES
+        ),
+        slow_poll_cycles=entry.options.get(
+            ConfName.SLOW_POLL_CYCLES, ConfDefaultInt.SLOW_POLL_CYCLES
+        ),
+        capture_path=hass.config.path(f"{DOMAIN}_capture_{entry.entry_id}.bin")
+        if entry.options.get(ConfName.CAPTURE, bool(ConfDefaultFlag.CAPTURE))
+        else None,
+        inverter_unit_ids=inverter_unit_ids(entry),
     )
 
     coordinator = SolarEdgeCoordinator(
@@ -63,23 +87,67 @@ async def async_setup_entry(hass: HomeAssistant, entry: ConfigEntry) -> bool:
         "coordinator": coordinator,
     }
 
-    await coordinator.async_config_entry_first_refresh()
+    try:
+        await coordinator.async_config_entry_first_refresh()
+    except Exception:
+        # The gateway connection may be shared, give it back before a retry
+        await solaredge_hub.shutdown()
+        hass.data[DOMAIN].pop(entry.entry_id)
+        raise
 
     await hass.config_entries.async_forward_entry_setups(entry, PLATFORMS)
 
     entry.async_on_unload(entry.add_update_listener(async_reload_entry))
 
+    if not hass.services.has_service(DOMAIN, SERVICE_PROFILE):
+
+        async def async_profile(call: ServiceCall) -> None:
+            """Profile the next scheduled poll cycles of all hubs."""
+            coordinators = [
+                data["coordinator"] for data in hass.data[DOMAIN].values()
+            ]
+            await async_profile_cycles(
+                hass,
+                coordinators,
+                call.data[ATTR_CYCLES],
+                call.data[ATTR_TRACE_MEMORY],
+            )
+
+        hass.services.async_register(
+            DOMAIN, SERVICE_PROFILE, async_profile, schema=PROFILE_SCHEMA
+        )
+
     return True
 
 
+def inverter_unit_ids(entry: ConfigEntry) -> list[int]:
+    """Return the unit IDs of the inverters of a config entry.
+
+    Entries set up from a bus scan list them, the others have the first unit
+    ID and the number of inverters with consecutive unit IDs.
+    """
+    if ConfName.DEVICE_IDS in entry.data:
+        return list(entry.data[ConfName.DEVICE_IDS])
+    first = entry.data.get(ConfName.DEVICE_ID, ConfDefaultInt.DEVICE_ID)
+    number = entry.data.get(
+        ConfName.NUMBER_INVERTERS, ConfDefaultInt.NUMBER_INVERTERS
+    )
+    return list(range(first, first + number))
+
+
 async def async_unload_entry(hass: HomeAssistant, entry: ConfigEntry) -> bool:
     """Unload a config entry."""
     solaredge_hub = hass.data[DOMAIN][entry.entry_id]["hub"]
+    coordinator = hass.data[DOMAIN][entry.entry_id]["coordinator"]
+    if coordinator.profile is not None:
+        coordinator.profile.detach(coordinator)
     await solaredge_hub.shutdown()
 
     unload_ok = await hass.config_entries.async_unload_platforms(entry, PLATFORMS)
     if unload_ok:
         hass.data[DOMAIN].pop(entry.entry_id)
+        if not hass.data[DOMAIN]:
+            hass.services.async_remove(DOMAIN, SERVICE_PROFILE)
 
     return unload_ok
 
@@ -138,12 +206,40 @@ class SolarEdgeCoordinator(DataUpdateCoordinator):
             update_interval=timedelta(seconds=scan_interval),
         )
         self._hub = hub
+        self.max_silence = PublishSettings.MaxSilence
+        # (unit id, field index) of the values that changed beyond their deadband
+        # in the last update; entities of other fields skip their state write
+        self.changed = frozenset()
+        # last published values by unit id, indexed like REGISTERS
+        self._published = {}
+        # seconds after which a value that could not be read again is
+        # unavailable, indexed like REGISTERS; None for values read only once
+        self.max_ages = []
+        for field in REGISTERS:
+            cycles = hub.poll_cycles(field.tier)
+            self.max_ages.append(
+                None
+                if cycles is None
+                else PartialReadSettings.MaxAgeReads * cycles * scan_interval
+            )
+        # ProfileSession running the next cycles under its profiler, if any
+        self.profile = None
 
     async def _async_update_data(self):
+        profile = self.profile
+        if profile is None:
+            return await self._async_poll()
+        profile.enable()
+        try:
+            return await self._async_poll()
+        finally:
+            profile.disable(self)
+
+    async def _async_poll(self):
         try:
             async with async_timeout.timeout(self._hub.coordinator_timeout):
-                return await self._refresh_rs485_data_with_retry(
-                    ex_type=DataUpdateFailed,
+                await self._refresh_rs485_data_with_retry(
+                    ex_type=HubInitFailed,
                     limit=RetrySettings.Limit,
                     wait_ms=RetrySettings.Time,
                     wait_ratio=RetrySettings.Ratio,
@@ -153,8 +249,56 @@ class SolarEdgeCoordinator(DataUpdateCoordinator):
             raise UpdateFailed(f"{e}")
 
         except DataUpdateFailed as e:
+            # The coordinator does not update the entities again while the
+            # updates keep failing; do it here, so the values that are too old
+            # by now become unavailable
+            self.async_update_listeners()
             raise UpdateFailed(f"{e}")
 
+        self.changed = self._changed_fields()
+        return tuple(inverter.snapshot for inverter in self._hub.inverters)
+
+    def _changed_fields(self) -> frozenset:
+        """Diff the decoded values against the last published ones."""
+        changed = []
+        for inverter in self._hub.inverters:
+            unit_id = inverter.inverter_unit_id
+            values = inverter.snapshot.values
+            published = self._published.get(unit_id)
+            if published is None:
+                published = self._published[unit_id] = [None] * len(values)
+            for index, field in enumerate(REGISTERS):
+                value = values[index]
+                previous = published[index]
+                if value != previous and exceeds_deadband(field, previous, value):
+                    published[index] = value
+                    changed.append((unit_id, index))
+        return frozenset(changed)
+
+    @callback
+    def async_update_listeners(self) -> None:
+        """Update the entities, timing it for the trace of the last cycle."""
+        started = time.monotonic()
+        super().async_update_listeners()
+        traces = self._hub.metrics.traces
+        if traces and traces[-1].publish is None:
+            traces[-1].publish = time.monotonic() - started
+
+    def is_fresh(self, snapshot, index) -> bool:
+        """Return True if field *index* was read within its maximum age."""
+        age = snapshot.age(index)
+        if age is None:
+            return False
+        max_age = self.max_ages[index]
+        return max_age is None or age <= max_age
+
+    def should_publish(self, unit_id, index, last_write: float) -> bool:
+        """Return True if an entity showing field *index* must write its state."""
+        return (
+            (unit_id, index) in self.changed
+            or time.monotonic() - last_write >= self.max_silence
+        )
+
     async def _refresh_rs485_data_with_retry(
         self,
         ex_type=Exception,
@@ -186,6 +330,7 @@ class SolarEdgeCoordinator(DataUpdateCoordinator):
                 _LOGGER.debug(f"Failed data refresh attempt #{attempt}", exc_info=ex)
 
                 attempt += 1
+                self._hub.metrics.retries += 1
                 _LOGGER.debug(
                     f"Waiting {wait_ms} ms before data refresh attempt #{attempt}"
                 )
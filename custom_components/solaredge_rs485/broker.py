@@ -0,0 +1,232 @@
+"""One connection per gateway, shared by all config entries using it.
+
+Most gateways take one TCP connection at a time, and the bus behind them
+carries one transaction at a time anyway. A :class:`GatewayBroker` owns the
+:class:`Instrument` of a gateway, keyed by (host, port) for the whole process,
+and hands out a :class:`BrokerClient` to every hub polling inverters behind it.
+The connection is closed when the last client is closed.
+
+The transactions of all clients queue in a :class:`RequestQueue`, which is the
+lock of the instrument:
+
+- Requests are served by priority, see RequestPriority: a hub setting up its
+  inverters goes before the poll cycles of the others.
+- Within a priority the clients take turns, one request each, so a hub with
+  many inverters does not hold back a hub with one until its sweep is done.
+  The requests of one client keep their order.
+
+The queue depth and the time spent waiting for the connection are counted in
+:class:`~.metrics.QueueMetrics`.
+"""
+import asyncio
+import contextvars
+import heapq
+import itertools
+import logging
+import time
+import weakref
+
+from .const import RequestPriority
+from .metrics import QueueMetrics, TransportMetrics
+from .rs485eth import Instrument
+
+_LOGGER = logging.getLogger(__name__)
+
+_BROKERS = {}  # GatewayBroker by (host, port)
+
+# (client, priority) of the request being made, set by BrokerClient
+_CURRENT_REQUEST = contextvars.ContextVar("gateway_request", default=None)
+
+
+def acquire_broker(host, port) -> "GatewayBroker":
+    """Return the broker of the gateway at *host*:*port*, creating it if needed.
+
+    Every broker returned must be given back with :meth:`GatewayBroker.client`
+    and :meth:`BrokerClient.close`, which count its users.
+    """
+    broker = _BROKERS.get((host, port))
+    if broker is None:
+        broker = GatewayBroker(host, port)
+        _BROKERS[broker.key] = broker
+    return broker
+
+
+class RequestQueue:
+    """The lock of a shared connection, serving the waiters in turns.
+
+    Entered like an asyncio.Lock. The waiter is the client and priority set by
+    the :class:`BrokerClient` making the request, or an anonymous client at
+    RequestPriority.POLL.
+
+    Args:
+        metrics (QueueMetrics): Where to count the waits, a new one by default.
+
+    """
+
+    def __init__(self, metrics=None):
+        self.metrics = QueueMetrics() if metrics is None else metrics
+        self._busy = False
+        self._waiters = []  # heap of [priority, turn, sequence, future]
+        self._sequence = itertools.count()
+        self._turns = weakref.WeakKeyDictionary()  # last turn given by client
+        self._anonymous_turn = 0
+        self._turn = 0  # turn of the request holding the connection
+
+    async def __aenter__(self):
+        client, priority = _CURRENT_REQUEST.get() or (None, RequestPriority.POLL)
+        queued = time.monotonic()
+        if self._busy or self._waiters:
+            future = asyncio.get_running_loop().create_future()
+            heapq.heappush(
+                self._waiters,
+                [priority, self._next_turn(client), next(self._sequence), future],
+            )
+            self.metrics.add_depth(self._depth())
+            try:
+                await future
+            except asyncio.CancelledError:
+                if future.done() and not future.cancelled():
+                    self._release()  # handed the connection while cancelled
+                self.metrics.depth = self._depth()
+                raise
+        else:
+            self._busy = True
+            self._turn = self._next_turn(client)
+        self.metrics.add_wait(time.monotonic() - queued)
+
+    async def __aexit__(self, exc_type, exc, traceback):
+        self._release()
+
+    def _next_turn(self, client):
+        """Return the turn of a new request of *client*.
+
+        A client gets the turn after its previous request, and not one before
+        the request holding the connection: the clients waiting take turns.
+        """
+        if client is None:
+            previous = self._anonymous_turn
+        else:
+            previous = self._turns.get(client, 0)
+        turn = max(previous, self._turn) + 1
+        if client is None:
+            self._anonymous_turn = turn
+        else:
+            self._turns[client] = turn
+        return turn
+
+    def _release(self):
+        """Hand the connection to the next waiter, if any."""
+        while self._waiters:
+            _, turn, _, future = heapq.heappop(self._waiters)
+            if not future.done():
+                self._turn = turn
+                self.metrics.depth = self._depth()
+                future.set_result(None)
+                return
+        self._busy = False
+        self.metrics.depth = 0
+
+    def _depth(self):
+        return sum(not entry[-1].done() for entry in self._waiters)
+
+
+class GatewayBroker:
+    """The connection to a gateway and the queue of its requests.
+
+    Use :func:`acquire_broker` rather than creating one, so every hub on the
+    gateway gets the same broker.
+
+    Args:
+        host (str): The host name or IP address of the gateway.
+        port (int): The TCP port of the gateway.
+
+    """
+
+    def __init__(self, host, port):
+        self.key = (host, port)
+        self.metrics = TransportMetrics()
+        self.queue = RequestQueue()
+        self.instrument = Instrument(
+            eth_address=host, eth_port=port, metrics=self.metrics, lock=self.queue
+        )
+        self.clients = 0
+
+    def client(self, priority=RequestPriority.POLL, capture=None) -> "BrokerClient":
+        """Return a new client of the gateway, counted until it is closed.
+
+        Args:
+            priority (RequestPriority): The priority of its requests.
+            capture: Recorder of the frames, see :class:`Instrument`. The
+                instrument has one; it records the traffic of all clients
+                and is taken by the first client asking for it.
+
+        """
+        self.clients += 1
+        if capture is not None and self.instrument.capture is None:
+            self.instrument.capture = capture
+        return BrokerClient(self, priority, capture)
+
+    async def _release(self, client):
+        if client.capture is not None and self.instrument.capture is client.capture:
+            self.instrument.capture = None
+        self.clients -= 1
+        if self.clients:
+            return
+        if _BROKERS.get(self.key) is self:
+            del _BROKERS[self.key]
+        _LOGGER.debug(f"Last client of {self.key[0]}:{self.key[1]} closed")
+        await self.instrument.close()
+
+
+class BrokerClient:
+    """The view of a hub on a shared gateway connection.
+
+    Has the reading methods of :class:`Instrument`; their requests queue as
+    this client, at its priority, which may be changed at any time.
+
+    Args:
+        broker (GatewayBroker): The broker of the gateway.
+        priority (RequestPriority): The priority of the requests.
+        capture: The recorder passed to :meth:`GatewayBroker.client`.
+
+    """
+
+    def __init__(self, broker, priority=RequestPriority.POLL, capture=None):
+        self.broker = broker
+        self.priority = priority
+        self.capture = capture
+        self._closed = False
+
+    @property
+    def metrics(self) -> TransportMetrics:
+        return self.broker.metrics
+
+    @property
+    def is_connected(self):
+        return self.broker.instrument.is_connected
+
+    @property
+    def request_timeout(self):
+        return self.broker.instrument.request_timeout
+
+    async def read_registers(self, *args, **kwargs):
+        return await self._call(self.broker.instrument.read_registers, args, kwargs)
+
+    async def read_blocks(self, *args, **kwargs):
+        return await self._call(self.broker.instrument.read_blocks, args, kwargs)
+
+    async def _generic_command(self, *args, **kwargs):
+        return await self._call(self.broker.instrument._generic_command, args, kwargs)
+
+    async def close(self):
+        """Stop using the gateway; the last client closes the connection."""
+        if not self._closed:
+            self._closed = True
+            await self.broker._release(self)
+
+    async def _call(self, method, args, kwargs):
+        token = _CURRENT_REQUEST.set((self, self.priority))
+        try:
+            return await method(*args, **kwargs)
+        finally:
+            _CURRENT_REQUEST.reset(token)
@@ -0,0 +1,274 @@
+"""Capture of the gateway traffic and replay of a capture.
+
+A capture file starts with a magic header, followed by one record per frame:
+the monotonic timestamp (float64), the direction (0 = request, 1 = response),
+the frame length (uint16) and the raw RTU frame, as sent and received on the
+TCP connection.
+
+The monotonic clock starts from a new base when Home Assistant restarts, and
+the records of a new :class:`CaptureWriter` are appended to the file. Each
+writer therefore starts with a session record (direction 2) whose timestamp is
+the monotonic time the session started at and whose frame is the wall-clock
+time (float64). The timestamps compare within a session only.
+
+:class:`CaptureWriter` is passed to :class:`Instrument` to record the frames.
+They are buffered in memory and written by :meth:`CaptureWriter.flush`, which
+does blocking file I/O and belongs in an executor.
+
+:class:`ReplayInstrument` answers the requests of a hub from a capture, so the
+decoding and publishing of real traffic can be reproduced without a gateway.
+"""
+import asyncio
+import logging
+import struct
+import time
+
+from .const import CaptureSettings
+from .rs485eth import Instrument, NoResponseError
+
+_LOGGER = logging.getLogger(__name__)
+
+CAPTURE_MAGIC = b"SERS485\x01"
+REQUEST = 0
+RESPONSE = 1
+SESSION = 2
+
+_RECORD_STRUCT = struct.Struct(">dBH")
+_SESSION_STRUCT = struct.Struct(">d")
+
+
+class CaptureWriter:
+    """Record request and response frames to a capture file.
+
+    Args:
+        path (str): The capture file, new records are appended after a session
+            record.
+        max_bytes (int): Size after which recording stops.
+
+    """
+
+    def __init__(self, path, max_bytes=CaptureSettings.MaxBytes):
+        self.path = path
+        self.max_bytes = max_bytes
+        self._pending = bytearray()
+        self._written = None  # size of the file, read on the first flush
+        self._full = False
+        self._record(SESSION, _SESSION_STRUCT.pack(time.time()))
+
+    def record_request(self, frame):
+        self._record(REQUEST, frame)
+
+    def record_response(self, frame):
+        self._record(RESPONSE, frame)
+
+    def _record(self, direction, frame):
+        if self._full:
+            return
+        self._pending += _RECORD_STRUCT.pack(time.monotonic(), direction, len(frame))
+        self._pending += frame
+
+    def flush(self):
+        """Append the recorded frames to the file (blocking)."""
+        if not self._pending:
+            return
+        pending = self._pending
+        self._pending = bytearray()
+        with open(self.path, "ab") as file:
+            if self._written is None:
+                self._written = file.tell()
+            if self._written == 0:
+                file.write(CAPTURE_MAGIC)
+                self._written = len(CAPTURE_MAGIC)
+            if self._written + len(pending) > self.max_bytes:
+                _LOGGER.warning(
+                    f"Capture file {self.path} reached {self.max_bytes} bytes, "
+                    + "recording stopped"
+                )
+                self._full = True
+                return
+            file.write(pending)
+            self._written += len(pending)
+
+
+def read_capture(path):
+    """Return the records of a capture file as (timestamp, direction, frame).
+
+    The session records are returned too, see :func:`split_sessions`.
+    """
+    with open(path, "rb") as file:
+        data = file.read()
+    if not data.startswith(CAPTURE_MAGIC):
+        raise ValueError(f"{path} is not a capture file")
+
+    records = []
+    position = len(CAPTURE_MAGIC)
+    while position + _RECORD_STRUCT.size <= len(data):
+        timestamp, direction, length = _RECORD_STRUCT.unpack_from(data, position)
+        position += _RECORD_STRUCT.size
+        frame = data[position : position + length]
+        if len(frame) != length:
+            break  # truncated by a crash while writing
+        position += length
+        records.append((timestamp, direction, frame))
+    return records
+
+
+def split_sessions(records):
+    """Split the records of a capture into the records of each session.
+
+    The records before the first session record, from captures made before
+    there were session records, are a session of their own.
+    """
+    sessions = []
+    for record in records:
+        if not sessions or record[1] == SESSION:
+            sessions.append([])
+        sessions[-1].append(record)
+    return sessions
+
+
+def session_started(record):
+    """Return the wall-clock time of a session record, None for a frame."""
+    timestamp, direction, frame = record
+    if direction != SESSION:
+        return None
+    return _SESSION_STRUCT.unpack(frame)[0]
+
+
+class ReplayInstrument(Instrument):
+    """An :class:`Instrument` answering from a capture instead of a gateway.
+
+    Every request is answered with the response recorded after the next
+    matching request to the same slave in the capture; the requests to each
+    slave are replayed in their own order, as the hub reads its inverters
+    concurrently and their requests interleave differently from one cycle to
+    the next. Requests that were not answered when recording raise
+    :class:`NoResponseError` again, unless the request was repeated on a new
+    connection like :meth:`Instrument._communicate` does. A request that is
+    not in the rest of the capture ends the replay, and the recorded requests
+    passed over to find the next match are counted in :attr:`skipped`. With a
+    *speed* the requests are held back to keep the recorded timing (2 replays
+    twice as fast), without one they are answered right away. The sessions of
+    the capture are replayed one after the other, without the time between
+    them.
+
+    Args:
+        records: The records, see :func:`read_capture`.
+        speed (float): Replay speed relative to the recording, None for as fast
+            as possible.
+        loop (bool): Start again at the beginning when the capture ends.
+
+    """
+
+    def __init__(self, records, speed=None, loop=False, **kwargs):
+        super().__init__("replay", 0, **kwargs)
+        self.speed = speed
+        self.loop = loop
+        self._exchanges = {}  # list of exchanges by slave address
+        self.sessions = 0
+        offset = 0.0  # from the monotonic time of the session to the replay's
+        last = None  # replay time of the last record
+        for index, (timestamp, direction, frame) in enumerate(records):
+            if direction == SESSION:
+                self.sessions += 1
+                offset = (timestamp if last is None else last) - timestamp
+                continue
+            last = timestamp + offset
+            if direction != REQUEST:
+                continue
+            answer = None
+            if index + 1 < len(records) and records[index + 1][1] == RESPONSE:
+                timestamp, _, answer = records[index + 1]
+            # (time of the answer or of the unanswered request, request, answer)
+            self._exchanges.setdefault(frame[0], []).append(
+                (timestamp + offset, frame, answer)
+            )
+        self._positions = dict.fromkeys(self._exchanges, 0)
+        self.skipped = 0
+        self._exhausted = False
+        self._started = None  # monotonic time and capture time of the first answer
+        self._origin = None
+
+    @property
+    def finished(self):
+        """Return True when the whole capture has been replayed."""
+        return self._exhausted or (not self.loop and not self._remaining())
+
+    @property
+    def unit_ids(self):
+        """Return the slave addresses of the recorded requests, in order."""
+        return tuple(sorted(self._exchanges))
+
+    @property
+    def recorded(self):
+        """Return the number of recorded requests."""
+        return sum(map(len, self._exchanges.values()))
+
+    @property
+    def unused(self):
+        """Return how many recorded requests have not been replayed (yet)."""
+        return self.skipped + self._remaining()
+
+    @property
+    def is_connected(self):
+        return True
+
+    async def close(self):
+        pass
+
+    async def _communicate(self, request):
+        timestamp, answer = self._next_answer(request)
+        self.metrics.requests += 1
+        self.metrics.bytes_out += len(request)
+        if answer is None and self._next_request(request[0]) == request:
+            self.metrics.reconnects += 1
+            self.metrics.requests += 1
+            self.metrics.bytes_out += len(request)
+            timestamp, answer = self._next_answer(request)
+        if self.speed:
+            if self._started is None:
+                self._started = time.monotonic()
+                self._origin = timestamp
+            delay = self._started + (timestamp - self._origin) / self.speed
+            await asyncio.sleep(max(0.0, delay - time.monotonic()))
+        if answer is None:
+            self.metrics.timeouts += 1
+            raise NoResponseError("No communication with the instrument (replay)")
+        self.metrics.bytes_in += len(answer)
+        return answer
+
+    def _remaining(self):
+        return sum(
+            len(exchanges) - self._positions[slave]
+            for slave, exchanges in self._exchanges.items()
+        )
+
+    def _next_request(self, slave):
+        """Return the next request to *slave* in the capture, None at the end."""
+        exchanges = self._exchanges.get(slave, ())
+        position = self._positions.get(slave, 0)
+        if position < len(exchanges):
+            return exchanges[position][1]
+        return None
+
+    def _next_answer(self, request):
+        """Return (timestamp, answer) of the next exchange for *request*."""
+        slave = request[0]
+        exchanges = self._exchanges.get(slave, ())
+        count = len(exchanges)
+        for step in range(count):
+            position = self._positions[slave] + step
+            wrapped = position >= count
+            if wrapped:
+                if not self.loop:
+                    break
+                position -= count
+            timestamp, frame, answer = exchanges[position]
+            if frame == request:
+                if wrapped:
+                    self._started = None
+                self._positions[slave] = position + 1
+                self.skipped += step
+                return timestamp, answer
+        self._exhausted = True
+        raise NoResponseError(f"Request {request!r} not in the rest of the capture")
@@ -1,16 +1,31 @@
+import asyncio
 import ipaddress
+import logging
 import re
 
 import homeassistant.helpers.config_validation as cv
 import voluptuous as vol
 from homeassistant import config_entries
+from homeassistant.components import network
+from homeassistant.components.network import MDNS_TARGET_IP
 from homeassistant.config_entries import ConfigEntry
 from homeassistant.const import CONF_HOST, CONF_NAME, CONF_PORT, CONF_SCAN_INTERVAL
 from homeassistant.core import HomeAssistant, callback
 from homeassistant.data_entry_flow import FlowResult
 
-from .const import DEFAULT_NAME, DOMAIN, ConfDefaultInt
-#, ConfDefaultFlag, ConfName
+from . import inverter_unit_ids
+from .const import (
+    DEFAULT_NAME,
+    DOMAIN,
+    SUNSPEC_DID,
+    ConfDefaultFlag,
+    ConfDefaultInt,
+    ConfName,
+    DiscoverySettings,
+)
+from .discovery import async_find_gateways, async_scan_unit_ids
+
+_LOGGER = logging.getLogger(__name__)
 
 
 def host_valid(host):
@@ -23,6 +38,18 @@ def host_valid(host):
         return all(x and not disallowed.search(x) for x in host.split("."))
 
 
+async def async_get_network(hass: HomeAssistant) -> str:
+    """Return the network of the address Home Assistant is reachable at."""
+    local_ip = await network.async_get_source_ip(hass, MDNS_TARGET_IP)
+    network_prefix = 24
+    for adapter in await network.async_get_adapters(hass):
+        for ipv4 in adapter["ipv4"]:
+            if ipv4["address"] == local_ip:
+                network_prefix = ipv4["network_prefix"]
+                break
+    return str(ipaddress.ip_network(f"{local_ip}/{network_prefix}", False))
+
+
 @callback
 def solaredge_rs485_multi_entries(hass: HomeAssistant):
     """Return the hosts already configured."""
@@ -31,66 +58,192 @@ def solaredge_rs485_multi_entries(hass: HomeAssistant):
     )
 
 
+@callback
+def unit_ids_in_use(hass: HomeAssistant, host, port) -> set:
+    """Return the unit IDs polled by the entries on the gateway at host:port."""
+    return {
+        unit_id
+        for entry in hass.config_entries.async_entries(DOMAIN)
+        if entry.data[CONF_HOST] == host and entry.data[CONF_PORT] == port
+        for unit_id in inverter_unit_ids(entry)
+    }
+
+
 class Solaredgers485MultiConfigFlow(config_entries.ConfigFlow, domain=DOMAIN):
     """Solaredge rs485 configflow."""
 
     VERSION = 1
     CONNECTION_CLASS = config_entries.CONN_CLASS_LOCAL_POLL
 
+    def __init__(self):
+        """Initialize the config flow."""
+        self._user_input = None
+        self._found = {}  # DID by unit ID, from the bus scan
+        self._gateways = {}  # DID by host, from the network search
+        self._host = ""
+        self._port = ConfDefaultInt.PORT
+
     @staticmethod
     @callback
     def async_get_options_flow(config_entry: ConfigEntry):
         return Solaredgers485MultiOptionsFlowHandler(config_entry)
 
-    def _host_in_configuration_exists(self, host) -> bool:
-        """Return True if host exists in configuration."""
-        if host in solaredge_rs485_multi_entries(self.hass):
-            return True
-        return False
+    async def _async_create_entry(self, data, unit_ids):
+        """Create the entry, unique by gateway and first unit ID.
+
+        Several entries may poll the same gateway, they share its connection
+        (see broker.py); only their unit IDs must not overlap.
+        """
+        await self.async_set_unique_id(
+            f"{data[CONF_HOST]}:{data[CONF_PORT]}:{min(unit_ids)}"
+        )
+        self._abort_if_unique_id_configured()
+        return self.async_create_entry(title=data[CONF_NAME], data=data)
 
     async def async_step_user(self, user_input=None):
         """Handle the initial step."""
+        return self.async_show_menu(step_id="user", menu_options=["discover", "manual"])
+
+    async def async_step_discover(self, user_input=None):
+        """Search a network for gateways."""
+        errors = {}
+
+        if user_input is not None:
+            try:
+                subnet = ipaddress.ip_network(user_input[ConfName.SUBNET], False)
+            except ValueError:
+                subnet = None
+            if subnet is None or subnet.version != 4:
+                errors[ConfName.SUBNET] = "invalid_subnet"
+            elif subnet.num_addresses > DiscoverySettings.MaxHosts:
+                errors[ConfName.SUBNET] = "subnet_too_large"
+            elif not 1 <= user_input[CONF_PORT] <= 65535:
+                errors[CONF_PORT] = "invalid_tcp_port"
+            else:
+                self._port = user_input[CONF_PORT]
+                self._gateways = await async_find_gateways(
+                    subnet,
+                    self._port,
+                    exclude=solaredge_rs485_multi_entries(self.hass),
+                )
+                if self._gateways:
+                    return await self.async_step_pick_gateway()
+                errors["base"] = "no_gateways_found"
+        else:
+            user_input = {
+                ConfName.SUBNET: await async_get_network(self.hass),
+                CONF_PORT: ConfDefaultInt.PORT,
+            }
+
+        return self.async_show_form(
+            step_id="discover",
+            data_schema=vol.Schema(
+                {
+                    vol.Required(
+                        f"{ConfName.SUBNET}", default=user_input[ConfName.SUBNET]
+                    ): cv.string,
+                    vol.Required(CONF_PORT, default=user_input[CONF_PORT]): vol.Coerce(
+                        int
+                    ),
+                },
+            ),
+            errors=errors,
+        )
+
+    async def async_step_pick_gateway(self, user_input=None):
+        """Select one of the gateways found."""
+        if user_input is not None:
+            self._host = user_input[CONF_HOST]
+            return await self.async_step_manual()
+
+        gateways = {}
+        for host, did in sorted(
+            self._gateways.items(), key=lambda item: ipaddress.ip_address(item[0])
+        ):
+            # No DID when the gateway answered with an exception
+            if did is None:
+                gateways[host] = host
+            else:
+                gateways[host] = f"{host} ({SUNSPEC_DID.get(did, f'DID {did}')})"
+        return self.async_show_form(
+            step_id="pick_gateway",
+            data_schema=vol.Schema(
+                {
+                    vol.Required(CONF_HOST, default=next(iter(gateways))): vol.In(
+                        gateways
+                    ),
+                }
+            ),
+        )
+
+    async def async_step_manual(self, user_input=None):
+        """Enter the gateway and the inverters."""
         errors = {}
 
         if user_input is not None:
-            if self._host_in_configuration_exists(user_input[CONF_HOST]):
-                errors[CONF_HOST] = "already_configured"
-            elif not host_valid(user_input[CONF_HOST]):
+            if not host_valid(user_input[CONF_HOST]):
                 errors[CONF_HOST] = "invalid_host"
             elif user_input[CONF_PORT] < 1:
                 errors[CONF_PORT] = "invalid_tcp_port"
             elif user_input[CONF_PORT] > 65535:
                 errors[CONF_PORT] = "invalid_tcp_port"
-#            elif user_input[ConfName.DEVICE_ID] > 247:
-#                errors[ConfName.DEVICE_ID] = "max_device_id"
-#            elif user_input[ConfName.DEVICE_ID] < 1:
-#                errors[ConfName.DEVICE_ID] = "min_device_id"
-#            elif user_input[ConfName.NUMBER_INVERTERS] > 32:
-#                errors[ConfName.NUMBER_INVERTERS] = "max_inverters"
-#            elif user_input[ConfName.NUMBER_INVERTERS] < 1:
-#                errors[ConfName.NUMBER_INVERTERS] = "min_inverters"
-#            elif (
-#                user_input[ConfName.NUMBER_INVERTERS] + user_input[ConfName.DEVICE_ID]
-#                > 247
-#            ):
-#                errors[ConfName.NUMBER_INVERTERS] = "too_many_inverters"
+            elif user_input[ConfName.DEVICE_ID] > 247:
+                errors[ConfName.DEVICE_ID] = "max_device_id"
+            elif user_input[ConfName.DEVICE_ID] < 1:
+                errors[ConfName.DEVICE_ID] = "min_device_id"
+            elif user_input[ConfName.NUMBER_INVERTERS] > 32:
+                errors[ConfName.NUMBER_INVERTERS] = "max_inverters"
+            elif user_input[ConfName.NUMBER_INVERTERS] < 1:
+                errors[ConfName.NUMBER_INVERTERS] = "min_inverters"
+            elif (
+                user_input[ConfName.NUMBER_INVERTERS] + user_input[ConfName.DEVICE_ID]
+                > 248
+            ):
+                errors[ConfName.NUMBER_INVERTERS] = "too_many_inverters"
             else:
-                await self.async_set_unique_id(user_input[CONF_HOST])
-                self._abort_if_unique_id_configured()
-                return self.async_create_entry(
-                    title=user_input[CONF_NAME], data=user_input
+                data = {
+                    key: value
+                    for key, value in user_input.items()
+                    if key != ConfName.SCAN
+                }
+                unit_ids = range(
+                    data[ConfName.DEVICE_ID],
+                    data[ConfName.DEVICE_ID] + data[ConfName.NUMBER_INVERTERS],
                 )
+                in_use = unit_ids_in_use(self.hass, data[CONF_HOST], data[CONF_PORT])
+                if user_input.get(ConfName.SCAN) and in_use:
+                    # The scan has a connection of its own, with bursts of probes
+                    # that would disturb the polling of the other entries
+                    errors["base"] = "scan_gateway_in_use"
+                elif user_input.get(ConfName.SCAN):
+                    try:
+                        self._found = await async_scan_unit_ids(
+                            data[CONF_HOST], data[CONF_PORT]
+                        )
+                    except (OSError, asyncio.TimeoutError) as e:
+                        _LOGGER.debug(f"Bus scan failed: {e!r}")
+                        errors["base"] = "cannot_connect"
+                    else:
+                        if self._found:
+                            self._user_input = data
+                            return await self.async_step_devices()
+                        errors["base"] = "no_devices_found"
+                elif in_use.intersection(unit_ids):
+                    errors["base"] = "unit_ids_in_use"
+                else:
+                    return await self._async_create_entry(data, unit_ids)
         else:
             user_input = {
                 CONF_NAME: DEFAULT_NAME,
-                CONF_HOST: "",
-                CONF_PORT: ConfDefaultInt.PORT,
-#                ConfName.NUMBER_INVERTERS: ConfDefaultInt.NUMBER_INVERTERS,
-#                ConfName.DEVICE_ID: ConfDefaultInt.DEVICE_ID,
+                CONF_HOST: self._host,
+                CONF_PORT: self._port,
+                ConfName.NUMBER_INVERTERS: ConfDefaultInt.NUMBER_INVERTERS,
+                ConfName.DEVICE_ID: ConfDefaultInt.DEVICE_ID,
+                ConfName.SCAN: bool(ConfDefaultFlag.SCAN),
             }
 
         return self.async_show_form(
-            step_id="user",
+            step_id="manual",
             data_schema=vol.Schema(
                 {
                     vol.Optional(CONF_NAME, default=user_input[CONF_NAME]): cv.string,
@@ -98,13 +251,55 @@ class Solaredgers485MultiConfigFlow(config_entries.ConfigFlow, domain=DOMAIN):
                     vol.Required(CONF_PORT, default=user_input[CONF_PORT]): vol.Coerce(
                         int
                     ),
- #                   vol.Required(
- #                       f"{ConfName.NUMBER_INVERTERS}",
- #                       default=user_input[ConfName.NUMBER_INVERTERS],
- #                   ): vol.Coerce(int),
- #                   vol.Required(
- #                       f"{ConfName.DEVICE_ID}", default=user_input[ConfName.DEVICE_ID]
- #                   ): vol.Coerce(int),
+                    vol.Required(
+                        f"{ConfName.NUMBER_INVERTERS}",
+                        default=user_input[ConfName.NUMBER_INVERTERS],
+                    ): vol.Coerce(int),
+                    vol.Required(
+                        f"{ConfName.DEVICE_ID}", default=user_input[ConfName.DEVICE_ID]
+                    ): vol.Coerce(int),
+                    vol.Optional(
+                        f"{ConfName.SCAN}", default=user_input[ConfName.SCAN]
+                    ): cv.boolean,
+                },
+            ),
+            errors=errors,
+        )
+
+    async def async_step_devices(self, user_input=None):
+        """Select the inverters to poll among those found on the bus."""
+        errors = {}
+        devices = {
+            str(unit_id): f"{unit_id}: {SUNSPEC_DID.get(did, f'DID {did}')}"
+            for unit_id, did in self._found.items()
+        }
+
+        in_use = unit_ids_in_use(
+            self.hass, self._user_input[CONF_HOST], self._user_input[CONF_PORT]
+        )
+
+        if user_input is not None:
+            unit_ids = sorted(
+                int(unit_id) for unit_id in user_input[ConfName.DEVICE_IDS]
+            )
+            if not unit_ids:
+                errors[ConfName.DEVICE_IDS] = "no_devices_selected"
+            elif in_use.intersection(unit_ids):
+                errors[ConfName.DEVICE_IDS] = "unit_ids_in_use"
+            else:
+                data = {**self._user_input, ConfName.DEVICE_IDS: unit_ids}
+                return await self._async_create_entry(data, unit_ids)
+
+        return self.async_show_form(
+            step_id="devices",
+            data_schema=vol.Schema(
+                {
+                    vol.Required(
+                        f"{ConfName.DEVICE_IDS}",
+                        default=[
+                            unit_id for unit_id in devices if int(unit_id) not in in_use
+                        ],
+                    ): cv.multi_select(devices),
                 },
             ),
             errors=errors,
@@ -125,6 +320,10 @@ class Solaredgers485MultiOptionsFlowHandler(config_entries.OptionsFlow):
                 errors[CONF_SCAN_INTERVAL] = "invalid_scan_interval"
             elif user_input[CONF_SCAN_INTERVAL] > 86400:
                 errors[CONF_SCAN_INTERVAL] = "invalid_scan_interval"
+            elif not 1 <= user_input[ConfName.MEDIUM_POLL_CYCLES] <= 10000:
+                errors[ConfName.MEDIUM_POLL_CYCLES] = "invalid_poll_cycles"
+            elif not 1 <= user_input[ConfName.SLOW_POLL_CYCLES] <= 10000:
+                errors[ConfName.SLOW_POLL_CYCLES] = "invalid_poll_cycles"
             else:
                 return self.async_create_entry(title="", data=user_input)
 
@@ -133,6 +332,15 @@ class Solaredgers485MultiOptionsFlowHandler(config_entries.OptionsFlow):
                 CONF_SCAN_INTERVAL: self.config_entry.options.get(
                     CONF_SCAN_INTERVAL, ConfDefaultInt.SCAN_INTERVAL
                 ),
+                ConfName.MEDIUM_POLL_CYCLES: self.config_entry.options.get(
+                    ConfName.MEDIUM_POLL_CYCLES, ConfDefaultInt.MEDIUM_POLL_CYCLES
+                ),
+                ConfName.SLOW_POLL_CYCLES: self.config_entry.options.get(
+                    ConfName.SLOW_POLL_CYCLES, ConfDefaultInt.SLOW_POLL_CYCLES
+                ),
+                ConfName.CAPTURE: self.config_entry.options.get(
+                    ConfName.CAPTURE, bool(ConfDefaultFlag.CAPTURE)
+                ),
             }
 
         return self.async_show_form(
@@ -143,6 +351,18 @@ class Solaredgers485MultiOptionsFlowHandler(config_entries.OptionsFlow):
                         CONF_SCAN_INTERVAL,
                         default=user_input[CONF_SCAN_INTERVAL],
                     ): vol.Coerce(int),
+                    vol.Optional(
+                        f"{ConfName.MEDIUM_POLL_CYCLES}",
+                        default=user_input[ConfName.MEDIUM_POLL_CYCLES],
+                    ): vol.Coerce(int),
+                    vol.Optional(
+                        f"{ConfName.SLOW_POLL_CYCLES}",
+                        default=user_input[ConfName.SLOW_POLL_CYCLES],
+                    ): vol.Coerce(int),
+                    vol.Optional(
+                        f"{ConfName.CAPTURE}",
+                        default=user_input[ConfName.CAPTURE],
+                    ): cv.boolean,
                 },
             ),
             errors=errors,
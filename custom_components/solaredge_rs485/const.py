@@ -18,6 +18,10 @@ else:
 DOMAIN = "solaredge_rs485"
 DEFAULT_NAME = "SolarEdge"
 
+SERVICE_PROFILE = "profile"
+ATTR_CYCLES = "cycles"
+ATTR_TRACE_MEMORY = "trace_memory"
+
 # units missing in homeassistant core
 #ENERGY_VOLT_AMPERE_HOUR: Final = "VAh"
 #ENERGY_VOLT_AMPERE_REACTIVE_HOUR: Final = "varh"
@@ -30,9 +34,98 @@ class RetrySettings(IntEnum):
     Ratio = 2  # time multiplier between each attempt
     Limit = 4  # number of attempts before failing
 
+class PartialReadSettings(IntEnum):
+    """Reading on when some register blocks fail."""
+
+    BlockRetries = 1  # extra attempts of a failed block within the same cycle
+    MaxAgeReads = 3  # reads of its tier a value may miss before it is unavailable
+
+class TimeoutSettings(IntEnum):
+    """Answer timeout of the gateway requests, from their round trip times."""
+
+    Initial = 1000  # milliseconds, until the first answer
+    Min = 200  # bounds of the timeout derived from the round trip times
+    Max = 3000
+    VarianceFactor = 4  # timeout in RTT variations over the smoothed RTT
+    ReconnectAfter = 3  # unanswered requests in a row before reconnecting
+
+class PollTier(StrEnum):
+    """How often a register field is read."""
+
+    STATIC = "static"  # once, when the device is set up
+    FAST = "fast"
+    MEDIUM = "medium"
+    SLOW = "slow"
+
+class PublishSettings(IntEnum):
+    """When unchanged sensor states are written anyway."""
+
+    MaxSilence = 600  # seconds without a state write before a heartbeat write
+
+class ReadPlanSettings(IntEnum):
+    """Coalescing of the wanted registers into block reads."""
+
+    MaxRegisters = 50  # maximum number of registers per request
+    # Unused registers read to merge two ranges: about as many as take the time
+    # of one more round trip (request, answer overhead and turnaround) on the bus
+    MaxGap = 20
+
+class DiscoverySettings(IntEnum):
+    """Search of the gateways and of the unit IDs on a bus, see discovery.py."""
+
+    ProbeTimeout = 200  # milliseconds, until the first inverter has answered
+    MinProbeTimeout = 50  # bounds of the timeout derived from the RTT
+    MaxProbeTimeout = 500
+    RttFactor = 4  # probe timeout in round trip times of the first inverter
+    Window = 8  # probes sent back to back if the gateway queues requests
+    ConnectTimeout = 3000  # milliseconds
+    ProbeRetries = 2  # of a unit ID whose probe was lost in garbled answers
+    # Search of the gateways on the LAN
+    Concurrency = 64  # connections tried at the same time
+    GatewayConnectTimeout = 500  # milliseconds
+    VerifyTimeout = 1000  # milliseconds for the DID answer
+    MaxHosts = 1024  # largest network searched
+
+class RequestPriority(IntEnum):
+    """Order of the requests queued for a shared gateway, see broker.py."""
+
+    SETUP = 0  # reading the inverters of a hub being set up
+    POLL = 1  # poll cycles
+
+class ProfileSettings(IntEnum):
+    """Defaults and limits of the profile service."""
+
+    Cycles = 5  # poll cycles profiled by default
+    MaxCycles = 100
+    TopFunctions = 40  # rows of the profile report
+    TopAllocators = 25
+
+class CaptureSettings(IntEnum):
+    """Recording of the gateway traffic, see capture.py."""
+
+    MaxBytes = 50 * 1024 * 1024  # size of the capture file after which it stops
+
 class ConfDefaultInt(IntEnum):
     SCAN_INTERVAL = 60
     PORT = 8899
+    MEDIUM_POLL_CYCLES = 5
+    SLOW_POLL_CYCLES = 60
+    DEVICE_ID = 1
+    NUMBER_INVERTERS = 1
+
+class ConfDefaultFlag(IntEnum):
+    CAPTURE = 0
+    SCAN = 0
+
+class ConfName(StrEnum):
+    MEDIUM_POLL_CYCLES = "medium_poll_cycles"
+    SLOW_POLL_CYCLES = "slow_poll_cycles"
+    CAPTURE = "capture"
+    DEVICE_ID = "device_id"
+    NUMBER_INVERTERS = "number_of_inverters"
+    DEVICE_IDS = "device_ids"
+    SCAN = "scan"
+    SUBNET = "subnet"
 
 class SunSpecNotImpl(IntEnum):
     INT16 = 0x8000
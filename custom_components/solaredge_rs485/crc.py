@@ -0,0 +1,120 @@
+"""CRC-16/Modbus on bytes-like objects."""
+import struct
+from array import array
+
+CRC16_POLY = 0xA001
+CRC16_INIT = 0xFFFF
+
+
+def _build_table(poly=CRC16_POLY):
+    table = array("H")
+    for index in range(256):
+        data = index << 1
+        crc = 0
+        for _ in range(8, 0, -1):
+            data >>= 1
+            if (data ^ crc) & 0x0001:
+                crc = (crc >> 1) ^ poly
+            else:
+                crc >>= 1
+        table.append(crc)
+    return table
+
+
+CRC16_TABLE = _build_table()
+"""CRC-16 lookup table with 256 elements, one byte per step."""
+
+_WIDE_TABLE = None
+_WORD_STRUCTS = {}
+
+
+def _wide_table():
+    """Return the 65536 element table for two bytes per step, building it once.
+
+    The CRC is 16 bits wide, so after XOR-ing two message bytes into the register
+    the result of both steps depends only on the register value:
+    ``T[hi] ^ (T[lo] >> 8) ^ T[T[lo] & 0xFF]``. The table takes 128 kB.
+    """
+    global _WIDE_TABLE
+    if _WIDE_TABLE is None:
+        table = CRC16_TABLE
+        low = [(table[lo] >> 8) ^ table[table[lo] & 0xFF] for lo in range(256)]
+        wide = array("H", bytes(2 * 65536))
+        for hi in range(256):
+            high = table[hi]
+            base = hi << 8
+            for lo in range(256):
+                wide[base | lo] = high ^ low[lo]
+        _WIDE_TABLE = wide
+    return _WIDE_TABLE
+
+
+def _word_struct(number_of_words):
+    word_struct = _WORD_STRUCTS.get(number_of_words)
+    if word_struct is None:
+        word_struct = _WORD_STRUCTS[number_of_words] = struct.Struct(
+            f"<{number_of_words}H"
+        )
+    return word_struct
+
+
+def crc16(data, crc=CRC16_INIT):
+    """Calculate the CRC-16/Modbus of *data* (bytes, bytearray or memoryview).
+
+    Returns:
+        The CRC (int). It is sent with the least significant byte first.
+
+    """
+    table = CRC16_TABLE
+    for byte in data:
+        crc = (crc >> 8) ^ table[(crc ^ byte) & 0xFF]
+    return crc
+
+
+def crc16_wide(data, crc=CRC16_INIT):
+    """Calculate the CRC-16/Modbus of *data* two bytes per table lookup.
+
+    Gives the same result as :func:`crc16`, with half the Python-level steps, at
+    the cost of a 128 kB table built on first use.
+    """
+    table = _wide_table()
+    number_of_words = len(data) >> 1
+    if number_of_words:
+        for word in _word_struct(number_of_words).unpack_from(data):
+            crc = table[crc ^ word]
+    if len(data) & 1:
+        crc = (crc >> 8) ^ CRC16_TABLE[(crc ^ data[-1]) & 0xFF]
+    return crc
+
+
+def validate_frame(frame):
+    """Return True if the trailing (little endian) CRC of an RTU frame is correct.
+
+    Running the CRC over a frame including its own CRC gives zero when the CRC is
+    right, so the frame does not need to be sliced.
+    """
+    return len(frame) > 2 and crc16_wide(frame) == 0
+
+
+def validate_frames(frames):
+    """Validate many frames, see :func:`validate_frame`.
+
+    Returns:
+        A list of booleans, one per frame.
+
+    """
+    table = _wide_table()
+    byte_table = CRC16_TABLE
+    results = []
+    for frame in frames:
+        length = len(frame)
+        if length <= 2:
+            results.append(False)
+            continue
+        crc = CRC16_INIT
+        for word in _word_struct(length >> 1).unpack_from(frame):
+            crc = table[crc ^ word]
+        if length & 1:
+            crc = (crc >> 8) ^ byte_table[(crc ^ frame[-1]) & 0xFF]
+        results.append(crc == 0)
+    return results
@@ -0,0 +1,96 @@
+"""Diagnostics support for SolarEdge rs485.
+
+Everything is taken from what the hub keeps anyway: the last raw register
+blocks, the decoded snapshots, the metrics and the ring buffer of cycle
+traces. Nothing is read from the gateway. The registers of the redacted
+fields, e.g. the serial number, are redacted in the raw blocks as well.
+"""
+from typing import Any
+
+from homeassistant.components.diagnostics import REDACTED, async_redact_data
+from homeassistant.config_entries import ConfigEntry
+from homeassistant.const import CONF_HOST
+from homeassistant.core import HomeAssistant
+
+from .const import DOMAIN
+from .registers import FIELDS_BY_KEY
+
+TO_REDACT = {CONF_HOST, "SN", "serial", "serial_number"}
+
+# Register addresses of the redacted fields
+REDACTED_REGISTERS = frozenset(
+    address
+    for key in TO_REDACT
+    if key in FIELDS_BY_KEY
+    for address in range(
+        FIELDS_BY_KEY[key].address,
+        FIELDS_BY_KEY[key].address + FIELDS_BY_KEY[key].width,
+    )
+)
+
+
+def _registers(block) -> str:
+    """Return the registers of *block* in hex, the redacted ones replaced."""
+    data = block.registerdata
+    return " ".join(
+        REDACTED
+        if block.address + index in REDACTED_REGISTERS
+        else data[2 * index : 2 * index + 2].hex()
+        for index in range(block.count)
+    )
+
+
+def _raw_blocks(inverter) -> list[dict[str, Any]]:
+    return [
+        {
+            "address": block.address,
+            "count": block.count,
+            "read_at": read_at,
+            "registers": _registers(block),
+        }
+        for _, (read_at, block) in sorted(inverter.raw_blocks.items())
+    ]
+
+
+def _inverter_diagnostics(inverter) -> dict[str, Any]:
+    return {
+        "unit_id": inverter.inverter_unit_id,
+        "identity": {
+            "manufacturer": inverter.manufacturer,
+            "model": getattr(inverter, "model", None),
+            "fw_version": getattr(inverter, "fw_version", None),
+            "serial": getattr(inverter, "serial", None),
+        },
+        "last_read_duration": inverter.last_read_duration,
+        "read_duration": inverter.read_duration.as_dict(),
+        "raw_blocks": _raw_blocks(inverter),
+        "snapshot": inverter.snapshot.as_dict(),
+    }
+
+
+async def async_get_config_entry_diagnostics(
+    hass: HomeAssistant, config_entry: ConfigEntry
+) -> dict[str, Any]:
+    """Return diagnostics for a config entry."""
+    hub = hass.data[DOMAIN][config_entry.entry_id]["hub"]
+
+    data = {
+        "entry": {
+            "data": config_entry.data,
+            "options": config_entry.options,
+        },
+        "hub": {
+            "online": hub.online,
+            "initialized": hub.initalized,
+            "cycle": hub._cycle,
+        },
+        "inverters": [_inverter_diagnostics(inverter) for inverter in hub.inverters],
+        "poll_metrics": hub.metrics.as_dict(),
+        "transport_metrics": hub.transport_metrics.as_dict(),
+        "queue_metrics": hub.queue_metrics.as_dict(),
+        "request_timeout": hub.request_timeout.as_dict()
+        if hub.request_timeout is not None
+        else None,
+        "cycle_traces": [trace.as_dict() for trace in hub.metrics.traces],
+    }
+    return async_redact_data(data, TO_REDACT)
@@ -0,0 +1,384 @@
+"""Discovery of the gateways on the LAN and of the inverters behind a gateway.
+
+Gateways: every host of a network is tried with a TCP connect to the gateway
+port, DiscoverySettings.Concurrency at a time with a short connect timeout.
+The hosts that accept the connection are asked for the DID of the inverters at
+GATEWAY_UNIT_IDS, one unit ID at a time until an answer comes. Any well-formed
+Modbus answer proves a gateway, including an exception such as "gateway target
+device failed to respond" when no inverter is at those unit IDs; other devices
+listening on the port are left out.
+
+Inverters: every unit ID is probed with a read of one register, the SunSpec
+DID. Unit IDs without an inverter do not answer, so a scan costs one probe
+timeout per empty address, and the probe timeout is kept short:
+
+- The probes go one at a time until the first inverter answers. Its round trip
+  time sets the timeout of the remaining probes: a few times the RTT, within
+  the bounds of DiscoverySettings.
+- That inverter is then sent a burst of probes back to back. If it answers all
+  of them, the gateway queues requests, and the remaining unit IDs are probed
+  DiscoverySettings.Window at a time, with one timeout per burst. Gateways that
+  pass the bytes straight to the bus garble such bursts; they are probed one at
+  a time.
+
+The probes left unanswered when the answers are garbled are sent again, up to
+DiscoverySettings.ProbeRetries times each, whatever the size of the burst.
+
+An answer arriving after its probe timed out still counts, and the scan waits a
+little after the last burst for such answers.
+"""
+import asyncio
+import contextlib
+import logging
+import time
+from collections import deque
+
+from .const import DiscoverySettings
+from .crc import validate_frame
+from .registers import FIELDS_BY_KEY
+from .rs485eth import build_read_request
+
+_LOGGER = logging.getLogger(__name__)
+
+DID_REGISTER = FIELDS_BY_KEY["C_SunSpec_DID"].address
+MAX_UNIT_ID = 247
+
+GATEWAY_UNIT_IDS = (1, 2, 3)  # asked for their DID by the gateway search
+
+_ANSWER_SIZE = 7  # slave address, function code, byte count, one register, CRC
+_EXCEPTION_SIZE = 5  # slave address, function code, exception code, CRC
+_EXCEPTION_BIT = 0x80
+_HEADER_SIZE = 3  # slave address, function code, byte count or exception code
+_READ_INPUT_REGISTERS = 4
+
+
+async def async_find_gateways(
+    network, port, unit_ids=GATEWAY_UNIT_IDS, exclude=(), concurrency=None
+) -> dict:
+    """Search a network for Modbus gateways.
+
+    Args:
+        network (ipaddress.IPv4Network): The network to search.
+        port (int): The TCP port of the gateways.
+        unit_ids: The unit IDs asked for their DID, in turn.
+        exclude: Hosts not to connect to, e.g. the gateways already in use;
+            most gateways take one connection at a time.
+        concurrency (int): Connections tried at the same time, by default
+            DiscoverySettings.Concurrency.
+
+    Returns:
+        The DID read through each gateway found, by host; None for a gateway
+        that answered with a Modbus exception.
+
+    """
+    started = time.monotonic()
+    semaphore = asyncio.Semaphore(
+        DiscoverySettings.Concurrency if concurrency is None else concurrency
+    )
+    exclude = set(exclude)
+
+    async def check(host):
+        async with semaphore:
+            return host, await _async_probe_gateway(host, port, unit_ids)
+
+    results = await asyncio.gather(
+        *(
+            check(str(host))
+            for host in network.hosts()
+            if str(host) not in exclude
+        )
+    )
+    found = {host: did for host, (is_gateway, did) in results if is_gateway}
+    _LOGGER.info(
+        f"Searched {network} for gateways on port {port} in "
+        + f"{time.monotonic() - started:.1f} s, found {sorted(found)}"
+    )
+    return found
+
+
+async def _async_probe_gateway(host, port, unit_ids):
+    """Ask the host at *host* for the DID of the inverters at *unit_ids*.
+
+    Returns:
+        (True, DID) for the first inverter answering, (True, None) if the host
+        answered with a Modbus exception, (False, None) if it is not a gateway.
+
+    """
+    try:
+        reader, writer = await asyncio.wait_for(
+            asyncio.open_connection(host, port),
+            DiscoverySettings.GatewayConnectTimeout / 1000,
+        )
+    except (OSError, asyncio.TimeoutError):
+        return False, None
+
+    asked = set()
+    try:
+        for unit_id in unit_ids:
+            asked.add(unit_id)
+            writer.write(build_read_request(unit_id, DID_REGISTER, 1))
+            try:
+                answer = await asyncio.wait_for(
+                    _read_answer(reader), DiscoverySettings.VerifyTimeout / 1000
+                )
+            except asyncio.TimeoutError:
+                continue  # no inverter at this unit ID, or not a gateway
+            # A late answer to an earlier probe proves the gateway as well
+            if answer is None or answer[0] not in asked:
+                break
+            if answer[1] & _EXCEPTION_BIT:
+                _LOGGER.debug(
+                    f"{host}:{port} answered unit {answer[0]} with exception "
+                    + f"{answer[2]}"
+                )
+                return True, None
+            if answer[2] == 2:
+                return True, int.from_bytes(answer[3:5], "big")
+            break
+    except (OSError, asyncio.IncompleteReadError):
+        pass
+    finally:
+        writer.close()
+        with contextlib.suppress(OSError):
+            await writer.wait_closed()
+
+    _LOGGER.debug(f"{host}:{port} accepts connections, but not a gateway")
+    return False, None
+
+
+async def _read_answer(reader):
+    """Read a Modbus RTU answer to a read request, None if it is not one."""
+    header = await reader.readexactly(_HEADER_SIZE)
+    if header[1] == _READ_INPUT_REGISTERS | _EXCEPTION_BIT:
+        answer = header + await reader.readexactly(_EXCEPTION_SIZE - _HEADER_SIZE)
+    elif header[1] == _READ_INPUT_REGISTERS:
+        answer = header + await reader.readexactly(header[2] + 2)
+    else:
+        return None
+    return answer if validate_frame(answer) else None
+
+
+async def async_scan_unit_ids(
+    host, port, unit_ids=range(1, MAX_UNIT_ID + 1), timeout=None, window=None
+) -> dict:
+    """Probe the unit IDs on the bus behind a gateway, see :class:`UnitScan`.
+
+    Returns:
+        The DID of every inverter that answered, by unit ID.
+
+    Raises:
+        OSError, asyncio.TimeoutError when the gateway cannot be reached.
+
+    """
+    return await UnitScan(host, port, timeout=timeout, window=window).run(unit_ids)
+
+
+class UnitScan:
+    """A scan of the unit IDs on the bus behind a gateway.
+
+    Args:
+        host (str): The host name or IP address of the gateway.
+        port (int): The TCP port of the gateway.
+        timeout (float): Seconds to wait for each answer; by default
+            DiscoverySettings.ProbeTimeout until the first answer, then
+            derived from its round trip time.
+        window (int): Number of probes sent back to back; by default 1 until
+            the gateway has been found to queue requests.
+
+    """
+
+    def __init__(self, host, port, timeout=None, window=None):
+        self.host = host
+        self.port = port
+        self._fixed_timeout = timeout is not None
+        self.timeout = (
+            DiscoverySettings.ProbeTimeout / 1000 if timeout is None else timeout
+        )
+        self._fixed_window = window is not None
+        self.window = 1 if window is None else window
+        self.found = {}
+        self.probes = 0
+        self._rtt = None
+        self._reader = None
+        self._writer = None
+        self._receiver = None
+        self._garbled = False
+        self._answers = asyncio.Queue()  # (time received, unit ID, DID or None)
+
+    async def run(self, unit_ids) -> dict:
+        """Probe *unit_ids*, returning the DID of the inverters by unit ID."""
+        started = time.monotonic()
+        pending = deque(unit_ids)
+        retries = {}  # of the probes lost in garbled answers, by unit ID
+        await self._connect()
+        try:
+            while pending:
+                if self._garbled:
+                    await self._reconnect()
+                if self.found and not self._fixed_window and self.window == 1:
+                    await self._calibrate(next(iter(self.found)))
+                    self._fixed_window = True
+                count = min(self.window, len(pending))
+                batch = [pending.popleft() for _ in range(count)]
+                unanswered = await self._probe(batch)
+                if not self._garbled:
+                    continue
+                if len(batch) > 1:
+                    _LOGGER.debug("Garbled answers to a burst of probes, one at a time")
+                    self.window = 1
+                # An answer may have been lost in the garbled bytes
+                again = [
+                    unit
+                    for unit in unanswered
+                    if retries.get(unit, 0) < DiscoverySettings.ProbeRetries
+                ]
+                for unit in again:
+                    retries[unit] = retries.get(unit, 0) + 1
+                pending.extendleft(reversed(again))
+            if self.window > 1:
+                await self._wait(None, time.monotonic() + self.timeout * self.window)
+            self._collect()
+        finally:
+            await self._close()
+
+        _LOGGER.info(
+            f"Scanned {self.probes} unit IDs on {self.host}:{self.port} in "
+            + f"{time.monotonic() - started:.1f} s, found {sorted(self.found)}"
+        )
+        return dict(sorted(self.found.items()))
+
+    async def _calibrate(self, unit):
+        """Set the timeout and window from the inverter found at *unit*."""
+        if not self._fixed_timeout and self._rtt is not None:
+            self.timeout = min(
+                DiscoverySettings.MaxProbeTimeout / 1000,
+                max(
+                    DiscoverySettings.MinProbeTimeout / 1000,
+                    DiscoverySettings.RttFactor * self._rtt,
+                ),
+            )
+        burst = [unit] * DiscoverySettings.Window
+        unanswered = await self._probe(burst)
+        if unanswered or self._garbled:
+            self._garbled = True  # drop what is left of the burst
+        else:
+            self.window = DiscoverySettings.Window
+        _LOGGER.debug(
+            f"Probe timeout {self.timeout * 1000:.0f} ms, window {self.window}"
+        )
+
+    async def _probe(self, units) -> list:
+        """Send a probe to every unit in *units*, back to back.
+
+        An answer may come after the answers to the probes before it, so every
+        extra probe adds a round trip time of the first inverter to the timeout.
+
+        Returns:
+            The units that did not answer within the timeout.
+
+        """
+        sent = time.monotonic()
+        for unit in units:
+            self._writer.write(build_read_request(unit, DID_REGISTER, 1))
+        self.probes += len(units)
+        await self._writer.drain()
+        deadline = sent + self.timeout + (len(units) - 1) * (self._rtt or 0)
+        return await self._wait(
+            list(units), deadline, sent if len(units) == 1 else None
+        )
+
+    async def _wait(self, waiting, deadline, sent=None):
+        """Record the answers until *waiting* have answered or the deadline.
+
+        Args:
+            waiting (list): The units to wait for, None to wait until the
+                deadline.
+            deadline (float): The time.monotonic() to stop waiting at.
+            sent (float): When the probe was sent, to measure the round trip
+                time of a single probe.
+
+        Returns:
+            The units in *waiting* that did not answer.
+
+        """
+        while (waiting is None or waiting) and not self._garbled:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                answer = await asyncio.wait_for(self._answers.get(), remaining)
+            except asyncio.TimeoutError:
+                break
+            if answer is None:  # garbled, see _receive
+                break
+            received, unit, did = answer
+            self._record(unit, did)
+            if waiting is not None and unit in waiting:
+                waiting.remove(unit)
+                if sent is not None:
+                    self._rtt = received - sent
+        return waiting
+
+    def _collect(self):
+        """Record the answers received after their probe timed out."""
+        while not self._answers.empty():
+            answer = self._answers.get_nowait()
+            if answer is not None:
+                self._record(*answer[1:])
+
+    def _record(self, unit, did):
+        if did is not None and unit not in self.found:
+            _LOGGER.debug(f"Unit ID {unit} answered with DID {did}")
+            self.found[unit] = did
+
+    async def _receive(self):
+        """Parse the answers from the gateway into the answer queue."""
+        reader = self._reader
+        try:
+            while True:
+                header = await reader.readexactly(2)
+                if header[1] & _EXCEPTION_BIT:
+                    frame = header + await reader.readexactly(_EXCEPTION_SIZE - 2)
+                else:
+                    frame = header + await reader.readexactly(_ANSWER_SIZE - 2)
+                if not validate_frame(frame) or (
+                    len(frame) == _ANSWER_SIZE and frame[2] != 2
+                ):
+                    # Out of step with the frames; the connection is reopened
+                    break
+                # An exception answer comes from a device that is not an
+                # inverter, it is not recorded
+                did = None
+                if len(frame) == _ANSWER_SIZE:
+                    did = int.from_bytes(frame[3:5], "big")
+                self._answers.put_nowait((time.monotonic(), frame[0], did))
+        except (asyncio.IncompleteReadError, OSError):
+            pass
+        self._garbled = True
+        self._answers.put_nowait(None)
+
+    async def _connect(self):
+        self._reader, self._writer = await asyncio.wait_for(
+            asyncio.open_connection(self.host, self.port),
+            DiscoverySettings.ConnectTimeout / 1000,
+        )
+        self._garbled = False
+        self._receiver = asyncio.create_task(self._receive())
+
+    async def _reconnect(self):
+        await self._close()
+        await self._connect()
+
+    async def _close(self):
+        if self._receiver is not None:
+            self._receiver.cancel()
+            with contextlib.suppress(asyncio.CancelledError):
+                await self._receiver
+            self._receiver = None
+        if self._writer is not None:
+            self._writer.close()
+            with contextlib.suppress(OSError):
+                await self._writer.wait_closed()
+            self._writer = None
+        # answers of the old connection must not end a probe on the new one
+        self._collect()
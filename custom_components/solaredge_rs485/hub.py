@@ -1,13 +1,33 @@
+import asyncio
 import logging
 import threading
-from collections import OrderedDict
+import time
 from typing import Any, Dict, Optional
 
 from homeassistant.core import HomeAssistant
-
-from .rs485eth import Instrument
-
-from .const import DOMAIN
+from homeassistant.util import dt as dt_util
+
+from .broker import acquire_broker
+from .capture import CaptureWriter
+from .rs485eth import rs485Exception
+
+from .const import (
+    DOMAIN,
+    ConfDefaultInt,
+    PartialReadSettings,
+    PollTier,
+    ReadPlanSettings,
+    RequestPriority,
+)
+from .metrics import (
+    CYCLE_DURATION_BUCKETS,
+    CycleTrace,
+    Histogram,
+    PollMetrics,
+    QueueMetrics,
+    TransportMetrics,
+)
+from .registers import RegisterMap, RegisterSnapshot, fields_for_tiers
 
 _LOGGER = logging.getLogger(__name__)
 _LOGGER.setLevel(logging.DEBUG)
@@ -65,43 +85,104 @@ class SolarEdgers485MultiHub:
         name: str,
         host: str,
         port: int,
+        max_read_registers: int = ReadPlanSettings.MaxRegisters,
+        max_read_gap: int = ReadPlanSettings.MaxGap,
+        medium_poll_cycles: int = ConfDefaultInt.MEDIUM_POLL_CYCLES,
+        slow_poll_cycles: int = ConfDefaultInt.SLOW_POLL_CYCLES,
+        capture_path: Optional[str] = None,
+        inverter_unit_ids=(1,),
     ):
-        """Initialize the rs485 hub."""
+        """Initialize the rs485 hub.
+
+        All inverters in *inverter_unit_ids* are daisy-chained on the RS485 bus
+        behind the gateway and polled over its one connection. That connection
+        is shared with the other hubs on the same gateway, see broker.py.
+        """
         self._hass = hass
         self._name = name
         self._host = host
         self._port = port
         self._lock = threading.Lock()
         self._id = name.lower()
-        self._coordinator_timeout = 30
+        self.inverter_unit_ids = tuple(inverter_unit_ids)
+        self._coordinator_timeout = 30 * len(self.inverter_unit_ids)
         self._client = None
         self._id = name.lower()
         self._lock = threading.Lock()
         self.inverters = []
+        self.common_map = RegisterMap(
+            fields_for_tiers([PollTier.STATIC]),
+            max_registers=max_read_registers,
+            max_gap=max_read_gap,
+        )
+        # A read plan for every combination of tiers that can be due together.
+        # Round trips cost more than registers: a combination needing more
+        # requests than the whole model reads the whole model instead.
+        full_tiers = frozenset([PollTier.FAST, PollTier.MEDIUM, PollTier.SLOW])
+        full_map = RegisterMap(
+            fields_for_tiers(full_tiers),
+            max_registers=max_read_registers,
+            max_gap=max_read_gap,
+        )
+        self.model_maps = {full_tiers: full_map}
+        for tiers in (
+            {PollTier.FAST},
+            {PollTier.FAST, PollTier.MEDIUM},
+            {PollTier.FAST, PollTier.SLOW},
+        ):
+            tier_map = RegisterMap(
+                fields_for_tiers(tiers),
+                max_registers=max_read_registers,
+                max_gap=max_read_gap,
+            )
+            if len(tier_map.blocks) > len(full_map.blocks):
+                tier_map = full_map
+            self.model_maps[frozenset(tiers)] = tier_map
+        self._medium_poll_cycles = max(1, medium_poll_cycles)
+        self._slow_poll_cycles = max(1, slow_poll_cycles)
+        self._cycle = 0
+        self._slow_read_date = None
+        self.metrics = PollMetrics()
+        # Replaced by those of the gateway broker when connecting
+        self.transport_metrics = TransportMetrics()
+        self.queue_metrics = QueueMetrics()
+        self.capture = None if capture_path is None else CaptureWriter(capture_path)
 
         self.initalized = False
         self._online = False
 
     async def _async_init_solaredge(self) -> None:
-        inverter_unit_id = 1
-
+        # Setting up goes before the poll cycles of the other hubs on the gateway
+        self._client.priority = RequestPriority.SETUP
         try:
-            new_inverter = SolarEdgeInverter(inverter_unit_id, self)
-            await self._hass.async_add_executor_job(new_inverter.init_device)
-            self.inverters.append(new_inverter)
+            await self._async_init_inverters()
+        finally:
+            self._client.priority = RequestPriority.POLL
+
+    async def _async_init_inverters(self) -> None:
+        # Only a complete setup is kept, a retry starts from scratch
+        inverters = []
+        for inverter_unit_id in self.inverter_unit_ids:
+            try:
+                new_inverter = SolarEdgeInverter(inverter_unit_id, self)
+                await new_inverter.init_device()
+                inverters.append(new_inverter)
 
-        except rs485ReadError as e:
-            _LOGGER.debug("---------------1---------------------------")
-            raise HubInitFailed(f"{e}")
+            except rs485ReadError as e:
+                raise HubInitFailed(f"Inverter device ID {inverter_unit_id}: {e}")
 
-        except DeviceInvalid as e:
-            """Inverters are required"""
-            _LOGGER.error(f"Inverter device ID {inverter_unit_id}: {e}")
-            raise HubInitFailed(f"{e}")
+            except DeviceInvalid as e:
+                """Inverters are required"""
+                _LOGGER.error(f"Inverter device ID {inverter_unit_id}: {e}")
+                raise HubInitFailed(f"{e}")
 
         try:
-            for inverter in self.inverters:
-                await self._hass.async_add_executor_job(inverter.read_rs485_data)
+            for inverter in inverters:
+                data = await inverter.read_rs485_data()
+                if len(data.errors) == len(data.blocks):
+                    raise rs485ReadError(
+                        f"No register block could be read: {data.errors}"
+                    )
 
         except rs485ReadError as e:
             self._online = False
@@ -115,6 +196,7 @@ class SolarEdgers485MultiHub:
             self._online = False
             raise HubInitFailed(f"Connection failed: {e}")
 
+        self.inverters = inverters
         self.initalized = True
 
     async def async_refresh_rs485_data(self, _now: Optional[int] = None) -> bool:
@@ -129,9 +211,31 @@ class SolarEdgers485MultiHub:
                 raise HubInitFailed(f"Setup failed: {e}")
 
         self._online = True
+        tiers = self._due_tiers()
+        trace = CycleTrace(dt_util.utcnow(), sorted(tiers))
+        phases = self.transport_metrics.phase_times()
+        requests = self.transport_metrics.requests
+        decode_time = self.metrics.decode_time
+        started = time.monotonic()
+        success = False
         try:
-            for inverter in self.inverters:
-                await self._hass.async_add_executor_job(inverter.read_rs485_data)
+            blocks = failed = 0
+            read = await self._read_inverters(tiers)
+            for inverter, data in zip(self.inverters, read):
+                trace.inverters[inverter.inverter_unit_id] = inverter.last_read_duration
+                blocks += len(data.blocks)
+                failed += len(data.errors)
+            if failed:
+                self.metrics.failed_blocks += failed
+                if failed == blocks:
+                    raise rs485ReadError(
+                        f"None of the {blocks} register blocks could be read"
+                    )
+                _LOGGER.warning(
+                    f"{failed} of {blocks} register blocks failed, "
+                    + "their fields keep the last values read"
+                )
+            success = True
 
         except rs485ReadError as e:
             self._online = False
@@ -145,8 +249,80 @@ class SolarEdgers485MultiHub:
             self._online = False
             raise DataUpdateFailed(f"Connection failed: {e}")
 
+        finally:
+            self.metrics.add_cycle(time.monotonic() - started, success)
+            trace.success = success
+            trace.requests = self.transport_metrics.requests - requests
+            trace.connect, trace.send, trace.receive = (
+                after - before
+                for after, before in zip(self.transport_metrics.phase_times(), phases)
+            )
+            trace.decode = self.metrics.decode_time - decode_time
+            self.metrics.traces.append(trace)
+            if self.capture is not None:
+                await self._hass.async_add_executor_job(self.capture.flush)
+
+        self._cycle += 1
+        if PollTier.SLOW in tiers:
+            self._slow_read_date = dt_util.now().date()
+
         return True
 
+    async def _read_inverters(self, tiers: frozenset) -> list:
+        """Read all inverters, interleaving their requests on the bus.
+
+        The reads run concurrently and queue for the gateway connection,
+        which serves the requests of a hub in their order: the first
+        block of every inverter is read, then the second, and so on. An
+        inverter with many blocks or failing reads does not hold the others
+        back until it is done. The inverter that goes first rotates with the
+        cycles, so none of them is always last.
+
+        Returns:
+            The RegisterData read from each inverter, in the order of
+            ``inverters``.
+
+        """
+        count = len(self.inverters)
+        if count == 1:
+            return [await self.inverters[0].read_rs485_data(tiers)]
+        first = self._cycle % count
+        order = list(range(first, count)) + list(range(first))
+        read = await asyncio.gather(
+            *(self.inverters[index].read_rs485_data(tiers) for index in order)
+        )
+        results = [None] * count
+        for index, data in zip(order, read):
+            results[index] = data
+        return results
+
+    def poll_cycles(self, tier: PollTier) -> Optional[int]:
+        """Return every how many cycles a tier is read, None if only once."""
+        if tier == PollTier.STATIC:
+            return None
+        if tier == PollTier.MEDIUM:
+            return self._medium_poll_cycles
+        if tier == PollTier.SLOW:
+            return self._slow_poll_cycles
+        return 1
+
+    def _due_tiers(self) -> frozenset:
+        """Return the poll tiers to read in this cycle.
+
+        The fast tier is read every cycle, the medium and slow tiers every N
+        cycles. The slow tier is also read on the first cycle of a new day, so
+        the day, month and year counters roll over on time.
+        """
+        tiers = {PollTier.FAST}
+        if self._cycle % self._medium_poll_cycles == 0:
+            tiers.add(PollTier.MEDIUM)
+        if (
+            self._cycle % self._slow_poll_cycles == 0
+            or self._slow_read_date != dt_util.now().date()
+        ):
+            tiers.add(PollTier.SLOW)
+        return frozenset(tiers)
+
     @property
     def online(self):
         return self._online
@@ -176,16 +352,25 @@ class SolarEdgers485MultiHub:
 #    def battery_rating_adjust(self) -> int:
 #        return (self._battery_rating_adjust + 100) / 100
 
+    @property
+    def request_timeout(self):
+        """Return the RequestTimeout of the gateway, None until connected."""
+        if self._client is None:
+            return None
+        return self._client.request_timeout
+
     @property
     def coordinator_timeout(self) -> int:
         _LOGGER.debug(f"coordinator timeout is {self._coordinator_timeout}")
         return self._coordinator_timeout
 
     async def connect(self) -> None:
-        """Connect rs485 client."""
+        """Connect rs485 client, through the broker of the gateway."""
         if self._client is None:
-            self._client = Instrument(eth_address=self._host,
-                                      eth_port=self._port)
+            broker = acquire_broker(self._host, self._port)
+            self.transport_metrics = broker.metrics
+            self.queue_metrics = broker.queue.metrics
+            self._client = broker.client(capture=self.capture)
 
     def is_socket_open(self) -> bool:
 #        """Check rs485 client connection status."""
@@ -198,8 +383,11 @@ class SolarEdgers485MultiHub:
     async def shutdown(self) -> None:
         """Shut down the hub."""
         self._online = False
-        # #await self.disconnect()
+        if self._client is not None:
+            await self._client.close()
         self._client = None
+        if self.capture is not None:
+            await self._hass.async_add_executor_job(self.capture.flush)
 
 class SolarEdgeInverter:
     _delta_energy = 0
@@ -207,19 +395,26 @@ class SolarEdgeInverter:
         self.inverter_unit_id = device_id
         self.hub = hub
         self.decoded_common = []
-        self.decoded_model = []
+        self.snapshot = RegisterSnapshot()
+        self._model_read = False
         self.decoded_mmppt = []
         self.decoded_storage = []
+        # (time read, block) of the last raw block at each address, for diagnostics
+        self.raw_blocks = {}
         self.has_parent = False
         self.global_power_control = None
+        # Seconds from the start of its read in a cycle until its blocks are in,
+        # including the time waiting for the bus
+        self.last_read_duration = None
+        self.read_duration = Histogram(CYCLE_DURATION_BUCKETS)
 #        self.site_limit_control = None
         self.manufacturer = "SolarEdge"
         self._delta_energy = 0
 
-    def init_device(self) -> None:
+    async def init_device(self) -> None:
 
         _LOGGER.debug("init_device")
-        self.read_rs485_data_common()
+        await self.read_rs485_data_common()
 
         #self.manufacturer = self.decoded_common["C_Manufacturer"]
         self.manufacturer = "SolarEdge"
@@ -234,56 +429,67 @@ class SolarEdgeInverter:
         self.device_address = f"{self.hub._host}:{self.hub._port}"
 
         #self.name = f"{self.hub.hub_id.capitalize()} I{self.inverter_unit_id}"
-        self.uid_base = f"{self.hub.hub_id.capitalize()} I"
-        + self.decoded_common["C_SunSpec_DID"]
+        # The first inverter keeps the ids it had before more unit IDs could be
+        # polled, so existing entities and devices stay as they are
+        if self.inverter_unit_id == 1:
+            self.uid_base = f"{self.hub.hub_id.capitalize()} I"
+            identifier = int(self.decoded_common["C_SunSpec_DID"])
+            name = self.device_address
+        else:
+            self.uid_base = f"{self.hub.hub_id.capitalize()} I{self.inverter_unit_id}"
+            identifier = f"{self.hub.hub_id}_{self.inverter_unit_id}"
+            name = f"{self.device_address} #{self.inverter_unit_id}"
 
         self._device_info = {
-            "identifiers": {(DOMAIN, int(self.decoded_common["C_SunSpec_DID"]))},
-            "name": self.device_address,
+            "identifiers": {(DOMAIN, identifier)},
+            "name": name,
             "manufacturer": "SolarEdge",
             "model": self.model,
             "sw_version": self.fw_version,
             #"hw_version": self.option,
         }
 
-    def getValueLong(self, addr, signed=False,
+    async def getValueLong(self, addr, signed=False,
                      numberOfDecimals=6):
         #_LOGGER.debug("getValueLong")
         #_LOGGER.debug(addr)
-        return self.hub._client._generic_command(
+        return await self.hub._client._generic_command(
             registeraddress=addr,
             numberOfDecimals=numberOfDecimals,
             number_of_registers=2,
             signed=signed,
             byteorder=0,
             payloadformat="long",
+            slaveaddress=self.inverter_unit_id,
         )
 
-    def getValueInt(self, addr, signed=False,
+    async def getValueInt(self, addr, signed=False,
                      numberOfDecimals=1):
         #_LOGGER.debug("getValueInt")
         #_LOGGER.debug(addr)
-        return self.hub._client._generic_command(
+        return await self.hub._client._generic_command(
             registeraddress=addr,
             numberOfDecimals=numberOfDecimals,
             number_of_registers=1,
             signed=signed,
             byteorder=1,
             payloadformat="int",
+            slaveaddress=self.inverter_unit_id,
         )
         
-    def getValueRegister(self, addr, numberOfDecimals=0,
+    async def getValueRegister(self, addr, numberOfDecimals=0,
                          signed=False, number_of_registers=1):
-        return self.hub._client._generic_command(
+        return await self.hub._client._generic_command(
             registeraddress=addr,
             numberOfDecimals=numberOfDecimals,
             number_of_registers=number_of_registers,
             signed=signed,
             payloadformat="register",
+            slaveaddress=self.inverter_unit_id,
         )
 
 #    def getValueString(self, addr, functioncode=3, number_of_registers=4):
-#        return self.hub._client._generic_command(
+#        return await self.hub._client._generic_command(
 #            functioncode=functioncode,
 #            registeraddress=addr,
 #            number_of_registers=number_of_registers,
@@ -293,66 +499,77 @@ class SolarEdgeInverter:
     def round(self, floatval):
         return round(floatval, 2)
 
-    def read_rs485_data_common(self) -> None:
+    async def read_rs485_data_common(self) -> None:
         #_LOGGER.debug("read_rs485_data")
 
         try:
-            C_SunSpec_DID = self.getValueRegister(3000,
-                                        signed=False)
+            data = await self.hub._client.read_blocks(
+                self.hub.common_map.blocks, slaveaddress=self.inverter_unit_id
+            )
 
-        except ConnectionException as e:
+        except (ConnectionException, rs485Exception) as e:
             _LOGGER.error(f"Connection error: {e}")
             self._online = False
             raise rs485ReadError(f"{e}")
 
-        self.decoded_common = OrderedDict(
-            [
-                ("C_SunSpec_DID", C_SunSpec_DID),
-                ("SN", self.getValueRegister(3062)),
-            ]
-        )
+        self.snapshot = self.hub.common_map.update(self.snapshot, data)
+        self.decoded_common = self.snapshot.as_dict()
+        read_at = dt_util.utcnow()
+        for block in data.blocks:
+            self.raw_blocks[block.address] = (read_at, block)
+
+    async def read_rs485_data(self, tiers: Optional[frozenset] = None):
+        """Read the fields of the due tiers and update the snapshot.
 
-    def read_rs485_data(self) -> None:
+        Blocks that fail are read again once more; fields of blocks that still
+        fail keep their last value and the time it was read.
+
+        Returns:
+            The RegisterData read, with the errors of the failed blocks.
+
+        """
         # _LOGGER.debug("read_rs485_data")
 
-        # https://ginlongsolis.freshdesk.com/helpdesk/attachments/36112313359
-
-        self.decoded_model = OrderedDict(
-            [
-                ("ac_power_output", self.getValueLong(3004) * 1000), # 3005
-
-                ("dc_output_power", self.getValueLong(3006) * 1000), # 3007
-                ("ac_generated_lifetimeproduction", 
-                                    self.getValueLong(3008) * 1000000), # 3009
-                ("ac_energy_wh",  self.getValueLong(3009)),
-                ("ac_generated_monthenergy",  self.getValueLong(3011)), # 3011
-                ("ac_generated_lastmonth",  self.getValueLong(3013)), # 3013
-                ("ac_generated_yearenergy",  self.getValueLong(3017)), # 3017
-                ("ac_generated_lastyear",  self.getValueLong(3019)), # 3019
-
-                ("ac_generated_today", self.getValueInt(3014) /10), # 3015
-                ("ac_generated_yesterday", self.getValueInt(3015) / 10), # 3016
-                ("dc_voltage_1", self.getValueInt(3021)), # 3022 U16
-                ("dc_current_1", self.getValueInt(3022)), # 3023 U16
-                ("dc_voltage_2", self.getValueInt(3023)), # 3024 U16
-                ("dc_current_2", self.getValueInt(3024)), # 3025 U16
-                ("ac_voltage_ab", self.getValueInt(3033)), # 3034 U16
-                ("ac_voltage_bc", self.getValueInt(3034)), # 3035 U16
-                ("ac_voltage_ca", self.getValueInt(3035)), # 3036 U16
-                ("ac_current_a", self.getValueInt(3036)), # 3037 U16
-                ("ac_current_b", self.getValueInt(3037)), # 3038 U16
-                ("ac_current_c", self.getValueInt(3038)), # 3039 U16
-                ("i_temp_sink", self.getValueInt(3041, signed=True)), # 3042 U16
-                ("ac_frequency", self.getValueInt(3042, numberOfDecimals=2)), # 3043 U16
-                ("i_status",  self.getValueInt(3071, numberOfDecimals=0)), # 3072 U16
-                ("i_status_vendor",  self.getValueInt(3043, 
-                                                      numberOfDecimals=0)), # 3044 U16
-            ]
-        )
+        if tiers is None or not self._model_read:
+            tiers = frozenset([PollTier.FAST, PollTier.MEDIUM, PollTier.SLOW])
+        model_map = self.hub.model_maps[tiers]
 
-        self.hub._online = True
+        started = time.monotonic()
+        data = await self.hub._client.read_blocks(
+            model_map.blocks,
+            partial=True,
+            retries=PartialReadSettings.BlockRetries,
+            slaveaddress=self.inverter_unit_id,
+        )
+        decoding = time.monotonic()
+        self.last_read_duration = decoding - started
+        self.read_duration.add(self.last_read_duration)
+        self.snapshot = model_map.update(self.snapshot, data, decoding)
+        self.hub.metrics.decode_time += time.monotonic() - decoding
+        read_at = dt_util.utcnow()
+        for block in data.blocks:
+            if block is not None:
+                self.raw_blocks[block.address] = (read_at, block)
+        for index, error in data.errors.items():
+            block = model_map.blocks[index]
+            _LOGGER.debug(
+                f"Inverter {self.inverter_unit_id}: reading {block.count} registers "
+                + f"from {block.address} failed: {error}"
+            )
+        # The whole model is read until every block of it has been read once
+        if data.complete:
+            self._model_read = True
+
+        if len(data.errors) < len(data.blocks):
+            self.hub._online = True
 #        _LOGGER.debug(f"Inverter: {self.decoded_common}")
-        _LOGGER.debug(f"Inverter: {self.decoded_model}")
+        _LOGGER.debug("Inverter: %s", self.snapshot)
+        return data
+
+    @property
+    def decoded_model(self) -> Dict[str, Any]:
+        """Decoded values by field key, for logging and diagnostics."""
+        return self.snapshot.as_dict()
 
     @property
     def online(self) -> bool:
@@ -0,0 +1,270 @@
+"""Rolling metrics of the gateway connection and the poll cycles.
+
+Everything is aggregated in constant memory: counters, histograms with fixed
+buckets and windows of the most recent samples. Adding a sample is a few
+integer operations, the percentiles are only worked out when they are read.
+"""
+from bisect import bisect_left
+from collections import deque
+
+# Upper bounds of the cycle duration buckets, in seconds
+CYCLE_DURATION_BUCKETS = (0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+RTT_WINDOW_SIZE = 256
+CYCLE_TRACE_SIZE = 32
+
+
+class Histogram:
+    """Counts of samples in buckets with fixed upper bounds.
+
+    Args:
+        bounds: The increasing upper bounds of the buckets. Larger samples are
+        counted in an extra overflow bucket.
+
+    """
+
+    def __init__(self, bounds):
+        self.bounds = tuple(bounds)
+        self.counts = [0] * (len(self.bounds) + 1)
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def add(self, value):
+        self.counts[bisect_left(self.bounds, value)] += 1
+        self.count += 1
+        self.total += value
+        if value > self.max:
+            self.max = value
+
+    def percentile(self, fraction):
+        """Return the upper bound of the bucket holding the *fraction* percentile.
+
+        Samples in the overflow bucket are reported as the largest sample.
+        """
+        if not self.count:
+            return None
+        rank = fraction * self.count
+        seen = 0
+        for index, count in enumerate(self.counts):
+            seen += count
+            if seen >= rank and count:
+                if index < len(self.bounds):
+                    return min(self.bounds[index], self.max)
+                return self.max
+        return self.max
+
+    def as_dict(self):
+        buckets = {
+            f"le_{bound}": count for bound, count in zip(self.bounds, self.counts)
+        }
+        buckets["overflow"] = self.counts[-1]
+        return {
+            "count": self.count,
+            "mean": self.total / self.count if self.count else None,
+            "max": self.max,
+            "buckets": buckets,
+        }
+
+
+class RollingWindow:
+    """The most recent *size* samples, for percentiles of recent behaviour."""
+
+    def __init__(self, size=RTT_WINDOW_SIZE):
+        self._samples = deque(maxlen=size)
+
+    def add(self, value):
+        self._samples.append(value)
+
+    def __len__(self):
+        return len(self._samples)
+
+    def percentile(self, fraction):
+        """Return the *fraction* percentile (nearest rank), None without samples."""
+        if not self._samples:
+            return None
+        ordered = sorted(self._samples)
+        index = max(0, min(len(ordered) - 1, round(fraction * len(ordered)) - 1))
+        return ordered[index]
+
+
+class TransportMetrics:
+    """Counters of the requests sent through one gateway connection.
+
+    Attributes:
+        requests: Requests sent, including retries after a reconnect.
+        timeouts: Requests without an answer, after the reconnect attempt.
+        crc_errors: Answers with a wrong checksum.
+        exceptions: Exception answers from the slave.
+        connects: TCP connections opened.
+        reconnects: Connections reopened because a transaction on a reused
+            connection failed.
+        block_retries: Blocks read again in the same sweep after failing.
+        late_answers: Answers discarded because their request had timed out.
+        frame_cache_hits / frame_cache_misses: Requests taken from the frame
+            cache of the instrument, and built because they were not in it.
+        bytes_out / bytes_in: Bytes sent to and received from the gateway.
+        rtt: Round trip times (seconds) of the recent requests.
+        connect_time / send_time / receive_time: Total seconds spent
+            connecting, sending requests and waiting for the answers.
+
+    """
+
+    def __init__(self, rtt_window=RTT_WINDOW_SIZE):
+        self.requests = 0
+        self.timeouts = 0
+        self.crc_errors = 0
+        self.exceptions = 0
+        self.connects = 0
+        self.reconnects = 0
+        self.block_retries = 0
+        self.late_answers = 0
+        self.frame_cache_hits = 0
+        self.frame_cache_misses = 0
+        self.bytes_out = 0
+        self.bytes_in = 0
+        self.rtt = RollingWindow(rtt_window)
+        self.connect_time = 0.0
+        self.send_time = 0.0
+        self.receive_time = 0.0
+
+    def phase_times(self):
+        """Return the (connect, send, receive) totals, to diff around a cycle."""
+        return self.connect_time, self.send_time, self.receive_time
+
+    def frame_cache_hit_rate(self):
+        """Return the fraction of requests from the frame cache, None before any."""
+        lookups = self.frame_cache_hits + self.frame_cache_misses
+        if not lookups:
+            return None
+        return self.frame_cache_hits / lookups
+
+    def as_dict(self):
+        return {
+            "requests": self.requests,
+            "timeouts": self.timeouts,
+            "crc_errors": self.crc_errors,
+            "exceptions": self.exceptions,
+            "connects": self.connects,
+            "reconnects": self.reconnects,
+            "block_retries": self.block_retries,
+            "late_answers": self.late_answers,
+            "frame_cache_hits": self.frame_cache_hits,
+            "frame_cache_misses": self.frame_cache_misses,
+            "frame_cache_hit_rate": self.frame_cache_hit_rate(),
+            "bytes_out": self.bytes_out,
+            "bytes_in": self.bytes_in,
+            "rtt_p50": self.rtt.percentile(0.5),
+            "rtt_p95": self.rtt.percentile(0.95),
+            "rtt_p99": self.rtt.percentile(0.99),
+            "connect_time": self.connect_time,
+            "send_time": self.send_time,
+            "receive_time": self.receive_time,
+        }
+
+
+class QueueMetrics:
+    """Waits for a gateway connection shared by several hubs, see broker.py.
+
+    Attributes:
+        depth: Requests waiting now.
+        max_depth: Most requests ever waiting at the same time.
+        queued: Requests that had to wait for another one.
+        wait: Seconds waited by the recent requests, 0 for those served at once.
+        wait_time: Total seconds waited.
+
+    """
+
+    def __init__(self, wait_window=RTT_WINDOW_SIZE):
+        self.depth = 0
+        self.max_depth = 0
+        self.queued = 0
+        self.wait = RollingWindow(wait_window)
+        self.wait_time = 0.0
+
+    def add_depth(self, depth):
+        """Count a request queued behind others, *depth* now waiting."""
+        self.queued += 1
+        self.depth = depth
+        if depth > self.max_depth:
+            self.max_depth = depth
+
+    def add_wait(self, seconds):
+        self.wait.add(seconds)
+        self.wait_time += seconds
+
+    def as_dict(self):
+        return {
+            "depth": self.depth,
+            "max_depth": self.max_depth,
+            "queued": self.queued,
+            "wait_p50": self.wait.percentile(0.5),
+            "wait_p95": self.wait.percentile(0.95),
+            "wait_time": self.wait_time,
+        }
+
+
+class CycleTrace:
+    """Where the time of one poll cycle went, in seconds per phase."""
+
+    __slots__ = (
+        "started",
+        "tiers",
+        "success",
+        "requests",
+        "connect",
+        "send",
+        "receive",
+        "decode",
+        "publish",
+        "inverters",
+    )
+
+    def __init__(self, started, tiers):
+        self.started = started  # wall clock time (datetime)
+        self.tiers = tiers
+        self.success = False
+        self.requests = 0
+        self.connect = 0.0
+        self.send = 0.0
+        self.receive = 0.0
+        self.decode = 0.0
+        self.publish = None  # set when the entities have been updated
+        self.inverters = {}  # read duration by unit ID
+
+    def as_dict(self):
+        return {name: getattr(self, name) for name in self.__slots__}
+
+
+class PollMetrics:
+    """Counters and durations of the poll cycles of a hub.
+
+    The traces of the last cycles are kept in a ring buffer for diagnostics.
+    """
+
+    def __init__(self, trace_size=CYCLE_TRACE_SIZE):
+        self.cycles = 0
+        self.failed_cycles = 0
+        self.retries = 0
+        self.failed_blocks = 0  # blocks still failing after their retries
+        self.last_cycle_duration = None
+        self.cycle_duration = Histogram(CYCLE_DURATION_BUCKETS)
+        self.decode_time = 0.0  # total seconds spent decoding register blocks
+        self.traces = deque(maxlen=trace_size)
+
+    def add_cycle(self, duration, success):
+        self.cycles += 1
+        if not success:
+            self.failed_cycles += 1
+        self.last_cycle_duration = duration
+        self.cycle_duration.add(duration)
+
+    def as_dict(self):
+        return {
+            "cycles": self.cycles,
+            "failed_cycles": self.failed_cycles,
+            "retries": self.retries,
+            "failed_blocks": self.failed_blocks,
+            "last_cycle_duration": self.last_cycle_duration,
+            "cycle_duration": self.cycle_duration.as_dict(),
+            "decode_time": self.decode_time,
+        }
@@ -0,0 +1,164 @@
+"""Profiling of poll cycles on demand, for the profile service.
+
+The cycles profiled are the scheduled ones: a :class:`ProfileSession` is
+attached to the coordinators, which run their next cycles under its profiler
+as usual, so the profile shows the load of normal polling rather than that of
+refreshes forced back to back.
+
+The cycles run on the event loop, so cProfile sees everything the loop runs in
+the meantime; the report only lists the functions of this integration. The
+raw profile is saved next to it for tools like snakeviz. The tracemalloc
+snapshots, their comparison and the report are done in the executor.
+"""
+import cProfile
+import io
+import logging
+import os
+import pstats
+import tracemalloc
+
+from homeassistant.core import HomeAssistant
+from homeassistant.util import dt as dt_util
+
+from .const import DOMAIN, ProfileSettings
+
+_LOGGER = logging.getLogger(__name__)
+
+# Selects the rows of this integration in the pstats report and the tracemalloc
+# statistics
+_MODULE_PATTERN = f"custom_components[/\\\\]{DOMAIN}"
+_MODULE_GLOB = f"*{os.sep}custom_components{os.sep}{DOMAIN}{os.sep}*"
+
+
+async def async_profile_cycles(
+    hass: HomeAssistant, coordinators, cycles: int, trace_memory: bool = False
+) -> "ProfileSession":
+    """Profile the next *cycles* scheduled cycles of every coordinator.
+
+    Returns at once; the report is written to the config directory when the
+    cycles are done.
+
+    Args:
+        coordinators: The coordinators whose cycles are profiled.
+        cycles (int): The number of cycles of each coordinator.
+        trace_memory (bool): Also trace the allocations with tracemalloc.
+
+    Returns:
+        The session, None if some coordinator is being profiled already.
+
+    """
+    if any(coordinator.profile is not None for coordinator in coordinators):
+        _LOGGER.warning("The poll cycles are being profiled already")
+        return None
+    session = ProfileSession(hass, coordinators, cycles, trace_memory)
+    await session.async_start()
+    return session
+
+
+class ProfileSession:
+    """A profile of the next scheduled cycles of some coordinators.
+
+    Each coordinator runs its cycles under the shared profiler while the
+    session is its ``profile``, and is detached after *cycles* of them, or
+    when its entry is unloaded. The report is written once all are detached.
+
+    Args:
+        hass (HomeAssistant): For the executor and the config directory.
+        coordinators: The coordinators whose cycles are profiled.
+        cycles (int): The number of cycles of each coordinator.
+        trace_memory (bool): Also trace the allocations with tracemalloc.
+
+    """
+
+    def __init__(self, hass, coordinators, cycles, trace_memory=False):
+        self._hass = hass
+        self.cycles = cycles
+        self.trace_memory = trace_memory
+        self.path = None  # of the report, once written
+        self._remaining = {coordinator: cycles for coordinator in coordinators}
+        self._profiler = cProfile.Profile()
+        self._running = 0  # cycles running now, of all coordinators
+        self._profiled = 0
+        self._started_tracing = False
+        self._before = None
+
+    async def async_start(self):
+        """Take the first memory snapshot and attach to the coordinators."""
+        if self.trace_memory:
+            self._started_tracing = not tracemalloc.is_tracing()
+            if self._started_tracing:
+                tracemalloc.start()
+            self._before = await self._hass.async_add_executor_job(
+                tracemalloc.take_snapshot
+            )
+        for coordinator in self._remaining:
+            coordinator.profile = self
+        _LOGGER.info(
+            f"Profiling the next {self.cycles} poll cycles of "
+            + f"{len(self._remaining)} hubs"
+        )
+
+    def enable(self):
+        """Profile from the start of a cycle."""
+        self._running += 1
+        if self._running == 1:
+            self._profiler.enable()
+
+    def disable(self, coordinator):
+        """Stop profiling at the end of a cycle of *coordinator*."""
+        self._running -= 1
+        if not self._running:
+            self._profiler.disable()
+        self._profiled += 1
+        if coordinator in self._remaining:
+            self._remaining[coordinator] -= 1
+            if not self._remaining[coordinator]:
+                self.detach(coordinator)
+
+    def detach(self, coordinator):
+        """Profile no more cycles of *coordinator*, e.g. when it is unloaded."""
+        if coordinator.profile is self:
+            coordinator.profile = None
+        if self._remaining.pop(coordinator, None) is not None and not self._remaining:
+            self._hass.async_create_task(self._async_finish())
+
+    async def _async_finish(self):
+        if self._running:  # a cycle of an unloaded entry is still running
+            self._profiler.disable()
+        timestamp = dt_util.now().strftime("%Y%m%d_%H%M%S")
+        path = self._hass.config.path(f"{DOMAIN}_profile_{timestamp}")
+        await self._hass.async_add_executor_job(self._write_report, path)
+        self.path = f"{path}.txt"
+        _LOGGER.info(f"Profile of {self._profiled} poll cycles written to {self.path}")
+
+    def _write_report(self, path):
+        """Write the raw profile to *path*.prof and the report to *path*.txt."""
+        after = None
+        if self.trace_memory:
+            after = tracemalloc.take_snapshot()
+            if self._started_tracing:
+                tracemalloc.stop()
+
+        self._profiler.dump_stats(f"{path}.prof")
+
+        report = io.StringIO()
+        report.write(f"{DOMAIN}: {self._profiled} poll cycles\n\n")
+        stats = pstats.Stats(self._profiler, stream=report)
+        stats.sort_stats(pstats.SortKey.CUMULATIVE).print_stats(
+            _MODULE_PATTERN, int(ProfileSettings.TopFunctions)
+        )
+        stats.sort_stats(pstats.SortKey.TIME).print_stats(
+            _MODULE_PATTERN, int(ProfileSettings.TopFunctions)
+        )
+
+        if after is not None:
+            filters = [tracemalloc.Filter(True, _MODULE_GLOB)]
+            difference = after.filter_traces(filters).compare_to(
+                self._before.filter_traces(filters), "lineno"
+            )
+            report.write("Top allocators (size difference over the cycles)\n")
+            for statistic in difference[: ProfileSettings.TopAllocators]:
+                report.write(f"{statistic}\n")
+
+        with open(f"{path}.txt", "w", encoding="utf-8") as file:
+            file.write(report.getvalue())
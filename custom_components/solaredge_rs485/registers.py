@@ -0,0 +1,451 @@
+"""Register map of the inverter.
+
+Every value read from the inverter is declared once in REGISTERS. The map is
+compiled into a block read plan and a decoder, and sensor.py creates the
+sensor entities from it.
+"""
+import struct
+import time
+from dataclasses import dataclass
+from typing import Optional
+
+from homeassistant.components.sensor import SensorDeviceClass, SensorStateClass
+from homeassistant.const import (
+    UnitOfElectricCurrent,
+    UnitOfElectricPotential,
+    UnitOfEnergy,
+    UnitOfFrequency,
+    UnitOfTemperature,
+)
+
+from .const import PollTier, ReadPlanSettings
+from .rs485eth import plan_read_blocks
+
+
+@dataclass(frozen=True)
+class RegisterField:
+    """A value in the inverter's input registers and the sensor showing it.
+
+    The raw register value is multiplied by ``scale`` (or divided by its inverse
+    when that is a whole number, which keeps e.g. 302 * 0.1 at 30.2). Fields
+    without a ``name`` are read but get no generic sensor entity.
+
+    A new value is only published when it differs from the last published value
+    by more than ``deadband`` (absolute) and ``deadband_rel`` (fraction of the
+    last published value).
+    """
+
+    key: str
+    address: int
+    width: int = 1  # number of registers: 1 (16 bits) or 2 (32 bits, big endian)
+    signed: bool = False
+    scale: float = 1
+    tier: PollTier = PollTier.FAST
+    deadband: float = 0
+    deadband_rel: float = 0
+    name: Optional[str] = None
+    unique_id: Optional[str] = None  # defaults to key
+    device_class: Optional[SensorDeviceClass] = None
+    state_class: Optional[SensorStateClass] = None
+    unit: Optional[str] = None
+    precision: Optional[int] = None
+    icon: Optional[str] = None
+
+
+def _energy(key, address, name, precision, width=2, scale=0.000001, **kwargs):
+    return RegisterField(
+        key,
+        address,
+        width=width,
+        scale=scale,
+        name=name,
+        device_class=SensorDeviceClass.ENERGY,
+        state_class=SensorStateClass.TOTAL_INCREASING,
+        unit=UnitOfEnergy.KILO_WATT_HOUR,
+        precision=precision,
+        **kwargs,
+    )
+
+
+def _current(key, address, name, **kwargs):
+    return RegisterField(
+        key,
+        address,
+        scale=0.1,
+        name=name,
+        device_class=SensorDeviceClass.CURRENT,
+        state_class=SensorStateClass.MEASUREMENT,
+        unit=UnitOfElectricCurrent.AMPERE,
+        precision=1,
+        **kwargs,
+    )
+
+
+def _voltage(key, address, name, precision, **kwargs):
+    return RegisterField(
+        key,
+        address,
+        scale=0.1,
+        deadband=0.5,
+        name=name,
+        device_class=SensorDeviceClass.VOLTAGE,
+        state_class=SensorStateClass.MEASUREMENT,
+        unit=UnitOfElectricPotential.VOLT,
+        precision=precision,
+        **kwargs,
+    )
+
+
+# https://ginlongsolis.freshdesk.com/helpdesk/attachments/36112313359
+REGISTERS = (
+    RegisterField("C_SunSpec_DID", 3000, tier=PollTier.STATIC),
+    RegisterField("SN", 3062, tier=PollTier.STATIC),
+    RegisterField(
+        "ac_power_output",
+        3004,
+        width=2,
+        scale=0.001,
+        name="AC Power",
+        device_class=SensorDeviceClass.ENERGY,
+        unit=UnitOfEnergy.KILO_WATT_HOUR,
+        precision=3,
+        icon="mdi:solar-power",
+    ),
+    RegisterField("dc_output_power", 3006, width=2, scale=0.001),
+    _energy(
+        "ac_generated_lifetimeproduction",
+        3008,
+        "AC Generated lifetimeproduction",
+        0,
+        scale=1,
+        tier=PollTier.SLOW,
+    ),
+    _energy(
+        "ac_energy_wh",
+        3009,
+        "AC Energy kWh",
+        -3,
+        unique_id="ac_energy_kwh",
+        tier=PollTier.MEDIUM,
+    ),
+    _energy(
+        "ac_generated_monthenergy",
+        3011,
+        "AC Generated monthenergy",
+        1,
+        tier=PollTier.MEDIUM,
+    ),
+    _energy(
+        "ac_generated_lastmonth",
+        3013,
+        "AC Generated lastmonth",
+        0,
+        tier=PollTier.SLOW,
+    ),
+    _energy(
+        "ac_generated_today",
+        3014,
+        "AC Generated today",
+        3,
+        width=1,
+        scale=0.01,
+        tier=PollTier.MEDIUM,
+    ),
+    _energy(
+        "ac_generated_yesterday",
+        3015,
+        "AC Generated yesterday",
+        3,
+        width=1,
+        scale=0.01,
+        tier=PollTier.SLOW,
+    ),
+    _energy(
+        "ac_generated_yearenergy",
+        3017,
+        "AC Generated yearenergy",
+        0,
+        tier=PollTier.SLOW,
+    ),
+    _energy(
+        "ac_generated_lastyear",
+        3019,
+        "AC Generated lastyear",
+        0,
+        tier=PollTier.SLOW,
+    ),
+    _voltage("dc_voltage_1", 3021, "DC Voltage 1", 1),
+    _current("dc_current_1", 3022, "DC Current 1", icon="mdi:current-dc"),
+    _voltage("dc_voltage_2", 3023, "DC Voltage 2", 1),
+    _current("dc_current_2", 3024, "DC Current 2", icon="mdi:current-dc"),
+    _voltage("ac_voltage_ab", 3033, "AC Voltage AB", 0),
+    _voltage("ac_voltage_bc", 3034, "AC Voltage BC", 0),
+    _voltage("ac_voltage_ca", 3035, "AC Voltage CA", 0),
+    _current("ac_current_a", 3036, "AC Current A"),
+    _current("ac_current_b", 3037, "AC Current B"),
+    _current("ac_current_c", 3038, "AC Current C"),
+    RegisterField(
+        "i_temp_sink",
+        3041,
+        signed=True,
+        scale=0.1,
+        name="Temp Sink",
+        unique_id="temp_sink",
+        deadband=0.5,
+        device_class=SensorDeviceClass.TEMPERATURE,
+        state_class=SensorStateClass.MEASUREMENT,
+        unit=UnitOfTemperature.CELSIUS,
+        precision=1,
+    ),
+    RegisterField(
+        "ac_frequency",
+        3042,
+        scale=0.01,
+        deadband=0.02,
+        name="AC Frequency",
+        device_class=SensorDeviceClass.FREQUENCY,
+        state_class=SensorStateClass.MEASUREMENT,
+        unit=UnitOfFrequency.HERTZ,
+        precision=1,
+    ),
+    RegisterField("i_status_vendor", 3043),
+    RegisterField("i_status", 3071),
+)
+
+# Position of every field in REGISTERS and in a RegisterSnapshot
+FIELD_INDEX = {field.key: index for index, field in enumerate(REGISTERS)}
+
+# struct format codes by (width, signed)
+_FORMAT_CODES = {(1, False): "H", (1, True): "h", (2, False): "L", (2, True): "l"}
+
+
+def _scaling(scale):
+    """Return (divide, factor) applying *scale* with the least rounding error."""
+    if 0 < scale < 1:
+        inverse = 1 / scale
+        if abs(inverse - round(inverse)) < 1e-9:
+            return True, round(inverse)
+    return False, scale
+
+
+def _block_layout(block, fields):
+    """Compile the fields in a block into as few structs as possible.
+
+    Each struct unpacks the whole block in one call, with pad bytes for the
+    registers between fields. Fields overlapping an earlier field (e.g. two longs
+    sharing a register) go into an extra struct.
+
+    Returns:
+        A list of (struct, fields) tuples.
+
+    """
+    layers = []
+    for field in sorted(fields, key=lambda field: field.address):
+        for layer in layers:
+            if layer[-1].address + layer[-1].width <= field.address:
+                layer.append(field)
+                break
+        else:
+            layers.append([field])
+
+    layout = []
+    for layer in layers:
+        formatcode = ">"
+        position = block.address
+        for field in layer:
+            if field.address > position:
+                formatcode += f"{2 * (field.address - position)}x"
+            formatcode += _FORMAT_CODES[field.width, field.signed]
+            position = field.address + field.width
+        layout.append((struct.Struct(formatcode), layer))
+    return layout
+
+
+class RegisterMap:
+    """A set of register fields compiled into a read plan and a decoder.
+
+    Args:
+        fields: The :class:`RegisterField` to read.
+        max_registers (int): The maximum number of registers per request.
+        max_gap (int): The maximum number of unused registers read to merge two
+        ranges into one request.
+
+    """
+
+    def __init__(
+        self,
+        fields,
+        max_registers=ReadPlanSettings.MaxRegisters,
+        max_gap=ReadPlanSettings.MaxGap,
+    ):
+        self.fields = tuple(fields)
+        for field in self.fields:
+            if (field.width, field.signed) not in _FORMAT_CODES:
+                raise ValueError(f"Unsupported register width of {field.key}")
+
+        self.blocks = plan_read_blocks(
+            [(field.address, field.width) for field in self.fields],
+            max_registers=max_registers,
+            max_gap=max_gap,
+        )
+
+        # (block index, struct, number of values) in the order the raw values
+        # are unpacked
+        self._unpackers = []
+        ordered = []
+        for index, block in enumerate(self.blocks):
+            in_block = [
+                field
+                for field in self.fields
+                if block.address <= field.address < block.end
+            ]
+            for unpacker, layer in _block_layout(block, in_block):
+                self._unpackers.append((index, unpacker, len(layer)))
+                ordered.extend(layer)
+        self.keys = tuple(field.key for field in ordered)
+        self.indexes = tuple(FIELD_INDEX[key] for key in self.keys)
+
+        # Positions of the raw values to divide or multiply, with the factor
+        self._divisions = []
+        self._multiplications = []
+        for position, field in enumerate(ordered):
+            divide, factor = _scaling(field.scale)
+            if factor == 1:
+                continue
+            if divide:
+                self._divisions.append((position, factor))
+            else:
+                self._multiplications.append((position, factor))
+
+    def decode(self, data):
+        """Decode all fields from the register blocks read for this map.
+
+        Args:
+            data (RegisterData): The blocks, in the order of ``blocks``.
+
+        Returns:
+            A dict of the scaled values by field key.
+
+        """
+        return dict(zip(self.keys, self.decode_values(data)))
+
+    def decode_values(self, data):
+        """Decode all fields into a list of scaled values, in the order of ``keys``.
+
+        The fields of blocks that were not read (see ``RegisterData.errors``) are
+        None.
+        """
+        blocks = data.blocks
+        values = []
+        for index, unpacker, count in self._unpackers:
+            block = blocks[index]
+            if block is None:
+                values.extend((None,) * count)
+            else:
+                values.extend(unpacker.unpack_from(block.data, block.offset))
+
+        if data.complete:
+            for position, factor in self._divisions:
+                values[position] /= factor
+            for position, factor in self._multiplications:
+                values[position] *= factor
+        else:
+            for position, factor in self._divisions:
+                if values[position] is not None:
+                    values[position] /= factor
+            for position, factor in self._multiplications:
+                if values[position] is not None:
+                    values[position] *= factor
+        return values
+
+    def update(self, snapshot, data, now=None):
+        """Return a new snapshot with the fields of this map decoded from *data*.
+
+        Fields of blocks that were not read keep their last value and the time
+        it was read.
+
+        Args:
+            snapshot (RegisterSnapshot): The current values.
+            data (RegisterData): The blocks read for this map.
+            now (float): The time.monotonic() of the read, now by default.
+
+        """
+        if now is None:
+            now = time.monotonic()
+        values = list(snapshot.values)
+        updated = list(snapshot.updated)
+        for index, value in zip(self.indexes, self.decode_values(data)):
+            if value is not None:
+                values[index] = value
+                updated[index] = now
+        return RegisterSnapshot(values, updated)
+
+
+class RegisterSnapshot:
+    """Immutable decoded values of one inverter, in the order of REGISTERS.
+
+    Entities read their value by field index (see FIELD_INDEX), so no key is
+    built or hashed per read. Fields not read yet are None. ``updated`` holds
+    the time.monotonic() at which each value was last read successfully, so a
+    value kept over failed reads can be told apart from a fresh one.
+    """
+
+    __slots__ = ("values", "updated")
+
+    def __init__(self, values=None, updated=None):
+        if values is None:
+            values = (None,) * len(REGISTERS)
+        if updated is None:
+            updated = (None,) * len(REGISTERS)
+        object.__setattr__(self, "values", tuple(values))
+        object.__setattr__(self, "updated", tuple(updated))
+
+    def __setattr__(self, name, value):
+        raise AttributeError("RegisterSnapshot is immutable")
+
+    def __delattr__(self, name):
+        raise AttributeError("RegisterSnapshot is immutable")
+
+    def __getitem__(self, index):
+        return self.values[index]
+
+    def __len__(self):
+        return len(self.values)
+
+    def __repr__(self):
+        return f"RegisterSnapshot({self.as_dict()})"
+
+    def get(self, key):
+        """Return the value of the field *key*."""
+        return self.values[FIELD_INDEX[key]]
+
+    def age(self, index, now=None):
+        """Return the seconds since field *index* was read, None if never."""
+        updated = self.updated[index]
+        if updated is None:
+            return None
+        return (time.monotonic() if now is None else now) - updated
+
+    def as_dict(self):
+        """Return the values as a dict by field key."""
+        return dict(zip(FIELD_INDEX, self.values))
+
+
+FIELDS_BY_KEY = {field.key: field for field in REGISTERS}
+
+
+def exceeds_deadband(field, published, value):
+    """Return True if *value* differs enough from *published* to be published."""
+    if published is None or value is None:
+        return published is not value
+    difference = abs(value - published)
+    if difference == 0:
+        return False
+    return difference > field.deadband and difference > field.deadband_rel * abs(
+        published
+    )
+
+
+def fields_for_tiers(tiers, fields=REGISTERS):
+    """Return the fields polled in any of the given tiers."""
+    return [field for field in fields if field.tier in tiers]
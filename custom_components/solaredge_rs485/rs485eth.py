@@ -15,9 +15,17 @@
 #   limitations under the License.
 #
 
+import asyncio
+import contextlib
+from collections import OrderedDict
 import struct
 import socket
 import logging
+import time
+
+from .const import TimeoutSettings
+from .crc import crc16_wide, validate_frame
+from .metrics import TransportMetrics
 
 _LOGGER = logging.getLogger(__name__)
 _LOGGER.setLevel(logging.DEBUG)
@@ -33,14 +41,54 @@ _PAYLOADFORMAT_LONG = "long"
 _PAYLOADFORMAT_INT = "int"
 _PAYLOADFORMAT_REGISTER = "register"
 
+MAX_REGISTERS_PER_READ = 125
+"""Maximum number of registers in one function code 4 request (Modbus limit)."""
+
+_READ_REQUEST_SIZE = 8  # slave address, function code, address, count, CRC
+_RESPONSE_HEADER_SIZE = 3  # slave address, function code, byte count
+_MINIMAL_RESPONSE_SIZE = 4
+_EXCEPTION_RESPONSE_SIZE = 5  # slave address, function code, exception code, CRC
+_EXCEPTION_BIT = 0x80
+
+_CRC_STRUCT = struct.Struct("<H")
+_READ_REQUEST_STRUCT = struct.Struct(">BBHH")
+_REGISTER_STRUCTS = {False: struct.Struct(">H"), True: struct.Struct(">h")}
+# Keyed by (big endian, signed)
+_LONG_STRUCTS = {
+    (True, False): struct.Struct(">L"),
+    (True, True): struct.Struct(">l"),
+    (False, False): struct.Struct("<L"),
+    (False, True): struct.Struct("<l"),
+}
+# Byte-swapped longs are decoded as two registers: (first, second)
+_SWAPPED_LONG_STRUCTS = {
+    BYTEORDER_BIG_SWAP: struct.Struct("<HH"),
+    BYTEORDER_LITTLE_SWAP: struct.Struct(">HH"),
+}
+
 class Instrument:
     """Instrument class for talking to instruments (slaves).
 
-    Uses the rs485 RTU or ASCII protocols (via RS485).
+    Uses the rs485 RTU protocol, tunnelled over TCP by an RS485-to-Ethernet
+    gateway. All I/O is done with asyncio streams; transactions are serialised
+    per gateway and a cancelled transaction drops the connection, so a late
+    answer can never be mistaken for the answer to the next request.
 
     Args:
-        port (str): The port number
-        debug (bool): Set this to :const:`True` to print the communication details
+        eth_address (str): The host name or IP address of the gateway
+        eth_port (int): The TCP port of the gateway
+        timeout (float): Seconds to wait for the connection
+        idle_timeout (float): Seconds after which an unused connection is reopened
+        frame_cache_size (int): Number of request frames kept in the
+        :class:`FrameCache`
+        metrics (TransportMetrics): Where to count requests, errors and bytes,
+        a new one by default
+        capture: Recorder of the frames sent and received, e.g. a
+        :class:`~.capture.CaptureWriter`, or None
+        lock: What serialises the transactions, an asyncio.Lock by default; a
+        :class:`~.broker.RequestQueue` when the connection is shared
+        request_timeout (RequestTimeout): The timeout of the answers, adapted
+        to the round trip times of the gateway; a new one by default
 
     """
 
@@ -48,13 +96,49 @@ class Instrument:
         self,
         eth_address,
         eth_port,
+        timeout=1,
+        idle_timeout=30,
+        frame_cache_size=64,
+        metrics=None,
+        capture=None,
+        lock=None,
+        request_timeout=None,
     ):
         self.precalculate_read_size = True
         self.clear_buffers_before_each_transaction = True
         self.eth_address = eth_address
         self.eth_port = eth_port
-
-    def _generic_command(
+        self.timeout = timeout
+        self.idle_timeout = idle_timeout
+        self._reader = None
+        self._writer = None
+        self._last_used = 0.0
+        self._lock = asyncio.Lock() if lock is None else lock
+        self._request = bytearray(_READ_REQUEST_SIZE)
+        self.frame_cache = FrameCache(frame_cache_size)
+        self.metrics = TransportMetrics() if metrics is None else metrics
+        self.capture = capture
+        self.request_timeout = (
+            RequestTimeout() if request_timeout is None else request_timeout
+        )
+        self._unanswered = 0  # requests in a row without an answer
+        self._timed_out = None  # (slave, function) of an unanswered request
+        self._partial_frame = False  # a frame is being read
+
+    @property
+    def is_connected(self):
+        """Return True if the connection to the gateway is open."""
+        return self._writer is not None
+
+    async def close(self):
+        """Close the connection to the gateway, if any."""
+        async with self._lock:
+            writer = self._close()
+            if writer is not None:
+                with contextlib.suppress(OSError):
+                    await writer.wait_closed()
+
+    async def _generic_command(
         self,
         registeraddress,
         numberOfDecimals=0,
@@ -62,6 +146,7 @@ class Instrument:
         signed=False,
         byteorder=BYTEORDER_BIG,
         payloadformat=None,
+        slaveaddress=1,
     ):
         """Perform generic command for reading and writing registers and bits.
 
@@ -78,6 +163,7 @@ class Instrument:
             signed. Only for a single register or for payloadformat='long'.
             byteorder (int): How multi-register data should be interpreted.
             payloadformat (None or string): Any of the _PAYLOADFORMAT_* values
+            slaveaddress (int): The unit ID of the inverter on the bus.
 
         Returns:
             The register data in numerical value (int or float), or the bit value 0 or
@@ -88,79 +174,698 @@ class Instrument:
             serial.SerialException (inherited from IOError)
 
         """
-        # Create payload
-        ps1 = _num_to_twobyte_string(registeraddress)
-        ps2 = _num_to_twobyte_string(number_of_registers)
-
-        first_part = (
-            chr(1)
-            + chr(4)
-            + f'{ps1}{ps2}'
+        request = self._build_request(
+            registeraddress, number_of_registers, slaveaddress
         )
- 
-        request = first_part + _calculate_crc_string(first_part)
 
         # Communicate
-        response = self._communicate(request)
-        # Extract payload
-        payload_from_slave = _extract_payload( response )
-        
-        if payload_from_slave == "":
+        response = await self._communicate(request)
+        self._check_response(response)
+
+        if response[0] != slaveaddress:
+            raise InvalidResponseError(
+                f"Wrong response from slave {slaveaddress} for "
+                + f"{number_of_registers} registers from {registeraddress}: "
+                + f"{response!r}"
+            )
+
+        if len(response) == _MINIMAL_RESPONSE_SIZE:
             return None
 
-        # Parse response payload
-        return _parse_payload(
-            payload_from_slave,
+        # Parse response payload, skipping the byte count
+        return _parse_registers(
+            response,
+            _RESPONSE_HEADER_SIZE,
             numberOfDecimals,
             signed,
             byteorder,
             payloadformat,
         )
 
-    def _communicate(self, request):
-        """Talk to the slave via a serial port.
+    async def read_registers(
+        self, registeraddress, number_of_registers, slaveaddress=1
+    ):
+        """Read a block of consecutive registers.
 
         Args:
-            request (str): The raw request that is to be sent to the slave.
+            registeraddress (int): The first register address.
+            number_of_registers (int): The number of registers to read.
+            slaveaddress (int): The unit ID of the inverter on the bus.
 
         Returns:
-            The raw data (string) returned from the slave.
+            A :class:`RegisterBlock` with the raw register data.
 
         Raises:
-            TypeError, ValueError, rs485Exception,
-            serial.SerialException (inherited from IOError)
+            ValueError, rs485Exception
 
         """
+        if not 1 <= number_of_registers <= MAX_REGISTERS_PER_READ:
+            raise ValueError(
+                f"Wrong number of registers to read: {number_of_registers}"
+            )
+
+        request = self._build_request(
+            registeraddress, number_of_registers, slaveaddress
+        )
 
-        request = bytes(
-            request, encoding="latin1"
-        )  # Convert types to make it Python3 compatible
+        response = await self._communicate(request)
+        self._check_response(response)
+
+        number_of_bytes = 2 * number_of_registers
+        if (
+            response[0] != slaveaddress
+            or response[2] != number_of_bytes
+            or len(response) != _RESPONSE_HEADER_SIZE + number_of_bytes + 2
+        ):
+            raise InvalidResponseError(
+                f"Wrong response from slave {slaveaddress} for "
+                + f"{number_of_registers} registers from {registeraddress}: "
+                + f"{response!r}"
+            )
+
+        return RegisterBlock(
+            registeraddress, number_of_registers, response, _RESPONSE_HEADER_SIZE
+        )
 
+    async def read_blocks(self, blocks, partial=False, retries=0, slaveaddress=1):
+        """Read all blocks of a read plan, see :func:`plan_read_blocks`.
+
+        With *partial*, a slave that does not answer the first block, after
+        its *retries*, is not asked for the other blocks: an inverter that is
+        off or not on the bus costs 1 + *retries* timeouts per cycle instead of
+        that many per block.
+
+        Args:
+            blocks: The :class:`ReadBlock` to read.
+            partial (bool): Carry on when a block fails instead of raising; the
+                block is None in the result and its error in ``errors``.
+            retries (int): With *partial*, how many more times a failed block
+                is read. The first block is retried at once, the others once
+                the sweep is done, and only those that failed.
+            slaveaddress (int): The unit ID of the inverter on the bus.
+
+        Returns:
+            A :class:`RegisterData` for looking up the registers.
+
+        """
+        if not partial:
+            return RegisterData(
+                [
+                    await self.read_registers(
+                        block.address, block.count, slaveaddress
+                    )
+                    for block in blocks
+                ]
+            )
+
+        read = [None] * len(blocks)
+        errors = {}
+        if not blocks:
+            return RegisterData(read, errors)
+
+        # The first block tells whether the slave is there at all
+        await self._read_block(blocks, 0, read, errors, slaveaddress)
+        for _ in range(retries):
+            if 0 not in errors:
+                break
+            self.metrics.block_retries += 1
+            await self._read_block(blocks, 0, read, errors, slaveaddress)
+        if isinstance(errors.get(0), NoResponseError):
+            errors.update((index, errors[0]) for index in range(1, len(blocks)))
+            return RegisterData(read, errors)
+
+        pending = range(1, len(blocks))
+        for attempt in range(1 + retries):
+            for index in pending:
+                await self._read_block(blocks, index, read, errors, slaveaddress)
+            pending = [index for index in sorted(errors) if index]
+            if not pending or attempt == retries:
+                break
+            self.metrics.block_retries += len(pending)
+        return RegisterData(read, errors)
+
+    async def _read_block(self, blocks, index, read, errors, slaveaddress):
+        """Read block *index* into *read*, or its error into *errors*."""
+        block = blocks[index]
+        try:
+            read[index] = await self.read_registers(
+                block.address, block.count, slaveaddress
+            )
+        except rs485Exception as error:
+            errors[index] = error
+        else:
+            errors.pop(index, None)
+
+    def _check_response(self, response):
+        """Validate an answer with :func:`_check_response`, counting the errors."""
+        try:
+            _check_response(response)
+        except ChecksumError:
+            self.metrics.crc_errors += 1
+            raise
+        except SlaveReportedException:
+            self.metrics.exceptions += 1
+            raise
+
+    def _build_request(
+        self, registeraddress, number_of_registers, slaveaddress=1, functioncode=4
+    ):
+        """Return the read request for a register range.
+
+        The polled ranges are the same every cycle, so the frames are taken from
+        the frame cache and only built (with CRC) on a miss.
+
+        Returns:
+            The request (bytes), including the CRC.
+
+        """
+        key = (slaveaddress, functioncode, registeraddress, number_of_registers)
+        request = self.frame_cache.get(key)
+        if request is None:
+            self.metrics.frame_cache_misses += 1
+            request = self._pack_request(*key)
+            self.frame_cache.put(key, request)
+        else:
+            self.metrics.frame_cache_hits += 1
+        return request
+
+    def _pack_request(
+        self, slaveaddress, functioncode, registeraddress, number_of_registers
+    ):
+        """Build a read request in the request buffer."""
+        request = self._request
         try:
-            sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-            sock.settimeout(1)
+            _READ_REQUEST_STRUCT.pack_into(
+                request,
+                0,
+                slaveaddress,
+                functioncode,
+                registeraddress,
+                number_of_registers,
+            )
+        except struct.error:
+            raise ValueError(
+                "Wrong slave address, function code, register address or number "
+                + f"of registers: {slaveaddress}, {functioncode}, {registeraddress}, "
+                + f"{number_of_registers}"
+            )
+        _CRC_STRUCT.pack_into(
+            request,
+            _READ_REQUEST_SIZE - 2,
+            _calculate_crc(memoryview(request)[: _READ_REQUEST_SIZE - 2]),
+        )
+        return bytes(request)
 
-            sock.connect((self.eth_address, self.eth_port))
-            sock.send(request)
-            answer = sock.recv(1024)
-            sock.close()
+    async def _communicate(self, request):
+        """Talk to the slave via the ETH gateway.
 
-        except Exception:
-            raise NoResponseError("No communication with the instrument (timeout)")
+        The TCP connection is kept open between calls. It is re-established
+        when it has been idle for longer than ``idle_timeout`` seconds (the
+        gateways silently drop idle sockets) or when a transaction on a reused
+        connection fails.
 
-        answer = str(answer, encoding="latin1")
+        A slave not answering in time is not a failure of the connection, which
+        may be shared by other hubs (see broker.py): it stays open, and a late
+        answer is discarded when it comes. The connection is reopened after
+        TimeoutSettings.ReconnectAfter requests in a row went unanswered, when
+        a timeout cut a frame in half, and before the next request to the same
+        slave if nothing was answered since: RTU frames carry no transaction
+        ID, so a late answer of that slave could pass for the answer to it.
+
+        Args:
+            request (bytes): The raw request that is to be sent to the slave.
+
+        Returns:
+            The raw data (bytes) returned from the slave.
+
+        Raises:
+            TypeError, ValueError, rs485Exception, asyncio.CancelledError
+
+        """
+        if self.precalculate_read_size:
+            number_of_bytes_to_read = _predict_response_size(request)
+        else:
+            number_of_bytes_to_read = None
+
+        async with self._lock:
+            if (
+                self._writer is not None
+                and time.monotonic() - self._last_used > self.idle_timeout
+            ):
+                _LOGGER.debug("Closing idle connection to the gateway")
+                self._close()
+            elif self._writer is not None and self._timed_out == request[:2]:
+                self._close()
+
+            reused = self._writer is not None
+            self.metrics.requests += 1
+            try:
+                answer = await self._transact(request, number_of_bytes_to_read)
+            except asyncio.CancelledError:
+                self._close()
+                raise
+            except NoResponseError:
+                self.metrics.timeouts += 1
+                self._unanswered += 1
+                self._timed_out = request[:2]
+                if (
+                    self._partial_frame
+                    or self._unanswered >= TimeoutSettings.ReconnectAfter
+                ):
+                    self._close()
+                raise
+            except Exception as error:
+                self._close()
+                if not reused:
+                    self.metrics.timeouts += 1
+                    raise NoResponseError(
+                        f"No communication with the instrument (timeout): {error!r}"
+                    )
+                _LOGGER.debug(f"Reconnecting to the gateway after: {error!r}")
+                self.metrics.reconnects += 1
+                self.metrics.requests += 1
+                try:
+                    # The answer may be a late one to the first attempt, so its
+                    # round trip time is not sampled (Karn's algorithm)
+                    answer = await self._transact(
+                        request, number_of_bytes_to_read, sample=False
+                    )
+                except asyncio.CancelledError:
+                    self._close()
+                    raise
+                except NoResponseError:
+                    self.metrics.timeouts += 1
+                    self._unanswered += 1
+                    self._timed_out = request[:2]
+                    if self._partial_frame:
+                        self._close()
+                    raise
+                except Exception as error:
+                    self._close()
+                    self.metrics.timeouts += 1
+                    raise NoResponseError(
+                        f"No communication with the instrument (timeout): {error!r}"
+                    )
+
+            self._unanswered = 0
+            self._timed_out = None
+            self._last_used = time.monotonic()
 
         if not answer:
             raise NoResponseError("No communication with the instrument (no answer)")
 
         return answer
 
+    async def _transact(self, request, number_of_bytes_to_read=None, sample=True):
+        """Send a request on the (possibly new) connection and read the answer.
+
+        The answer is waited for as long as ``request_timeout`` says. Its
+        round trip time updates the timeout unless *sample* is False; no
+        answer in time backs the timeout off.
+
+        Raises:
+            NoResponseError: The slave did not answer in time.
+            OSError, asyncio.TimeoutError, InvalidResponseError: The
+            connection failed or is out of step with the frames.
+
+        """
+        if self._writer is None:
+            connecting = time.monotonic()
+            await asyncio.wait_for(self._connect(), self.timeout)
+            self.metrics.connect_time += time.monotonic() - connecting
+        elif self.clear_buffers_before_each_transaction:
+            await self._clear_buffers()
+
+        sent = time.monotonic()
+        self._writer.write(request)
+        self.metrics.bytes_out += len(request)
+        if self.capture is not None:
+            self.capture.record_request(request)
+        await self._writer.drain()
+        drained = time.monotonic()
+        self.metrics.send_time += drained - sent
+        if number_of_bytes_to_read is None:
+            reading = self._reader.read(1024)
+        else:
+            reading = self._read_frame(request)
+        timeout = self.request_timeout.timeout
+        try:
+            answer = await asyncio.wait_for(reading, timeout)
+        except asyncio.TimeoutError:
+            self.request_timeout.back_off()
+            raise NoResponseError(
+                f"No answer from slave {request[0]} within {timeout * 1000:.0f} ms"
+            )
+        if not answer:
+            raise ConnectionResetError("Connection closed by the gateway")
+        received = time.monotonic()
+        self.metrics.receive_time += received - drained
+        self.metrics.rtt.add(received - sent)
+        if sample:
+            self.request_timeout.add_sample(received - sent)
+        self.metrics.bytes_in += len(answer)
+        if self.capture is not None:
+            self.capture.record_response(answer)
+        return answer
+
+    async def _read_frame(self, request):
+        """Read the RTU frame answering *request*, as soon as it is complete.
+
+        The frames are delimited by their byte count; an exception frame is
+        recognised from its function code. A valid frame from another slave or
+        for another function is a late answer to an earlier request that timed
+        out, and is discarded.
+
+        Raises:
+            InvalidResponseError: A frame that is not valid, the connection is
+            out of step.
+
+        """
+        while True:
+            header = await self._reader.readexactly(_RESPONSE_HEADER_SIZE)
+            self._partial_frame = True
+            if header[1] & _EXCEPTION_BIT:
+                rest = _EXCEPTION_RESPONSE_SIZE - _RESPONSE_HEADER_SIZE
+            else:
+                rest = header[2] + 2  # register data and CRC
+            frame = header + await self._reader.readexactly(rest)
+            self._partial_frame = False
+            if frame[0] == request[0] and frame[1] & ~_EXCEPTION_BIT == request[1]:
+                return frame
+            if not validate_frame(frame):
+                raise InvalidResponseError(f"Out of step with the frames: {frame!r}")
+            self.metrics.late_answers += 1
+            _LOGGER.debug(f"Discarding a late answer from slave {frame[0]}")
+
+    async def _connect(self):
+        self._reader, self._writer = await asyncio.open_connection(
+            self.eth_address, self.eth_port
+        )
+        self.metrics.connects += 1
+        sock = self._writer.get_extra_info("socket")
+        if sock is not None:
+            sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            sock.setsockopt(socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1)
+            if hasattr(socket, "TCP_KEEPIDLE"):
+                sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_KEEPIDLE, 10)
+                sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_KEEPINTVL, 5)
+                sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_KEEPCNT, 3)
+        _LOGGER.debug(f"Connected to {self.eth_address}:{self.eth_port}")
+
+    async def _clear_buffers(self):
+        """Discard any stale bytes left on the connection by a late answer."""
+        while True:
+            read = asyncio.ensure_future(self._reader.read(1024))
+            # One loop iteration lets the read return data that is already buffered
+            await asyncio.sleep(0)
+            if not read.done():
+                read.cancel()
+                with contextlib.suppress(asyncio.CancelledError):
+                    await read
+                return
+            if not read.result():
+                raise ConnectionResetError("Connection closed by the gateway")
+
+    def _close(self):
+        """Close the connection without waiting, return the closed writer."""
+        self._unanswered = 0
+        self._timed_out = None
+        self._partial_frame = False
+        writer = self._writer
+        self._reader = None
+        self._writer = None
+        if writer is not None:
+            writer.close()
+        return writer
+
+class FrameCache:
+    """Bounded LRU cache of request frames.
+
+    Keyed by ``(slaveaddress, functioncode, registeraddress, number_of_registers)``.
+    The hits and misses are counted in the :class:`~.metrics.TransportMetrics`
+    of the instrument.
+    """
+
+    def __init__(self, maxsize=64):
+        self.maxsize = maxsize
+        self._frames = OrderedDict()
+
+    def get(self, key):
+        """Return the cached frame for *key*, or None."""
+        frame = self._frames.get(key)
+        if frame is not None:
+            self._frames.move_to_end(key)
+        return frame
+
+    def put(self, key, frame):
+        """Store a frame, evicting the least recently used one if full."""
+        if self.maxsize <= 0:
+            return
+        self._frames[key] = frame
+        self._frames.move_to_end(key)
+        if len(self._frames) > self.maxsize:
+            self._frames.popitem(last=False)
+
+    def clear(self):
+        self._frames.clear()
+
+    def __len__(self):
+        return len(self._frames)
+
+
+class RequestTimeout:
+    """The answer timeout of a gateway, from its round trip times.
+
+    Estimated like the TCP retransmission timeout (RFC 6298): a smoothed RTT
+    and RTT variation, with the timeout *variance_factor* variations above the
+    smoothed RTT, within bounds. A request without an answer doubles the
+    timeout until the next sample, so a gateway that got slower still gets
+    answers in time to be measured.
+
+    Args:
+        initial (float): Seconds until the first sample.
+        minimum (float): Lower bound, in seconds.
+        maximum (float): Upper bound, in seconds.
+        variance_factor (int): RTT variations added to the smoothed RTT.
+
+    """
+
+    ALPHA = 1 / 8  # gain of the smoothed RTT
+    BETA = 1 / 4  # gain of the RTT variation
+
+    def __init__(
+        self,
+        initial=TimeoutSettings.Initial / 1000,
+        minimum=TimeoutSettings.Min / 1000,
+        maximum=TimeoutSettings.Max / 1000,
+        variance_factor=TimeoutSettings.VarianceFactor,
+    ):
+        self.minimum = minimum
+        self.maximum = maximum
+        self.variance_factor = variance_factor
+        self.srtt = None
+        self.rttvar = None
+        self.samples = 0
+        self.backoffs = 0
+        self.timeout = self._bounded(initial)
+
+    def add_sample(self, rtt):
+        """Update the estimate with the round trip time of an answer."""
+        if self.srtt is None:
+            self.srtt = rtt
+            self.rttvar = rtt / 2
+        else:
+            self.rttvar += self.BETA * (abs(self.srtt - rtt) - self.rttvar)
+            self.srtt += self.ALPHA * (rtt - self.srtt)
+        self.samples += 1
+        self.timeout = self._bounded(self.srtt + self.variance_factor * self.rttvar)
+
+    def back_off(self):
+        """Double the timeout after a request went unanswered."""
+        self.backoffs += 1
+        self.timeout = self._bounded(2 * self.timeout)
+
+    def _bounded(self, timeout):
+        return min(self.maximum, max(self.minimum, timeout))
+
+    def as_dict(self):
+        return {
+            "timeout": self.timeout,
+            "srtt": self.srtt,
+            "rttvar": self.rttvar,
+            "samples": self.samples,
+            "backoffs": self.backoffs,
+        }
+
+
+class ReadBlock:
+    """A range of consecutive registers read in a single request."""
+
+    __slots__ = ("address", "count")
+
+    def __init__(self, address, count):
+        self.address = address
+        self.count = count
+
+    @property
+    def end(self):
+        """The register address just after the block."""
+        return self.address + self.count
+
+    def __eq__(self, other):
+        if not isinstance(other, ReadBlock):
+            return NotImplemented
+        return (self.address, self.count) == (other.address, other.count)
+
+    def __repr__(self):
+        return f"ReadBlock({self.address}, {self.count})"
+
+
+def plan_read_blocks(registers, max_registers=MAX_REGISTERS_PER_READ, max_gap=0):
+    """Coalesce the wanted registers into as few block reads as possible.
+
+    Args:
+        registers (iterable): ``(address, number_of_registers)`` tuples, in any
+        order. Ranges may overlap.
+        max_registers (int): The maximum number of registers in one request.
+        max_gap (int): The maximum number of unwanted registers to read in order to
+        merge two ranges into one request; reading them should cost less than
+        the round trip of a separate request.
+
+    Returns:
+        A list of :class:`ReadBlock`, sorted by address.
+
+    Raises:
+        ValueError
+
+    """
+    if not 1 <= max_registers <= MAX_REGISTERS_PER_READ:
+        raise ValueError(f"Wrong maximum number of registers: {max_registers}")
+
+    blocks = []
+    for address, count in sorted(registers):
+        if count > max_registers:
+            raise ValueError(
+                f"Register range {address} ({count} registers) does not fit "
+                + f"in {max_registers} registers"
+            )
+        if blocks:
+            block = blocks[-1]
+            end = max(block.end, address + count)
+            if address - block.end <= max_gap and end - block.address <= max_registers:
+                block.count = end - block.address
+                continue
+        blocks.append(ReadBlock(address, count))
+
+    return blocks
+
+
+def build_read_request(
+    slaveaddress, registeraddress, number_of_registers, functioncode=4
+):
+    """Return a read request frame, including the CRC.
+
+    For requests outside the poll cycle (e.g. discovery); the cycle builds its
+    requests with :meth:`Instrument._build_request`, which caches them.
+    """
+    try:
+        request = _READ_REQUEST_STRUCT.pack(
+            slaveaddress, functioncode, registeraddress, number_of_registers
+        )
+    except struct.error:
+        raise ValueError(
+            f"Wrong read request: slave {slaveaddress}, function code "
+            + f"{functioncode}, {number_of_registers} registers from "
+            + f"{registeraddress}"
+        )
+    return request + _CRC_STRUCT.pack(_calculate_crc(request))
+
+
+class RegisterBlock:
+    """Raw data of consecutive registers, as received from the slave.
+
+    The register data is not copied out of the response; it starts at
+    ``offset`` in ``data``.
+    """
+
+    __slots__ = ("address", "count", "data", "offset")
+
+    def __init__(self, address, count, data, offset=0):
+        self.address = address
+        self.count = count
+        self.data = data
+        self.offset = offset
+
+    @property
+    def end(self):
+        """The register address just after the block."""
+        return self.address + self.count
+
+    @property
+    def registerdata(self):
+        """The raw register data, as a memoryview."""
+        return memoryview(self.data)[self.offset : self.offset + 2 * self.count]
+
+    def offset_of(self, registeraddress):
+        """Return the offset of a register within ``data``."""
+        return self.offset + 2 * (registeraddress - self.address)
+
+
+class RegisterData:
+    """Lookup of register values in the blocks of a read plan.
+
+    After a partial read (see :meth:`Instrument.read_blocks`) the blocks that
+    failed are None, and ``errors`` holds their exception by block index.
+    """
+
+    def __init__(self, blocks, errors=None):
+        self.blocks = blocks
+        self.errors = {} if errors is None else errors
+
+    @property
+    def complete(self):
+        """Return True if every block has been read."""
+        return not self.errors
+
+    def _find(self, registeraddress, number_of_registers):
+        for block in self.blocks:
+            if block is not None and (
+                block.address <= registeraddress
+                and registeraddress + number_of_registers <= block.end
+            ):
+                return block
+        raise KeyError(f"Register {registeraddress} has not been read")
+
+    def get_long(
+        self, registeraddress, signed=False, byteorder=BYTEORDER_BIG, numberOfDecimals=0
+    ):
+        """Decode a long integer from two registers, see :func:`_unpack_long`."""
+        block = self._find(registeraddress, 2)
+        return _unpack_long(
+            block.data,
+            block.offset_of(registeraddress),
+            signed,
+            byteorder,
+            numberOfDecimals,
+        )
+
+    def get_int(self, registeraddress, numberOfDecimals=0, signed=False):
+        """Decode one register, see :func:`_unpack_register`."""
+        block = self._find(registeraddress, 1)
+        return _unpack_register(
+            block.data, block.offset_of(registeraddress), numberOfDecimals, signed
+        )
+
+
 class rs485Exception(IOError):
     """Base class for rs485 communication exceptions.
 
     Inherits from IOError, which is an alias for OSError in Python3.
     """
 
+class SlaveReportedException(rs485Exception):
+    """Base class for exceptions that the slave (instrument) reports."""
+
 class MasterReportedException(rs485Exception):
     """Base class for exceptions that the master (computer) detects."""
 
@@ -170,6 +875,24 @@ class NoResponseError(MasterReportedException):
 class InvalidResponseError(MasterReportedException):
     """The response does not fulfill the rs485 standad, for example wrong checksum."""
 
+class ChecksumError(InvalidResponseError):
+    """The CRC of the response is wrong."""
+
+def _parse_registers(
+    buffer,
+    offset,
+    numberOfDecimals,
+    signed,
+    byteorder,
+    payloadformat,
+):
+    """Decode the register data at *offset* in a bytes-like *buffer*."""
+    if payloadformat == _PAYLOADFORMAT_LONG:
+        return _unpack_long(buffer, offset, signed, byteorder, numberOfDecimals)
+
+    if payloadformat in (_PAYLOADFORMAT_INT, _PAYLOADFORMAT_REGISTER):
+        return _unpack_register(buffer, offset, numberOfDecimals, signed)
+
 def _parse_payload(
     payload,
     numberOfDecimals,
@@ -177,21 +900,51 @@ def _parse_payload(
     byteorder,
     payloadformat,
 ):
-    registerdata = payload[1:]
+    """Decode a payload string (byte count and register data)."""
+    return _parse_registers(
+        bytes(payload, encoding="latin1"),
+        1,
+        numberOfDecimals,
+        signed,
+        byteorder,
+        payloadformat,
+    )
 
-    if payloadformat == _PAYLOADFORMAT_LONG:
-        return _bytestring_to_long(
-            registerdata, signed, byteorder, numberOfDecimals
+def _check_response(response):
+    """Validate a raw RTU answer from the slave.
+
+    Args:
+        response (bytes): The raw response from the slave, including the CRC.
+
+    Raises:
+        rs485Exception (or subclasses) if there is any problem with the length,
+        the CRC or if the slave answered with an exception frame.
+
+    """
+    # Validate response length
+    if len(response) < _MINIMAL_RESPONSE_SIZE:
+        raise InvalidResponseError(
+            "Too short rs485 RTU response (minimum length "
+            + f"{_MINIMAL_RESPONSE_SIZE} bytes). Response: {response!r}"
         )
 
-    if payloadformat == _PAYLOADFORMAT_INT:
-        return _twobyte_string_to_num(
-            registerdata, numberOfDecimals, signed=signed
+    if not validate_frame(response):
+        number_of_checksum_bytes = 2
+        end = len(response) - number_of_checksum_bytes
+        received_checksum = _CRC_STRUCT.unpack_from(response, end)[0]
+        calculated_checksum = _calculate_crc(memoryview(response)[:end])
+        text = (
+            f"Checksum error: {received_checksum:#06x} instead of "
+            + f"{calculated_checksum:#06x} . The response "
+            + f"is: {response!r}"
         )
+        raise ChecksumError(text)
 
-    if payloadformat == _PAYLOADFORMAT_REGISTER:
-        return _twobyte_string_to_num(
-            registerdata, numberOfDecimals, signed=signed
+    if response[1] & _EXCEPTION_BIT:
+        raise SlaveReportedException(
+            f"The slave reported exception code {response[2]} "
+            + f"for function code {response[1] & ~_EXCEPTION_BIT}. "
+            + f"Response: {response!r}"
         )
 
 def _extract_payload(response):
@@ -199,11 +952,9 @@ def _extract_payload(response):
 
     Args:
         response (str): The raw response byte string from the slave.
-        This is different for RTU and ASCII.
 
     Returns:
-        The payload part of the *response* string. Conversion from rs485 ASCII
-        has been done if applicable.
+        The payload part of the *response* string.
 
     Raises:
         ValueError, TypeError, rs485Exception (or subclasses).
@@ -212,38 +963,32 @@ def _extract_payload(response):
     the 4 or the CRC.
 
     """
-    MINIMAL_RESPONSE_LENGTH_RTU = 4
-    plainresponse = response
+    _check_response(bytes(response, encoding="latin1"))
 
-    # Validate response length
-    if len(response) < MINIMAL_RESPONSE_LENGTH_RTU:
-        raise InvalidResponseError(
-            "Too short rs485 RTU response (minimum length "
-            + f"{MINIMAL_RESPONSE_LENGTH_RTU} bytes). Response: {response!r}"
-        )
+    # Read data payload
+    return response[2 : len(response) - 2]
 
-    calculate_checksum = _calculate_crc_string
-    number_of_checksum_bytes = 2
+def _predict_response_size(request):
+    """Calculate the number of bytes in the slave's answer to a request.
 
-    received_checksum = response[-number_of_checksum_bytes:]
-    response_without_checksum = response[0 : (len(response) - number_of_checksum_bytes)]
-    calculated_checksum = calculate_checksum(response_without_checksum)
+    Args:
+        request (bytes): The raw RTU request (slave address, function code,
+        register address, number of registers, CRC).
 
-    if received_checksum != calculated_checksum:
-        text = (
-            f"Checksum error: {received_checksum!r} instead of "
-            + f"{calculated_checksum!r} . The response "
-            + f"is: {response!r} (plain response: {plainresponse!r})"
-        )
-        raise InvalidResponseError(text)
+    Returns:
+        The size of a normal (non-exception) answer, in bytes.
 
-    # Read data payload
-    first_databyte_number = 2
+    Raises:
+        ValueError
 
-    last_databyte_number = len(response) - 2
+    """
+    functioncode = request[1]
+    if functioncode not in (3, 4):
+        raise ValueError(f"Unsupported function code: {functioncode}")
 
-    payload = response[first_databyte_number:last_databyte_number]
-    return payload
+    number_of_registers = (request[4] << 8) | request[5]
+    # Slave address, function code, byte count, register data, CRC
+    return _RESPONSE_HEADER_SIZE + 2 * number_of_registers + 2
 
 def _num_to_twobyte_string(value, numberOfDecimals=0, lsb_first=False, signed=False):
     r"""Convert a numerical value to a two-byte string, possibly scaling it.
@@ -279,77 +1024,136 @@ def _num_to_twobyte_string(value, numberOfDecimals=0, lsb_first=False, signed=Fa
     assert len(outstring) == 2
     return outstring
 
-def _twobyte_string_to_num(bytestring, numberOfDecimals=0, signed=False):
-    r"""Convert a two-byte string to a numerical value, possibly scaling it.
+def _unpack_register(buffer, offset=0, numberOfDecimals=0, signed=False):
+    """Decode one register at *offset* in a bytes-like *buffer*, possibly scaling it.
 
     Args:
-        bytestring (str): A string of length 2.
+        buffer (bytes, bytearray or memoryview): The raw data.
+        offset (int): The position of the register in *buffer*.
         numberOfDecimals (int): The number of decimals. Defaults to 0.
         signed (bol): Whether large positive values should be interpreted as negative
         values.
 
     Returns:
-        The numerical value (int or float) calculated from the ``bytestring``.
+        The numerical value (int or float).
 
     Raises:
-        TypeError, ValueError
+        InvalidResponseError
 
     """
-    formatcode = ">"  # Big-endian
-    if signed:
-        formatcode += "h"  # (Signed) short (2 bytes)
-    else:
-        formatcode += "H"  # Unsigned short (2 bytes)
-
-    fullregister = _unpack(formatcode, bytestring)
+    try:
+        fullregister = _REGISTER_STRUCTS[signed].unpack_from(buffer, offset)[0]
+    except struct.error as error:
+        raise InvalidResponseError(
+            f"The received data is probably wrong: {bytes(buffer)!r} at offset "
+            + f"{offset}: {error}"
+        )
 
     if numberOfDecimals == 0:
         return fullregister
     divisor = 10 ** numberOfDecimals
     return fullregister / float(divisor)
 
-def _bytestring_to_long(
-    bytestring, signed=False, byteorder=BYTEORDER_BIG, numberOfDecimals=0
+def _unpack_long(
+    buffer, offset=0, signed=False, byteorder=BYTEORDER_BIG, numberOfDecimals=0
 ):
-    """Convert a bytestring to a long integer.
+    """Decode a long integer at *offset* in a bytes-like *buffer*.
 
     Long integers (32 bits = 4 bytes) are stored in two consecutive 16-bit registers
     in the slave.
 
     Args:
-        bytestring (str): A string of length 4.
+        buffer (bytes, bytearray or memoryview): The raw data.
+        offset (int): The position of the first register in *buffer*.
         signed (bol): Whether large positive values should be interpreted as
         negative values.
-        number_of_registers (int): Should be 2. For error checking only.
         byteorder (int): How multi-register data should be interpreted.
+        numberOfDecimals (int): The number of decimals. Defaults to 0.
 
     Returns:
-        The numerical value (int).
+        The numerical value (int or float).
 
     Raises:
-        ValueError, TypeError
+        InvalidResponseError
 
     """
-
-    if byteorder in [BYTEORDER_BIG, BYTEORDER_BIG_SWAP]:
-        formatcode = ">"
-    else:
-        formatcode = "<"
-    if signed:
-        formatcode += "l"  # (Signed) long (4 bytes)
-    else:
-        formatcode += "L"  # Unsigned long (4 bytes)
-
-    if byteorder in [BYTEORDER_BIG_SWAP, BYTEORDER_LITTLE_SWAP]:
-        bytestring = _swap(bytestring)
-
-    fullregister = _unpack(formatcode, bytestring)
+    try:
+        if byteorder in _SWAPPED_LONG_STRUCTS:
+            first, second = _SWAPPED_LONG_STRUCTS[byteorder].unpack_from(
+                buffer, offset
+            )
+            if byteorder == BYTEORDER_BIG_SWAP:
+                fullregister = (first << 16) | second
+            else:
+                fullregister = (second << 16) | first
+            if signed and fullregister & 0x80000000:
+                fullregister -= 0x100000000
+        else:
+            longstruct = _LONG_STRUCTS[byteorder == BYTEORDER_BIG, signed]
+            fullregister = longstruct.unpack_from(buffer, offset)[0]
+    except struct.error as error:
+        raise InvalidResponseError(
+            f"The received data is probably wrong: {bytes(buffer)!r} at offset "
+            + f"{offset}: {error}"
+        )
 
     if numberOfDecimals == 0:
         return fullregister
     divisor = 10 ** numberOfDecimals
     return fullregister / float(divisor)
 
+def _twobyte_string_to_num(bytestring, numberOfDecimals=0, signed=False):
+    r"""Convert a two-byte string to a numerical value, possibly scaling it.
+
+    Thin wrapper around :func:`_unpack_register`.
+
+    Args:
+        bytestring (str): A string of length 2.
+        numberOfDecimals (int): The number of decimals. Defaults to 0.
+        signed (bol): Whether large positive values should be interpreted as negative
+        values.
+
+    Returns:
+        The numerical value (int or float) calculated from the ``bytestring``.
+
+    Raises:
+        TypeError, ValueError
+
+    """
+    packed = bytes(bytestring, encoding="latin1")
+    if len(packed) != 2:
+        raise InvalidResponseError(
+            f"The received bytestring is probably wrong: {packed!r}"
+        )
+    return _unpack_register(packed, 0, numberOfDecimals, signed)
+
+def _bytestring_to_long(
+    bytestring, signed=False, byteorder=BYTEORDER_BIG, numberOfDecimals=0
+):
+    """Convert a bytestring to a long integer.
+
+    Thin wrapper around :func:`_unpack_long`.
+
+    Args:
+        bytestring (str): A string of length 4.
+        signed (bol): Whether large positive values should be interpreted as
+        negative values.
+        byteorder (int): How multi-register data should be interpreted.
+
+    Returns:
+        The numerical value (int).
+
+    Raises:
+        ValueError, TypeError
+
+    """
+    packed = bytes(bytestring, encoding="latin1")
+    if len(packed) != 4:
+        raise InvalidResponseError(
+            f"The received bytestring is probably wrong: {packed!r}"
+        )
+    return _unpack_long(packed, 0, signed, byteorder, numberOfDecimals)
+
 def _pack(formatstring, value):
     """Pack a value into a bytestring.
 
@@ -438,291 +1242,24 @@ def _swap(bytestring):
     )
     return "".join(templist)
 
-_CRC16TABLE = (
-    0,
-    49345,
-    49537,
-    320,
-    49921,
-    960,
-    640,
-    49729,
-    50689,
-    1728,
-    1920,
-    51009,
-    1280,
-    50625,
-    50305,
-    1088,
-    52225,
-    3264,
-    3456,
-    52545,
-    3840,
-    53185,
-    52865,
-    3648,
-    2560,
-    51905,
-    52097,
-    2880,
-    51457,
-    2496,
-    2176,
-    51265,
-    55297,
-    6336,
-    6528,
-    55617,
-    6912,
-    56257,
-    55937,
-    6720,
-    7680,
-    57025,
-    57217,
-    8000,
-    56577,
-    7616,
-    7296,
-    56385,
-    5120,
-    54465,
-    54657,
-    5440,
-    55041,
-    6080,
-    5760,
-    54849,
-    53761,
-    4800,
-    4992,
-    54081,
-    4352,
-    53697,
-    53377,
-    4160,
-    61441,
-    12480,
-    12672,
-    61761,
-    13056,
-    62401,
-    62081,
-    12864,
-    13824,
-    63169,
-    63361,
-    14144,
-    62721,
-    13760,
-    13440,
-    62529,
-    15360,
-    64705,
-    64897,
-    15680,
-    65281,
-    16320,
-    16000,
-    65089,
-    64001,
-    15040,
-    15232,
-    64321,
-    14592,
-    63937,
-    63617,
-    14400,
-    10240,
-    59585,
-    59777,
-    10560,
-    60161,
-    11200,
-    10880,
-    59969,
-    60929,
-    11968,
-    12160,
-    61249,
-    11520,
-    60865,
-    60545,
-    11328,
-    58369,
-    9408,
-    9600,
-    58689,
-    9984,
-    59329,
-    59009,
-    9792,
-    8704,
-    58049,
-    58241,
-    9024,
-    57601,
-    8640,
-    8320,
-    57409,
-    40961,
-    24768,
-    24960,
-    41281,
-    25344,
-    41921,
-    41601,
-    25152,
-    26112,
-    42689,
-    42881,
-    26432,
-    42241,
-    26048,
-    25728,
-    42049,
-    27648,
-    44225,
-    44417,
-    27968,
-    44801,
-    28608,
-    28288,
-    44609,
-    43521,
-    27328,
-    27520,
-    43841,
-    26880,
-    43457,
-    43137,
-    26688,
-    30720,
-    47297,
-    47489,
-    31040,
-    47873,
-    31680,
-    31360,
-    47681,
-    48641,
-    32448,
-    32640,
-    48961,
-    32000,
-    48577,
-    48257,
-    31808,
-    46081,
-    29888,
-    30080,
-    46401,
-    30464,
-    47041,
-    46721,
-    30272,
-    29184,
-    45761,
-    45953,
-    29504,
-    45313,
-    29120,
-    28800,
-    45121,
-    20480,
-    37057,
-    37249,
-    20800,
-    37633,
-    21440,
-    21120,
-    37441,
-    38401,
-    22208,
-    22400,
-    38721,
-    21760,
-    38337,
-    38017,
-    21568,
-    39937,
-    23744,
-    23936,
-    40257,
-    24320,
-    40897,
-    40577,
-    24128,
-    23040,
-    39617,
-    39809,
-    23360,
-    39169,
-    22976,
-    22656,
-    38977,
-    34817,
-    18624,
-    18816,
-    35137,
-    19200,
-    35777,
-    35457,
-    19008,
-    19968,
-    36545,
-    36737,
-    20288,
-    36097,
-    19904,
-    19584,
-    35905,
-    17408,
-    33985,
-    34177,
-    17728,
-    34561,
-    18368,
-    18048,
-    34369,
-    33281,
-    17088,
-    17280,
-    33601,
-    16640,
-    33217,
-    32897,
-    16448,
-)
-"""CRC-16 lookup table with 256 elements.
-
-Built with this code::
-
-    poly=0xA001
-    table = []
-    for index in range(256):
-        data = index << 1
-        crc = 0
-        for _ in range(8, 0, -1):
-            data >>= 1
-            if (data ^ crc) & 0x0001:
-                crc = (crc >> 1) ^ poly
-            else:
-                crc >>= 1
-        table.append(crc)
-    output = ''
-    for i, m in enumerate(table):
-        if not i%11:
-            output += "\n"
-        output += f"{m:5.0f}, "
-    print output
-"""
+def _calculate_crc(data):
+    """Calculate CRC-16 for rs485.
+
+    Args:
+        data (bytes, bytearray or memoryview): An arbitrary-length message
+        (without the CRC).
+
+    Returns:
+        The CRC (int). It is sent with the least significant byte first.
+
+    """
+    return crc16_wide(data)
 
 def _calculate_crc_string(inputstring):
     """Calculate CRC-16 for rs485.
 
+    Thin wrapper around :func:`_calculate_crc`.
+
     Args:
         inputstring (str): An arbitrary-length message (without the CRC).
 
@@ -730,10 +1267,5 @@ def _calculate_crc_string(inputstring):
         A two-byte CRC string, where the least significant byte is first.
 
     """
-    # Preload a 16-bit register with ones
-    register = 0xFFFF
-
-    for char in inputstring:
-        register = (register >> 8) ^ _CRC16TABLE[(register ^ ord(char)) & 0xFF]
-
-    return _num_to_twobyte_string(register, lsb_first=True)
+    crc = _calculate_crc(bytes(inputstring, encoding="latin1"))
+    return str(_CRC_STRUCT.pack(crc), encoding="latin1")
@@ -1,5 +1,7 @@
 import logging
-import re
+import time
+from dataclasses import dataclass
+from typing import Callable, Optional
 
 from homeassistant.components.sensor import (
     SensorDeviceClass,
@@ -7,17 +9,7 @@ from homeassistant.components.sensor import (
     SensorStateClass,
 )
 from homeassistant.config_entries import ConfigEntry
-from homeassistant.const import (
-#    PERCENTAGE,
-#    POWER_VOLT_AMPERE_REACTIVE,
-    UnitOfApparentPower,
-    UnitOfElectricCurrent,
-    UnitOfElectricPotential,
-    UnitOfEnergy,
-    UnitOfFrequency,
-    UnitOfPower,
-    UnitOfTemperature,
-)
+from homeassistant.const import UnitOfInformation, UnitOfTime
 from homeassistant.core import HomeAssistant, callback
 from homeassistant.helpers.entity import EntityCategory
 from homeassistant.helpers.entity_platform import AddEntitiesCallback
@@ -42,11 +34,162 @@ from .const import (
 #    SunSpecAccum,
     #SunSpecNotImpl,
 )
+from .registers import FIELD_INDEX, REGISTERS
 #from .helpers import  update_accum
 # scale_factor, float_to_hex
 _LOGGER = logging.getLogger(__name__)
 _LOGGER.setLevel(logging.DEBUG)
 
+
+def _ms(seconds):
+    return None if seconds is None else round(seconds * 1000, 1)
+
+
+@dataclass(frozen=True)
+class MetricField:
+    """A metric of the hub (or of an inverter) shown by a diagnostic sensor."""
+
+    key: str
+    name: str
+    value: Callable  # hub or inverter -> state
+    attributes: Optional[Callable] = None  # hub or inverter -> extra attributes
+    device_class: Optional[SensorDeviceClass] = None
+    state_class: Optional[SensorStateClass] = SensorStateClass.TOTAL_INCREASING
+    unit: Optional[str] = None
+    icon: Optional[str] = None
+    # the byte counters change every cycle, they are enabled on demand
+    enabled_default: bool = True
+
+
+def _cycle_attributes(hub):
+    duration = hub.metrics.cycle_duration
+    return {
+        "p50": _ms(duration.percentile(0.5)),
+        "p95": _ms(duration.percentile(0.95)),
+        "p99": _ms(duration.percentile(0.99)),
+        "max": _ms(duration.max),
+        "cycles": hub.metrics.cycles,
+        "failed_cycles": hub.metrics.failed_cycles,
+    }
+
+
+def _rtt_attributes(hub):
+    rtt = hub.transport_metrics.rtt
+    request_timeout = hub.request_timeout
+    return {
+        "p95": _ms(rtt.percentile(0.95)),
+        "p99": _ms(rtt.percentile(0.99)),
+        "samples": len(rtt),
+        "timeout": None if request_timeout is None else _ms(request_timeout.timeout),
+    }
+
+
+def _queue_attributes(hub):
+    queue = hub.queue_metrics
+    return {
+        "p95": _ms(queue.wait.percentile(0.95)),
+        "depth": queue.depth,
+        "max_depth": queue.max_depth,
+        "queued": queue.queued,
+    }
+
+
+METRICS = (
+    MetricField(
+        "cycle_duration",
+        "Cycle duration",
+        lambda hub: _ms(hub.metrics.last_cycle_duration),
+        _cycle_attributes,
+        device_class=SensorDeviceClass.DURATION,
+        state_class=SensorStateClass.MEASUREMENT,
+        unit=UnitOfTime.MILLISECONDS,
+    ),
+    MetricField(
+        "request_rtt",
+        "Request RTT",
+        lambda hub: _ms(hub.transport_metrics.rtt.percentile(0.5)),
+        _rtt_attributes,
+        device_class=SensorDeviceClass.DURATION,
+        state_class=SensorStateClass.MEASUREMENT,
+        unit=UnitOfTime.MILLISECONDS,
+    ),
+    MetricField(
+        "timeouts",
+        "Timeouts",
+        lambda hub: hub.transport_metrics.timeouts,
+        icon="mdi:timer-alert-outline",
+    ),
+    MetricField(
+        "crc_errors",
+        "CRC errors",
+        lambda hub: hub.transport_metrics.crc_errors,
+        icon="mdi:alert-circle-outline",
+    ),
+    MetricField(
+        "reconnects",
+        "Reconnects",
+        lambda hub: hub.transport_metrics.reconnects,
+        icon="mdi:lan-connect",
+    ),
+    MetricField(
+        "retries",
+        "Retries",
+        lambda hub: hub.metrics.retries + hub.transport_metrics.block_retries,
+        icon="mdi:refresh",
+    ),
+    MetricField(
+        "bytes_received",
+        "Bytes received",
+        lambda hub: hub.transport_metrics.bytes_in,
+        device_class=SensorDeviceClass.DATA_SIZE,
+        unit=UnitOfInformation.BYTES,
+        enabled_default=False,
+    ),
+    MetricField(
+        "bytes_sent",
+        "Bytes sent",
+        lambda hub: hub.transport_metrics.bytes_out,
+        device_class=SensorDeviceClass.DATA_SIZE,
+        unit=UnitOfInformation.BYTES,
+        enabled_default=False,
+    ),
+    # the wait for the gateway connection, when other hubs share it
+    MetricField(
+        "queue_wait",
+        "Queue wait",
+        lambda hub: _ms(hub.queue_metrics.wait.percentile(0.5)),
+        _queue_attributes,
+        device_class=SensorDeviceClass.DURATION,
+        state_class=SensorStateClass.MEASUREMENT,
+        unit=UnitOfTime.MILLISECONDS,
+        enabled_default=False,
+    ),
+)
+
+def _read_attributes(inverter):
+    duration = inverter.read_duration
+    return {
+        "p50": _ms(duration.percentile(0.5)),
+        "p95": _ms(duration.percentile(0.95)),
+        "max": _ms(duration.max),
+    }
+
+
+# Metrics of every inverter on the bus; the time until its blocks are in within
+# a cycle shows the inverters slowing down the sweep
+INVERTER_METRICS = (
+    MetricField(
+        "read_duration",
+        "Read duration",
+        lambda inverter: _ms(inverter.last_read_duration),
+        _read_attributes,
+        device_class=SensorDeviceClass.DURATION,
+        state_class=SensorStateClass.MEASUREMENT,
+        unit=UnitOfTime.MILLISECONDS,
+        enabled_default=False,
+    ),
+)
+
 async def async_setup_entry(
     hass: HomeAssistant,
     config_entry: ConfigEntry,
@@ -55,6 +198,14 @@ async def async_setup_entry(
     hub = hass.data[DOMAIN][config_entry.entry_id]["hub"]
     coordinator = hass.data[DOMAIN][config_entry.entry_id]["coordinator"]
 
+    entities = create_entities(hub, config_entry, coordinator)
+
+    _LOGGER.debug(entities)
+    if entities:
+        async_add_entities(entities)
+
+def create_entities(hub, config_entry, coordinator) -> list:
+    """Return the sensor entities of all inverters of a hub."""
     entities = []
 
     for inverter in hub.inverters:
@@ -62,50 +213,34 @@ async def async_setup_entry(
         entities.append(Version(inverter, config_entry, coordinator))
         entities.append(SolarEdgeInverterStatus(inverter, config_entry, coordinator))
         entities.append(StatusVendor(inverter, config_entry, coordinator))
-        entities.append(ACCurrentSensor(inverter, config_entry, coordinator, "A"))
-        entities.append(ACCurrentSensor(inverter, config_entry, coordinator, "B"))
-        entities.append(ACCurrentSensor(inverter, config_entry, coordinator, "C"))
-        entities.append(VoltageSensor(inverter, config_entry, coordinator, "BC"))
-        entities.append(VoltageSensor(inverter, config_entry, coordinator, "CA"))
-        entities.append(VoltageSensor(inverter, config_entry, coordinator, "AB"))
-        entities.append(ACPower(inverter, config_entry, coordinator))
-        entities.append(ACFrequency(inverter, config_entry, coordinator))
-        #entities.append(ACVoltAmp(inverter, config_entry, coordinator))
-        #entities.append(ACVoltAmpReactive(inverter, config_entry, coordinator))
-        #entities.append(ACPowerFactor(inverter, config_entry, coordinator))
-        entities.append(ACEnergy(inverter, config_entry, coordinator))
-        entities.append(DCCurrent(inverter, config_entry, coordinator, "1"))
-        entities.append(DCCurrent(inverter, config_entry, coordinator, "2"))
-        entities.append(DCVoltage(inverter, config_entry, coordinator, "1"))
-        entities.append(DCVoltage(inverter, config_entry, coordinator, "2"))
-        #entities.append(DCPower(inverter, config_entry, coordinator))
-        entities.append(HeatSinkTemperature(inverter, config_entry, coordinator))
-        #entities.append(SolarEdgeActivePowerLimit(inverter, config_entry, coordinator))
-        #entities.append(SolarEdgeCosPhi(inverter, config_entry, coordinator))
-        entities.append(ACGenerated(inverter, config_entry, coordinator, 
-                                    "lifetimeproduction", 0))
-        entities.append(ACGenerated(inverter, config_entry, coordinator, 
-                                    "lastmonth", 0))
-        entities.append(ACGenerated(inverter, config_entry, coordinator, 
-                                    "monthenergy", 1))
-        entities.append(ACGenerated(inverter, config_entry, coordinator, 
-                                    "yearenergy", 0))
-        entities.append(ACGenerated(inverter, config_entry, coordinator,  
-                                    "lastyear", 0))
-        entities.append(ACGenerated(inverter, config_entry, coordinator, 
-                                    "today", 3))
-        entities.append(ACGenerated(inverter, config_entry, coordinator, 
-                                    "yesterday", 3))
-
-
-    _LOGGER.debug(entities)
-    if entities:
-        async_add_entities(entities)
+        for field in REGISTERS:
+            if field.name is not None:
+                entities.append(
+                    SolarEdgeRegisterSensor(inverter, config_entry, coordinator, field)
+                )
+        for metric in INVERTER_METRICS:
+            entities.append(
+                SolarEdgeMetricSensor(
+                    inverter, config_entry, coordinator, inverter, metric
+                )
+            )
+
+    # The metrics are of the gateway connection, shown on the first inverter
+    if hub.inverters:
+        for metric in METRICS:
+            entities.append(
+                SolarEdgeMetricSensor(
+                    hub.inverters[0], config_entry, coordinator, hub, metric
+                )
+            )
+    return entities
 
 class SolarEdgeSensorBase(CoordinatorEntity, SensorEntity):
     should_poll = False
     #suggested_display_precision = 3
     _attr_has_entity_name = True
+    # snapshot index of the value shown, None if not read every cycle
+    _model_index = None
     
     def __init__(self, platform, config_entry, coordinator):
         """Pass coordinator to CoordinatorEntity."""
@@ -113,6 +248,8 @@ class SolarEdgeSensorBase(CoordinatorEntity, SensorEntity):
         """Initialize the sensor."""
         self._platform = platform
         self._config_entry = config_entry
+        self._last_write = time.monotonic()
+        self._last_available = None
     
     @property
     def device_info(self):
@@ -128,12 +265,26 @@ class SolarEdgeSensorBase(CoordinatorEntity, SensorEntity):
 
     @property
     def available(self) -> bool:
-        return self._platform.online
+        if self._model_index is None:
+            return self._platform.online
+        # a value is shown as long as it is not too old, even when the last
+        # reads of its register block failed
+        return self.coordinator.is_fresh(self._platform.snapshot, self._model_index)
 
     @callback
     def _handle_coordinator_update(self) -> None:
+        available = self.available
+        if available == self._last_available and not self._should_publish():
+            return
+        self._last_available = available
+        self._last_write = time.monotonic()
         self.async_write_ha_state()
 
+    def _should_publish(self) -> bool:
+        return self.coordinator.should_publish(
+            self._platform.inverter_unit_id, self._model_index, self._last_write
+        )
+
 class SolarEdgeDevice(SolarEdgeSensorBase):
     entity_category = EntityCategory.DIAGNOSTIC
 
@@ -269,370 +420,79 @@ class Version(SolarEdgeSensorBase):
     def native_value(self):
         return self._platform.fw_version
 
-class ACCurrentSensor(SolarEdgeSensorBase):
-    device_class = SensorDeviceClass.CURRENT
-    state_class = SensorStateClass.MEASUREMENT
-    native_unit_of_measurement = UnitOfElectricCurrent.AMPERE
-    suggested_display_precision = 1
+class SolarEdgeRegisterSensor(SolarEdgeSensorBase):
+    """Sensor for a field of the register map, see registers.py."""
 
-    def __init__(self, platform, config_entry, coordinator, phase: str = None):
+    def __init__(self, platform, config_entry, coordinator, field):
         super().__init__(platform, config_entry, coordinator)
         """Initialize the sensor."""
-        self._phase = phase
+        self._field = field
+        self._model_index = FIELD_INDEX[field.key]
+        self._attr_name = field.name
+        self._attr_device_class = field.device_class
+        self._attr_state_class = field.state_class
+        self._attr_native_unit_of_measurement = field.unit
+        self._attr_suggested_display_precision = field.precision
+        self._attr_icon = field.icon
 
     @property
     def unique_id(self) -> str:
-        if self._phase is None:
-            return f"{self._platform.uid_base}_ac_current"
-        else:
-            return f"{self._platform.uid_base}_ac_current_{self._phase.lower()}"
-
-    @property
-    def name(self) -> str:
-        if self._phase is None:
-            return "AC Current"
-        else:
-            return f"AC Current {self._phase.upper()}"
+        return f"{self._platform.uid_base}_{self._field.unique_id or self._field.key}"
 
     @property
     def native_value(self):
-        if self._phase is None:
-            model_key = "ac_current"
-        else:
-            model_key = f"ac_current_{self._phase.lower()}"
-
-        return self._platform.decoded_model[model_key]
-
-class ACGenerated(SolarEdgeSensorBase):
-    device_class = SensorDeviceClass.ENERGY
-    state_class = SensorStateClass.TOTAL_INCREASING
-    native_unit_of_measurement = UnitOfEnergy.KILO_WATT_HOUR
-    suggested_display_precision = 0
-    
-    def __init__(self, platform, config_entry, coordinator, phase: str = None, 
-                 suggested_display_precision: int = 0):
-        super().__init__(platform, config_entry, coordinator)
-        """Initialize the sensor."""
-        self._phase = phase
-        self.suggested_display_precision = suggested_display_precision
-
-    @property
-    def unique_id(self) -> str:
-        if self._phase is None:
-            return f"{self._platform.uid_base}_ac_generated"
-        else:
-            return f"{self._platform.uid_base}_ac_generated_{self._phase.lower()}"
+        return self._platform.snapshot[self._model_index]
 
-    @property
-    def name(self) -> str:
-        if self._phase is None:
-            return "AC Generated"
-        else:
-            return f"AC Generated {self._phase}"
-
-    @property
-    def native_value(self):
-        if self._phase is None:
-            model_key = "ac_generated"
-        else:
-            model_key = f"ac_generated_{self._phase.lower()}"
-
-        return self._platform.decoded_model[model_key]
-
-class VoltageSensor(SolarEdgeSensorBase):
-    device_class = SensorDeviceClass.VOLTAGE
-    state_class = SensorStateClass.MEASUREMENT
-    native_unit_of_measurement = UnitOfElectricPotential.VOLT
-    suggested_display_precision = 0
-
-    def __init__(self, platform, config_entry, coordinator, phase: str = None):
-        super().__init__(platform, config_entry, coordinator)
-        """Initialize the sensor."""
-        self._phase = phase
-
-    @property
-    def unique_id(self) -> str:
-        if self._phase is None:
-            return f"{self._platform.uid_base}_ac_voltage"
-        else:
-            return f"{self._platform.uid_base}_ac_voltage_{self._phase.lower()}"
+class SolarEdgeMetricSensor(SolarEdgeSensorBase):
+    """Diagnostic sensor for a metric of the hub or an inverter, see metrics.py."""
 
-    @property
-    def name(self) -> str:
-        if self._phase is None:
-            return "AC Voltage"
-        else:
-            return f"AC Voltage {self._phase}"
-
-    @property
-    def native_value(self):
-        if self._phase is None:
-            model_key = "ac_voltage"
-        else:
-            model_key = f"ac_voltage_{self._phase.lower()}"
-
-        return self._platform.decoded_model[model_key]
-
-class ACPower(SolarEdgeSensorBase):
-    device_class = SensorDeviceClass.ENERGY
-    #state_class = SensorStateClass.MEASUREMENT
-    native_unit_of_measurement = UnitOfEnergy.KILO_WATT_HOUR
-    icon = "mdi:solar-power"
-    suggested_display_precision = 3
-
-    def __init__(self, platform, config_entry, coordinator, phase: str = None):
-        super().__init__(platform, config_entry, coordinator)
-        """Initialize the sensor."""
-        self._phase = phase
-
-    @property
-    def unique_id(self) -> str:
-        if self._phase is None:
-            return f"{self._platform.uid_base}_ac_power_output"
-        else:
-            return f"{self._platform.uid_base}_ac_power_output_{self._phase.lower()}"
-
-    @property
-    def name(self) -> str:
-        if self._phase is None:
-            return "AC Power"
-        else:
-            return f"AC Power {self._phase.upper()}"
-
-    @property
-    def native_value(self):
-        if self._phase is None:
-            model_key = "ac_power_output"
-        else:
-            model_key = f"ac_power_output_{self._phase.lower()}"
-
-        return self._platform.decoded_model[model_key]
-
-class ACFrequency(SolarEdgeSensorBase):
-    device_class = SensorDeviceClass.FREQUENCY
-    state_class = SensorStateClass.MEASUREMENT
-    native_unit_of_measurement = UnitOfFrequency.HERTZ
-    suggested_display_precision = 1
-    entity_registry_enabled_default = True
-
-    def __init__(self, platform, config_entry, coordinator):
-        super().__init__(platform, config_entry, coordinator)
-        """Initialize the sensor."""
-
-    @property
-    def unique_id(self) -> str:
-        return f"{self._platform.uid_base}_ac_frequency"
-
-    @property
-    def name(self) -> str:
-        return "AC Frequency"
-
-    @property
-    def native_value(self):
-                return self._platform.decoded_model["ac_frequency"]
-
-class ACVoltAmp(SolarEdgeSensorBase):
-    device_class = SensorDeviceClass.APPARENT_POWER
-    state_class = SensorStateClass.MEASUREMENT
-    native_unit_of_measurement = UnitOfApparentPower.VOLT_AMPERE
-    suggested_display_precision = 0
+    entity_category = EntityCategory.DIAGNOSTIC
 
-    def __init__(self, platform, config_entry, coordinator, phase: str = None):
+    def __init__(self, platform, config_entry, coordinator, source, metric):
         super().__init__(platform, config_entry, coordinator)
         """Initialize the sensor."""
-        self._phase = phase
+        self._source = source
+        self._metric = metric
+        self._last_value = None
+        self._attr_name = metric.name
+        self._attr_device_class = metric.device_class
+        self._attr_state_class = metric.state_class
+        self._attr_native_unit_of_measurement = metric.unit
+        self._attr_icon = metric.icon
+        self._attr_entity_registry_enabled_default = metric.enabled_default
 
     @property
     def unique_id(self) -> str:
-        if self._phase is None:
-            return f"{self._platform.uid_base}_ac_va"
-        else:
-            return f"{self._platform.uid_base}_ac_va_{self._phase.lower()}"
+        return f"{self._platform.uid_base}_{self._metric.key}"
 
     @property
-    def name(self) -> str:
-        if self._phase is None:
-            return "AC VA"
-        else:
-            return f"AC VA {self._phase.upper()}"
+    def available(self) -> bool:
+        return True
 
     @property
     def native_value(self):
-        if self._phase is None:
-            model_key = "ac_va"
-        else:
-            model_key = f"ac_va_{self._phase.lower()}"
-
-
-        return self._platform.decoded_model[model_key]
-
-class ACEnergy(SolarEdgeSensorBase):
-    device_class = SensorDeviceClass.ENERGY
-    state_class = SensorStateClass.TOTAL_INCREASING
-    native_unit_of_measurement = UnitOfEnergy.KILO_WATT_HOUR
-    suggested_display_precision = -3
-
-    def __init__(self, platform, config_entry, coordinator, phase: str = None):
-        super().__init__(platform, config_entry, coordinator)
-        """Initialize the sensor."""
-        self._phase = phase
-        self.last = None
+        return self._metric.value(self._source)
 
     @property
-    def unique_id(self) -> str:
-        if self._phase is None:
-            return f"{self._platform.uid_base}_ac_energy_kwh"
-        else:
-            return f"{self._platform.uid_base}_{self._phase.lower()}_kwh"
-
-    @property
-    def icon(self) -> str:
-        if self._phase is None:
-            return None
-
-        elif re.match("import", self._phase.lower()):
-            return "mdi:transmission-tower-export"
-
-        elif re.match("export", self._phase.lower()):
-            return "mdi:transmission-tower-import"
-
-        else:
+    def extra_state_attributes(self):
+        if self._metric.attributes is None:
             return None
-
-    @property
-    def name(self) -> str:
-        if self._phase is None:
-            return "AC Energy kWh"
-        else:
-            return f"{re.sub('_', ' ', self._phase)} kWh"
-
-    @property
-    def native_value(self):
-        if self._phase is None:
-            model_key = "ac_energy_wh"
-        else:
-            model_key = f"ac_energy_wh_{self._phase.lower()}"
-
-        return self._platform.decoded_model[model_key]
-
-class DCCurrent(SolarEdgeSensorBase):
-    device_class = SensorDeviceClass.CURRENT
-    state_class = SensorStateClass.MEASUREMENT
-    native_unit_of_measurement = UnitOfElectricCurrent.AMPERE
-    icon = "mdi:current-dc"
-    suggested_display_precision = 1
-
-    def __init__(self, platform, config_entry, coordinator, phase: str = None):
-        super().__init__(platform, config_entry, coordinator)
-        """Initialize the sensor."""
-        self._phase = phase
-
-    @property
-    def unique_id(self) -> str:
-        if self._phase is None:
-            return f"{self._platform.uid_base}_dc_current"
-        else:
-            return f"{self._platform.uid_base}_dc_current_{self._phase.lower()}"
-
-    @property
-    def name(self) -> str:
-        if self._phase is None:
-            return "DC Current"
-        else:
-            return f"DC Current {self._phase.upper()}"
-
-    @property
-    def native_value(self):
-        if self._phase is None:
-            model_key = "dc_current"
-        else:
-            model_key = f"dc_current_{self._phase.lower()}"
-
-        return self._platform.decoded_model[model_key]
-
-class DCVoltage(SolarEdgeSensorBase):
-    device_class = SensorDeviceClass.VOLTAGE
-    state_class = SensorStateClass.MEASUREMENT
-    native_unit_of_measurement = UnitOfElectricPotential.VOLT
-    suggested_display_precision = 1
-
-    def __init__(self, platform, config_entry, coordinator, phase: str = None):
-        super().__init__(platform, config_entry, coordinator)
-        """Initialize the sensor."""
-        self._phase = phase
-
-    @property
-    def unique_id(self) -> str:
-        if self._phase is None:
-            return f"{self._platform.uid_base}_dc_voltage"
-        else:
-            return f"{self._platform.uid_base}_dc_voltage_{self._phase.lower()}"
-
-    @property
-    def name(self) -> str:
-        if self._phase is None:
-            return "DC Voltage"
-        else:
-            return f"DC Voltage {self._phase.upper()}"
-
-    @property
-    def native_value(self):
-        if self._phase is None:
-            model_key = "dc_voltage"
-        else:
-            model_key = f"dc_voltage_{self._phase.lower()}"
-
-        return self._platform.decoded_model[model_key]
-
-class DCPower(SolarEdgeSensorBase):
-    device_class = SensorDeviceClass.POWER
-    state_class = SensorStateClass.MEASUREMENT
-    native_unit_of_measurement = UnitOfPower.WATT
-    icon = "mdi:solar-power"
-    suggested_display_precision = 0
-
-    def __init__(self, platform, config_entry, coordinator):
-        super().__init__(platform, config_entry, coordinator)
-        """Initialize the sensor."""
-
-    @property
-    def unique_id(self) -> str:
-        return f"{self._platform.uid_base}_dc_power"
-
-    @property
-    def name(self) -> str:
-        return "DC Power"
-
-    @property
-    def native_value(self):
-       
-        return self._platform.decoded_model["i_dc_power"]
-
-class HeatSinkTemperature(SolarEdgeSensorBase):
-    device_class = SensorDeviceClass.TEMPERATURE
-    state_class = SensorStateClass.MEASUREMENT
-    native_unit_of_measurement = UnitOfTemperature.CELSIUS
-    suggested_display_precision = 1
-
-    def __init__(self, platform, config_entry, coordinator):
-        super().__init__(platform, config_entry, coordinator)
-        """Initialize the sensor."""
-
-    @property
-    def unique_id(self) -> str:
-        return f"{self._platform.uid_base}_temp_sink"
-
-    @property
-    def name(self) -> str:
-        return "Temp Sink"
-
-    @property
-    def native_value(self):
-        return self._platform.decoded_model["i_temp_sink"]
+        return self._metric.attributes(self._source)
+
+    def _should_publish(self) -> bool:
+        value = self.native_value
+        if (
+            value == self._last_value
+            and time.monotonic() - self._last_write < self.coordinator.max_silence
+        ):
+            return False
+        self._last_value = value
+        return True
 
 class SolarEdgeStatusSensor(SolarEdgeSensorBase):
     device_class = SensorDeviceClass.ENUM
     entity_category = EntityCategory.DIAGNOSTIC
+    _model_index = FIELD_INDEX["i_status"]
 
     def __init__(self, platform, config_entry, coordinator):
         super().__init__(platform, config_entry, coordinator)
@@ -648,10 +508,11 @@ class SolarEdgeStatusSensor(SolarEdgeSensorBase):
 
     @property
     def native_value(self):
-        return str(DEVICE_STATUS_TEXT[self._platform.decoded_model["i_status"]])
+        return str(DEVICE_STATUS_TEXT[self._platform.snapshot[self._model_index]])
 
 class SolarEdgeInverterStatus(SolarEdgeStatusSensor):
     options = list(DEVICE_STATUS_TEXT.values())
+    _model_index = FIELD_INDEX["i_status"]
 
     def __init__(self, platform, config_entry, coordinator):
         super().__init__(platform, config_entry, coordinator)
@@ -664,9 +525,9 @@ class SolarEdgeInverterStatus(SolarEdgeStatusSensor):
     @property
     def native_value(self):
         _LOGGER.debug(" native_value i_status")
-        _LOGGER.debug(self._platform.decoded_model["i_status"])
-        _LOGGER.debug(DEVICE_STATUS_TEXT[self._platform.decoded_model["i_status"]])
-        return DEVICE_STATUS_TEXT[self._platform.decoded_model["i_status"]]
+        _LOGGER.debug(self._platform.snapshot[self._model_index])
+        _LOGGER.debug(DEVICE_STATUS_TEXT[self._platform.snapshot[self._model_index]])
+        return DEVICE_STATUS_TEXT[self._platform.snapshot[self._model_index]]
 
     @property
     def extra_state_attributes(self):
@@ -674,12 +535,12 @@ class SolarEdgeInverterStatus(SolarEdgeStatusSensor):
         _LOGGER.debug(" extra_state_attributes")
 
         try:
-            if self._platform.decoded_model["i_status"] in DEVICE_STATUS:
+            if self._platform.snapshot[self._model_index] in DEVICE_STATUS:
                 _LOGGER.debug("1")
                 attrs["status_text"] = DEVICE_STATUS_TEXT[
-                    self._platform.decoded_model["i_status"]
+                    self._platform.snapshot[self._model_index]
                 ]
-                attrs["status_value"] = self._platform.decoded_model["i_status"]
+                attrs["status_value"] = self._platform.snapshot[self._model_index]
             _LOGGER.debug("2")
         except KeyError:
             pass
@@ -691,6 +552,7 @@ class StatusVendor(SolarEdgeSensorBase):
     device_class = SensorDeviceClass.ENUM
     entity_category = EntityCategory.DIAGNOSTIC
     options = list(DEVICE_STATUS_TEXT.values())
+    _model_index = FIELD_INDEX["i_status_vendor"]
 
     def __init__(self, platform, config_entry, coordinator):
         super().__init__(platform, config_entry, coordinator)
@@ -707,10 +569,10 @@ class StatusVendor(SolarEdgeSensorBase):
     @property
     def native_value(self):
         _LOGGER.debug("i_status_vendor")
-        _LOGGER.debug(self._platform.decoded_model["i_status_vendor"])
-        _LOGGER.debug(DEVICE_STATUS_TEXT[self._platform.decoded_model["i_status_vendor"]])
+        _LOGGER.debug(self._platform.snapshot[self._model_index])
+        _LOGGER.debug(DEVICE_STATUS_TEXT[self._platform.snapshot[self._model_index]])
 
-        return DEVICE_STATUS_TEXT[self._platform.decoded_model["i_status_vendor"]]
+        return DEVICE_STATUS_TEXT[self._platform.snapshot[self._model_index]]
     
     @property
     def extra_state_attributes(self):
@@ -718,12 +580,12 @@ class StatusVendor(SolarEdgeSensorBase):
         _LOGGER.debug("i_status_vendor extra_state_attributes")
 
         try:
-            if self._platform.decoded_model["i_status_vendor"] in DEVICE_STATUS_TEXT:
+            if self._platform.snapshot[self._model_index] in DEVICE_STATUS_TEXT:
                 _LOGGER.debug("3")
                 attrs["status_text"] = DEVICE_STATUS_TEXT[
-                    self._platform.decoded_model["i_status_vendor"]
+                    self._platform.snapshot[self._model_index]
                 ]
-                attrs["status_value"] = self._platform.decoded_model["i_status_vendor"]
+                attrs["status_value"] = self._platform.snapshot[self._model_index]
 
         except KeyError:
             pass
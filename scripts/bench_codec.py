@@ -0,0 +1,379 @@
+"""Microbenchmarks for the codec functions of rs485eth.py.
+
+Times the string based codec of the original rs485eth.py (_calculate_crc_string,
+_extract_payload, _parse_payload, _bytestring_to_long, _twobyte_string_to_num,
+_swap) on frames as the inverter sends them, next to the bytes based functions
+used on the poll path, and decodes a fleet-sized batch of 10000 answers both
+ways. The original functions are copied below, as the helpers of the same names
+in rs485eth.py now wrap the bytes based code. The register values come from
+the simulated inverter of scripts/simulator.py; no gateway is needed.
+
+Usage: python scripts/bench_codec.py [--number N] [--repeat R] [--batch B]
+"""
+import argparse
+import os
+import struct
+import sys
+import timeit
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+from custom_components.solaredge_rs485 import rs485eth  # noqa: E402
+from custom_components.solaredge_rs485.registers import (  # noqa: E402
+    REGISTERS,
+    RegisterMap,
+)
+from simulator import SimulatedInverter, with_crc  # noqa: E402
+
+# The string based codec of the original rs485eth.py, unchanged apart from the
+# docstrings, the wording of the errors and the CRC table, which is computed
+# rather than listed.
+
+BYTEORDER_BIG = 0
+BYTEORDER_LITTLE = 1
+BYTEORDER_BIG_SWAP = 2
+BYTEORDER_LITTLE_SWAP = 3
+
+_PAYLOADFORMAT_LONG = "long"
+_PAYLOADFORMAT_INT = "int"
+_PAYLOADFORMAT_REGISTER = "register"
+
+
+def _make_crc16_table():
+    table = []
+    for index in range(256):
+        crc = index
+        for _ in range(8):
+            crc = (crc >> 1) ^ 0xA001 if crc & 1 else crc >> 1
+        table.append(crc)
+    return tuple(table)
+
+
+_CRC16TABLE = _make_crc16_table()
+
+
+def _parse_payload(
+    payload,
+    numberOfDecimals,
+    signed,
+    byteorder,
+    payloadformat,
+):
+    registerdata = payload[1:]
+
+    if payloadformat == _PAYLOADFORMAT_LONG:
+        return _bytestring_to_long(registerdata, signed, byteorder, numberOfDecimals)
+
+    if payloadformat == _PAYLOADFORMAT_INT:
+        return _twobyte_string_to_num(registerdata, numberOfDecimals, signed=signed)
+
+    if payloadformat == _PAYLOADFORMAT_REGISTER:
+        return _twobyte_string_to_num(registerdata, numberOfDecimals, signed=signed)
+
+
+def _extract_payload(response):
+    MINIMAL_RESPONSE_LENGTH_RTU = 4
+    plainresponse = response
+
+    # Validate response length
+    if len(response) < MINIMAL_RESPONSE_LENGTH_RTU:
+        raise rs485eth.InvalidResponseError(
+            "Too short rs485 RTU response (minimum length "
+            + f"{MINIMAL_RESPONSE_LENGTH_RTU} bytes). Response: {response!r}"
+        )
+
+    calculate_checksum = _calculate_crc_string
+    number_of_checksum_bytes = 2
+
+    received_checksum = response[-number_of_checksum_bytes:]
+    response_without_checksum = response[0 : (len(response) - number_of_checksum_bytes)]
+    calculated_checksum = calculate_checksum(response_without_checksum)
+
+    if received_checksum != calculated_checksum:
+        text = (
+            f"Checksum error: {received_checksum!r} instead of "
+            + f"{calculated_checksum!r} . The response "
+            + f"is: {response!r} (plain response: {plainresponse!r})"
+        )
+        raise rs485eth.InvalidResponseError(text)
+
+    # Read data payload
+    first_databyte_number = 2
+
+    last_databyte_number = len(response) - 2
+
+    payload = response[first_databyte_number:last_databyte_number]
+    return payload
+
+
+def _num_to_twobyte_string(value, numberOfDecimals=0, lsb_first=False, signed=False):
+    multiplier = 10**numberOfDecimals
+    integer = int(float(value) * multiplier)
+
+    if lsb_first:
+        formatcode = "<"  # Little-endian
+    else:
+        formatcode = ">"  # Big-endian
+    if signed:
+        formatcode += "h"  # (Signed) short (2 bytes)
+    else:
+        formatcode += "H"  # Unsigned short (2 bytes)
+
+    outstring = _pack(formatcode, integer)
+    assert len(outstring) == 2
+    return outstring
+
+
+def _twobyte_string_to_num(bytestring, numberOfDecimals=0, signed=False):
+    formatcode = ">"  # Big-endian
+    if signed:
+        formatcode += "h"  # (Signed) short (2 bytes)
+    else:
+        formatcode += "H"  # Unsigned short (2 bytes)
+
+    fullregister = _unpack(formatcode, bytestring)
+
+    if numberOfDecimals == 0:
+        return fullregister
+    divisor = 10**numberOfDecimals
+    return fullregister / float(divisor)
+
+
+def _bytestring_to_long(
+    bytestring, signed=False, byteorder=BYTEORDER_BIG, numberOfDecimals=0
+):
+    if byteorder in [BYTEORDER_BIG, BYTEORDER_BIG_SWAP]:
+        formatcode = ">"
+    else:
+        formatcode = "<"
+    if signed:
+        formatcode += "l"  # (Signed) long (4 bytes)
+    else:
+        formatcode += "L"  # Unsigned long (4 bytes)
+
+    if byteorder in [BYTEORDER_BIG_SWAP, BYTEORDER_LITTLE_SWAP]:
+        bytestring = _swap(bytestring)
+
+    fullregister = _unpack(formatcode, bytestring)
+
+    if numberOfDecimals == 0:
+        return fullregister
+    divisor = 10**numberOfDecimals
+    return fullregister / float(divisor)
+
+
+def _pack(formatstring, value):
+    try:
+        result = struct.pack(formatstring, value)
+    except Exception as error:
+        raise ValueError(
+            "The value to send is probably out of range, as the num-to-bytestring "
+            + f"conversion failed. Value: {value!r} "
+            + f"Struct format code is: {formatstring}"
+        ) from error
+
+    return str(result, encoding="latin1")
+
+
+def _unpack(formatstring, packed):
+    packed = bytes(packed, encoding="latin1")
+    try:
+        value = struct.unpack(formatstring, packed)[0]
+    except Exception as error:
+        errortext1 = "The received bytestring is probably wrong, as the "
+        errortext2 = f"bytestring-to-num  conversion failed. Bytestring: {packed!r} "
+        errortext3 = f"Struct format code is: {formatstring}"
+        errortext4 = error
+
+        raise rs485eth.InvalidResponseError(
+            f"{errortext1}{errortext2}{errortext3}{errortext4}"
+        ) from error
+
+    return value
+
+
+def _swap(bytestring):
+    length = len(bytestring)
+    if length % 2:
+        raise ValueError(
+            f"The length of the bytestring should be even. Given {bytestring!r}."
+        )
+    templist = list(bytestring)
+    templist[1:length:2], templist[:length:2] = (
+        templist[:length:2],
+        templist[1:length:2],
+    )
+    return "".join(templist)
+
+
+def _calculate_crc_string(inputstring):
+    # Preload a 16-bit register with ones
+    register = 0xFFFF
+
+    for char in inputstring:
+        register = (register >> 8) ^ _CRC16TABLE[(register ^ ord(char)) & 0xFF]
+
+    return _num_to_twobyte_string(register, lsb_first=True)
+
+
+def bench(label, func, number, repeat):
+    best = min(timeit.repeat(func, number=number, repeat=repeat)) / number
+    print(f"{label:<44} {best * 1e6:10.2f} us")
+    return best
+
+
+def make_answer(registers, address, count, slave=1):
+    """Return the raw answer to a function code 4 read of *count* registers."""
+    values = [registers[register] for register in range(address, address + count)]
+    return with_crc(struct.pack(f">BBB{count}H", slave, 4, 2 * count, *values))
+
+
+def decode_string(text):
+    """Decode an answer field by field, the way the original codec was used."""
+    payload = _extract_payload(text)
+    return [
+        _parse_payload(payload[: 1 + 2 * width], 0, False, BYTEORDER_BIG, payloadformat)
+        for width, payloadformat in ((1, "int"), (2, "long"))
+    ]
+
+
+def decode_bytes(frame):
+    """Decode the same fields from the bytes of an answer."""
+    rs485eth._check_response(frame)
+    return [
+        rs485eth._unpack_register(frame, 3),
+        rs485eth._unpack_long(frame, 3),
+    ]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--number", type=int, default=20000)
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--batch", type=int, default=10000)
+    args = parser.parse_args()
+    number, repeat = args.number, args.repeat
+
+    registers = SimulatedInverter(1).registers()
+    register_map = RegisterMap(REGISTERS)
+    frames = [
+        make_answer(registers, block.address, block.count)
+        for block in register_map.blocks
+    ]
+    frame = max(frames, key=len)
+    text = str(frame, encoding="latin1")
+    payload = _extract_payload(text)
+    print(
+        f"answers of the default read plan: {[len(frame) for frame in frames]} bytes"
+    )
+
+    print(f"CRC of an answer ({len(frame) - 2} bytes)")
+    bench(
+        "  _calculate_crc_string",
+        lambda: _calculate_crc_string(text[:-2]),
+        number,
+        repeat,
+    )
+    bench(
+        "  _calculate_crc (bytes)",
+        lambda: rs485eth._calculate_crc(frame[:-2]),
+        number,
+        repeat,
+    )
+
+    print("check an answer and extract the payload")
+    bench("  _extract_payload", lambda: _extract_payload(text), number, repeat)
+    bench(
+        "  _check_response (bytes)",
+        lambda: rs485eth._check_response(frame),
+        number,
+        repeat,
+    )
+
+    print("decode a register")
+    register_text = payload[1:3]
+    bench(
+        "  _twobyte_string_to_num",
+        lambda: _twobyte_string_to_num(register_text, 1),
+        number,
+        repeat,
+    )
+    bench(
+        "  _parse_payload (int)",
+        lambda: _parse_payload(payload[:3], 1, False, BYTEORDER_BIG, "int"),
+        number,
+        repeat,
+    )
+    bench(
+        "  _unpack_register (bytes)",
+        lambda: rs485eth._unpack_register(frame, 3, 1),
+        number,
+        repeat,
+    )
+
+    print("decode a long")
+    long_text = payload[1:5]
+    bench(
+        "  _bytestring_to_long",
+        lambda: _bytestring_to_long(long_text),
+        number,
+        repeat,
+    )
+    bench(
+        "  _bytestring_to_long (little swap)",
+        lambda: _bytestring_to_long(
+            long_text, byteorder=BYTEORDER_LITTLE_SWAP
+        ),
+        number,
+        repeat,
+    )
+    bench(
+        "  _parse_payload (long)",
+        lambda: _parse_payload(payload[:5], 0, False, BYTEORDER_BIG, "long"),
+        number,
+        repeat,
+    )
+    bench(
+        "  _unpack_long (bytes)",
+        lambda: rs485eth._unpack_long(frame, 3),
+        number,
+        repeat,
+    )
+
+    print(f"byte swap of the register data ({len(payload) - 1} bytes)")
+    bench("  _swap", lambda: _swap(payload[1:]), number, repeat)
+
+    print("decode all fields of the read plan")
+    data = rs485eth.RegisterData(
+        [
+            rs485eth.RegisterBlock(block.address, block.count, frame, 3)
+            for block, frame in zip(register_map.blocks, frames)
+        ]
+    )
+    bench(
+        "  RegisterMap.decode_values",
+        lambda: register_map.decode_values(data),
+        number,
+        repeat,
+    )
+
+    batch = [frames[index % len(frames)] for index in range(args.batch)]
+    texts = [str(frame, encoding="latin1") for frame in batch]
+    print(f"check and decode {args.batch} answers")
+    legacy = bench(
+        "  original string codec",
+        lambda: [decode_string(text) for text in texts],
+        1,
+        repeat,
+    )
+    fast = bench(
+        "  bytes functions",
+        lambda: [decode_bytes(frame) for frame in batch],
+        1,
+        repeat,
+    )
+    print(f"  speedup: {legacy / fast:.1f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,105 @@
+"""Microbenchmarks for the CRC-16/Modbus engine.
+
+Compares the former string based implementation with the functions of
+custom_components/solaredge_rs485/crc.py on realistic RTU frames.
+
+Usage: python scripts/bench_crc.py [--number N] [--repeat R]
+"""
+import argparse
+import os
+import struct
+import sys
+import timeit
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+from custom_components.solaredge_rs485 import crc  # noqa: E402
+
+_LEGACY_TABLE = tuple(crc.CRC16_TABLE)
+
+
+def legacy_crc_string(inputstring):
+    """The CRC as it was calculated before crc.py: str in, two-char str out."""
+    register = 0xFFFF
+    for char in inputstring:
+        register = (register >> 8) ^ _LEGACY_TABLE[(register ^ ord(char)) & 0xFF]
+    return str(struct.pack("<H", register), encoding="latin1")
+
+
+def legacy_validate(response):
+    """Slice off the checksum and compare it with a recalculated one."""
+    return response[-2:] == legacy_crc_string(response[:-2])
+
+
+def make_frame(number_of_registers):
+    """Return a valid function code 4 answer with *number_of_registers*."""
+    body = bytes([1, 4, 2 * number_of_registers]) + bytes(
+        (index * 37) & 0xFF for index in range(2 * number_of_registers)
+    )
+    return body + struct.pack("<H", crc.crc16(body))
+
+
+def bench(label, func, number, repeat):
+    best = min(timeit.repeat(func, number=number, repeat=repeat)) / number
+    print(f"{label:<40} {best * 1e6:10.2f} us")
+    return best
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--number", type=int, default=20000)
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    crc._wide_table()  # Build the table outside of the measurements
+
+    request = bytes([1, 4, 0x0B, 0xBC, 0x00, 0x28])
+    for label, frame in (
+        ("request (6 bytes)", request),
+        ("answer, 1 register (7 bytes)", make_frame(1)),
+        ("answer, 40 registers (85 bytes)", make_frame(40)),
+    ):
+        text = str(frame, encoding="latin1")
+        print(label)
+        legacy = bench(
+            "  legacy _calculate_crc_string",
+            lambda: legacy_crc_string(text),
+            args.number,
+            args.repeat,
+        )
+        bench("  crc16", lambda: crc.crc16(frame), args.number, args.repeat)
+        wide = bench(
+            "  crc16_wide", lambda: crc.crc16_wide(frame), args.number, args.repeat
+        )
+        print(f"  speedup crc16_wide: {legacy / wide:.1f}x")
+
+    frame = make_frame(40)
+    text = str(frame, encoding="latin1")
+    print("validate answer, 40 registers")
+    legacy = bench(
+        "  legacy slice and compare",
+        lambda: legacy_validate(text),
+        args.number,
+        args.repeat,
+    )
+    fast = bench(
+        "  validate_frame", lambda: crc.validate_frame(frame), args.number, args.repeat
+    )
+    print(f"  speedup: {legacy / fast:.1f}x")
+
+    frames = [make_frame(1 + index % 40) for index in range(10000)]
+    texts = [str(frame, encoding="latin1") for frame in frames]
+    print("validate 10000 answers")
+    legacy = bench(
+        "  legacy slice and compare",
+        lambda: [legacy_validate(text) for text in texts],
+        1,
+        args.repeat,
+    )
+    fast = bench(
+        "  validate_frames", lambda: crc.validate_frames(frames), 1, args.repeat
+    )
+    print(f"  speedup: {legacy / fast:.1f}x")
+
+if __name__ == "__main__":
+    main()
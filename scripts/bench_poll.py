@@ -0,0 +1,244 @@
+"""End-to-end benchmarks of the poll cycle against the gateway simulator.
+
+Runs full SolarEdgeCoordinator._async_update_data cycles (mode "coordinator")
+and bare SolarEdgeInverter.read_rs485_data calls (mode "inverter") against
+scripts/simulator.py, for a set of scenarios: number of inverters, gateway
+latency and packet loss. For every scenario it reports:
+
+- cycle latency percentiles (p50/p95/p99, ms) and the failed cycles
+- requests and bytes on the wire per cycle, counted by the simulator
+- CPU time per cycle of the thread running the integration; the simulator
+  runs on a thread of its own, so its CPU time is not included
+- allocations per cycle: peak traced memory and allocated blocks, measured in
+  a separate pass under tracemalloc. tracemalloc sees the whole process, these
+  figures include the few small buffers the simulator allocates per request.
+
+Results are printed as JSON, one object per scenario, so transports and read
+strategies can be compared run against run. The hubs are set up with the
+packet loss off, the scenarios measure the poll cycles. A scenario that fails
+gets an object with its error, and the others still run.
+
+Usage: python scripts/bench_poll.py [--cycles N] [--scenario NAME ...]
+       [--mode coordinator|inverter] [--output FILE]
+"""
+import argparse
+import asyncio
+import json
+import logging
+import os
+import statistics
+import sys
+import tempfile
+import threading
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+from custom_components.solaredge_rs485 import SolarEdgeCoordinator  # noqa: E402
+from custom_components.solaredge_rs485.hub import SolarEdgers485MultiHub  # noqa: E402
+from hass_setup import make_hass  # noqa: E402
+from simulator import GatewaySimulator  # noqa: E402
+
+# name: (inverters, latency in s, drop probability)
+SCENARIOS = {
+    "1inv-0ms": (1, 0.0, 0.0),
+    "1inv-5ms": (1, 0.005, 0.0),
+    "1inv-50ms": (1, 0.05, 0.0),
+    "16inv-0ms": (16, 0.0, 0.0),
+    "16inv-5ms": (16, 0.005, 0.0),
+    "16inv-50ms": (16, 0.05, 0.0),
+    "1inv-5ms-loss1": (1, 0.005, 0.01),
+    "1inv-5ms-loss5": (1, 0.005, 0.05),
+    "16inv-5ms-loss1": (16, 0.005, 0.01),
+}
+
+
+class SimulatorThread:
+    """Run a GatewaySimulator on its own event loop and thread."""
+
+    def __init__(self, **kwargs):
+        self._kwargs = kwargs
+        self._loop = asyncio.new_event_loop()
+        self._thread = threading.Thread(target=self._loop.run_forever, daemon=True)
+        self.simulator = None
+
+    def __enter__(self):
+        self._thread.start()
+
+        async def start():
+            self.simulator = GatewaySimulator(**self._kwargs)
+            await self.simulator.start()
+
+        asyncio.run_coroutine_threadsafe(start(), self._loop).result()
+        return self.simulator
+
+    def __exit__(self, *exc_info):
+        asyncio.run_coroutine_threadsafe(self.simulator.stop(), self._loop).result()
+        self._loop.call_soon_threadsafe(self._loop.stop)
+        self._thread.join()
+        self._loop.close()
+
+
+def percentile(values, fraction):
+    """Return the *fraction* percentile of *values* (nearest rank)."""
+    ordered = sorted(values)
+    index = max(0, min(len(ordered) - 1, round(fraction * len(ordered)) - 1))
+    return ordered[index]
+
+
+async def setup(hass, port, inverters):
+    """Return a coordinator whose hub polls *inverters* unit IDs."""
+    hub = SolarEdgers485MultiHub(
+        hass,
+        "bench",
+        "127.0.0.1",
+        port,
+        inverter_unit_ids=range(1, inverters + 1),
+    )
+    await hub.connect()
+    await hub._async_init_solaredge()
+    return SolarEdgeCoordinator(hass, hub, scan_interval=30)
+
+
+def make_cycle(coordinator, mode):
+    hub = coordinator._hub
+    if mode == "coordinator":
+        return coordinator._async_update_data
+
+    async def cycle():
+        for inverter in hub.inverters:
+            await inverter.read_rs485_data()
+
+    return cycle
+
+
+async def measure(cycle, cycles):
+    """Run *cycles* cycles, return (latencies in s, CPU seconds, failures)."""
+    latencies = []
+    failures = 0
+    cpu = time.thread_time()
+    for _ in range(cycles):
+        start = time.perf_counter()
+        try:
+            await cycle()
+        except Exception:  # noqa: BLE001 - a failed cycle is a result too
+            failures += 1
+        latencies.append(time.perf_counter() - start)
+    return latencies, time.thread_time() - cpu, failures
+
+
+async def measure_allocations(cycle, cycles):
+    """Return the median peak traced bytes and allocated blocks per cycle."""
+    peaks = []
+    blocks = []
+    tracemalloc.start()
+    try:
+        for _ in range(cycles):
+            tracemalloc.reset_peak()
+            before, _ = tracemalloc.get_traced_memory()
+            allocated = sys.getallocatedblocks()
+            try:
+                await cycle()
+            except Exception:  # noqa: BLE001
+                pass
+            peaks.append(tracemalloc.get_traced_memory()[1] - before)
+            blocks.append(sys.getallocatedblocks() - allocated)
+    finally:
+        tracemalloc.stop()
+    return statistics.median(peaks), statistics.median(blocks)
+
+
+async def run_scenario(name, mode, cycles, warmup):
+    inverters, latency, drop = SCENARIOS[name]
+    with SimulatorThread(
+        slaves=range(1, inverters + 1), latency=latency, drop=drop, seed=0
+    ) as simulator, tempfile.TemporaryDirectory() as config_dir:
+        hass = make_hass(config_dir)
+        simulator.drop = 0.0
+        coordinator = await setup(hass, simulator.port, inverters)
+        simulator.drop = drop
+        cycle = make_cycle(coordinator, mode)
+        await measure(cycle, warmup)
+
+        simulator.reset_stats()
+        latencies, cpu, failures = await measure(cycle, cycles)
+        stats = simulator.stats
+        alloc_peak, alloc_blocks = await measure_allocations(
+            cycle, max(1, cycles // 4)
+        )
+        await coordinator._hub.shutdown()
+
+    return {
+        "scenario": name,
+        "mode": mode,
+        "inverters": inverters,
+        "latency_ms": latency * 1000,
+        "drop": drop,
+        "cycles": cycles,
+        "failed_cycles": failures,
+        "p50_ms": percentile(latencies, 0.50) * 1000,
+        "p95_ms": percentile(latencies, 0.95) * 1000,
+        "p99_ms": percentile(latencies, 0.99) * 1000,
+        "mean_ms": statistics.fmean(latencies) * 1000,
+        "requests_per_cycle": stats.requests / cycles,
+        # as seen from the integration: sent to and received from the gateway
+        "bytes_sent_per_cycle": stats.bytes_in / cycles,
+        "bytes_received_per_cycle": stats.bytes_out / cycles,
+        "cpu_ms_per_cycle": cpu / cycles * 1000,
+        "alloc_peak_bytes_per_cycle": alloc_peak,
+        "alloc_blocks_per_cycle": alloc_blocks,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--cycles", type=int, default=200)
+    parser.add_argument("--warmup", type=int, default=5)
+    parser.add_argument(
+        "--scenario",
+        action="append",
+        choices=sorted(SCENARIOS),
+        help="scenario to run, may be repeated; default all",
+    )
+    parser.add_argument(
+        "--mode", choices=("coordinator", "inverter"), default="coordinator"
+    )
+    parser.add_argument("--output", help="write the JSON here instead of stdout")
+    args = parser.parse_args()
+
+    # The records the integration logs are part of the cost, but keep them off
+    # the terminal
+    logging.getLogger().addHandler(logging.NullHandler())
+
+    results = []
+    for name in args.scenario or SCENARIOS:
+        try:
+            result = asyncio.run(
+                run_scenario(name, args.mode, args.cycles, args.warmup)
+            )
+        except Exception as error:  # noqa: BLE001 - recorded as the result
+            print(f"{name:<18} failed: {error!r}", file=sys.stderr)
+            results.append({"scenario": name, "mode": args.mode, "error": repr(error)})
+            continue
+        print(
+            f"{name:<18} p50 {result['p50_ms']:8.2f} ms"
+            f"  p99 {result['p99_ms']:8.2f} ms"
+            f"  {result['requests_per_cycle']:5.1f} req"
+            f"  cpu {result['cpu_ms_per_cycle']:6.2f} ms"
+            f"  failed {result['failed_cycles']}",
+            file=sys.stderr,
+        )
+        results.append(result)
+
+    output = json.dumps(results, indent=2)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as file:
+            file.write(output + "\n")
+    else:
+        print(output)
+    return 1 if any("error" in result for result in results) else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
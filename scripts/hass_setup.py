@@ -0,0 +1,16 @@
+"""A bare HomeAssistant instance for the scripts that run the integration.
+
+The scripts drive the hub and the coordinator directly, without starting Home
+Assistant; they only need an instance for its config and executor.
+"""
+from homeassistant.core import HomeAssistant
+
+
+def make_hass(config_dir):
+    """Return a HomeAssistant instance, not started, using *config_dir*."""
+    try:
+        return HomeAssistant(config_dir)
+    except TypeError:  # releases before 2023.9 take no argument
+        hass = HomeAssistant()
+        hass.config.config_dir = config_dir
+        return hass
@@ -0,0 +1,191 @@
+"""Replay a capture of gateway traffic through the integration.
+
+Feeds a capture file (see custom_components/solaredge_rs485/capture.py, written
+when the "capture" option is on) through the hub, the coordinator and the
+sensor entities, without a gateway or a running Home Assistant. The entities
+publish into a recorder instead of the state machine, with the same logic that
+decides which states are written.
+
+Prints the time spent in the update (reading and decoding) and in publishing
+per cycle. With --states every cycle's written states are saved as JSON lines,
+to compare them with what was seen on site.
+
+The inverters polled are those addressed in the capture, or --unit-id. Each
+session of the capture, from a start of Home Assistant to the next, is
+replayed with a hub of its own, as the hub was set up again. The replay fails
+when recorded requests are left unused: the integration no longer asks what it
+asked when the capture was taken, and the timings do not compare.
+
+Usage: python scripts/replay.py CAPTURE [--speed X] [--cycles N]
+       [--states FILE] [--unit-id ID ...]
+"""
+import argparse
+import asyncio
+import json
+import logging
+import os
+import statistics
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+from custom_components.solaredge_rs485 import SolarEdgeCoordinator  # noqa: E402
+from custom_components.solaredge_rs485.capture import (  # noqa: E402
+    REQUEST,
+    ReplayInstrument,
+    read_capture,
+    split_sessions,
+)
+from custom_components.solaredge_rs485.hub import SolarEdgers485MultiHub  # noqa: E402
+from custom_components.solaredge_rs485.metrics import TransportMetrics  # noqa: E402
+from custom_components.solaredge_rs485.sensor import create_entities  # noqa: E402
+from hass_setup import make_hass  # noqa: E402
+
+
+def record_writes(entities, writes):
+    """Make the entities append their state to *writes* instead of writing it."""
+    for entity in entities:
+
+        def write(entity=entity):
+            writes[entity.unique_id] = {
+                "available": entity.available,
+                "state": entity.native_value if entity.available else None,
+                "attributes": entity.extra_state_attributes,
+            }
+
+        entity.async_write_ha_state = write
+
+
+class Replay:
+    """The cycles replayed and their timings, over the sessions of a capture."""
+
+    def __init__(self, args, hass, states):
+        self.args = args
+        self.hass = hass
+        self.states = states
+        self.metrics = TransportMetrics()
+        self.unit_ids = set()
+        self.updates = []
+        self.publishes = []
+        self.failures = 0
+        self.recorded = 0
+        self.unused = 0
+
+    async def session(self, records):
+        """Replay the cycles of one session with a hub of its own.
+
+        Every session of the capture started with a new hub, which read the
+        models of its inverters again; so does the replay.
+        """
+        args = self.args
+        client = ReplayInstrument(records, speed=args.speed, metrics=self.metrics)
+        unit_ids = args.unit_id or client.unit_ids
+        self.unit_ids.update(unit_ids)
+        hub = SolarEdgers485MultiHub(
+            self.hass, "replay", "replay", 0, inverter_unit_ids=unit_ids
+        )
+        hub._client = client
+        hub.transport_metrics = self.metrics
+        coordinator = SolarEdgeCoordinator(self.hass, hub, scan_interval=30)
+
+        entities = None
+        writes = {}
+        while not client.finished and len(self.updates) < args.cycles:
+            started = time.perf_counter()
+            try:
+                coordinator.data = await coordinator._async_update_data()
+                coordinator.last_update_success = True
+            except Exception as error:  # noqa: BLE001 - replayed failures count
+                coordinator.last_update_success = False
+                self.failures += 1
+                print(f"cycle {len(self.updates)}: {error}", file=sys.stderr)
+            updated = time.perf_counter()
+
+            if entities is None and hub.inverters:
+                entities = create_entities(hub, None, coordinator)
+                record_writes(entities, writes)
+            writes.clear()
+            for entity in entities or ():
+                entity._handle_coordinator_update()
+            published = time.perf_counter()
+
+            self.updates.append(updated - started)
+            self.publishes.append(published - updated)
+            if self.states is not None:
+                self.states.write(json.dumps(writes, default=str) + "\n")
+
+        self.recorded += client.recorded
+        # Stopping at --cycles leaves the rest of the capture unused on purpose
+        self.unused += (
+            client.unused if len(self.updates) < args.cycles else client.skipped
+        )
+
+
+async def replay(args, config_dir):
+    sessions = [
+        records
+        for records in split_sessions(read_capture(args.capture))
+        if any(record[1] == REQUEST for record in records)
+    ]
+    states = open(args.states, "w", encoding="utf-8") if args.states else None
+    try:
+        result = Replay(args, make_hass(config_dir), states)
+        for records in sessions:
+            if len(result.updates) >= args.cycles:
+                break
+            await result.session(records)
+    finally:
+        if states is not None:
+            states.close()
+
+    updates = result.updates
+    publishes = result.publishes
+    if not updates:
+        print("The capture has no cycles", file=sys.stderr)
+        return 1
+    print(f"unit IDs         {', '.join(map(str, sorted(result.unit_ids)))}")
+    print(f"sessions         {len(sessions)}")
+    print(f"cycles           {len(updates)} ({result.failures} failed)")
+    print(f"requests         {result.metrics.requests}")
+    print(f"update   p50     {statistics.median(updates) * 1e3:8.3f} ms")
+    print(f"update   max     {max(updates) * 1e3:8.3f} ms")
+    print(f"publish  p50     {statistics.median(publishes) * 1e3:8.3f} ms")
+    print(f"publish  max     {max(publishes) * 1e3:8.3f} ms")
+
+    if result.unused:
+        print(
+            f"{result.unused} of {result.recorded} recorded requests were not "
+            "replayed",
+            file=sys.stderr,
+        )
+        return 1
+    return 0
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("capture")
+    parser.add_argument(
+        "--speed",
+        type=float,
+        help="replay speed relative to the recording; default as fast as possible",
+    )
+    parser.add_argument("--cycles", type=int, default=sys.maxsize)
+    parser.add_argument("--states", help="write the published states here")
+    parser.add_argument(
+        "--unit-id",
+        type=int,
+        action="append",
+        help="unit ID of an inverter to poll; default those in the capture",
+    )
+    args = parser.parse_args()
+
+    logging.getLogger().addHandler(logging.NullHandler())
+    with tempfile.TemporaryDirectory() as config_dir:
+        sys.exit(asyncio.run(replay(args, config_dir)))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,480 @@
+"""Simulated RS485-over-TCP gateway (WEM3080 style) with SolarEdge inverters.
+
+Speaks Modbus RTU framing over TCP like the real gateway: every request is a
+raw 8-byte RTU frame with CRC, every answer a raw RTU frame. Only the slaves
+configured answer; like on a real RS485 bus, the other unit IDs time out. One
+transaction is on the bus at a time, whatever the number of TCP connections.
+
+The simulator has its own CRC and register encoding, so that it checks the
+integration instead of sharing its bugs. The register map, which field is at
+which address with which width, sign and scale, is the integration's
+registers.REGISTERS by default, or any list of :class:`SimulatedField` (--map
+takes them from a JSON file). It can run in the test process:
+
+    async with GatewaySimulator(slaves=(1, 2), latency=0.005) as simulator:
+        instrument = Instrument("127.0.0.1", simulator.port)
+        ...
+    print(simulator.stats)
+
+Usage: python scripts/simulator.py [--port 8899] [--slaves 1,2] [--latency MS]
+       [--jitter MS] [--drop P] [--split P] [--corrupt P] [--max-connections N]
+       [--map FILE]
+"""
+import argparse
+import asyncio
+import contextlib
+import json
+import logging
+import math
+import os
+import random
+import struct
+import sys
+import time
+from dataclasses import asdict, dataclass
+
+_LOGGER = logging.getLogger("simulator")
+
+READ_FUNCTION_CODES = (3, 4)
+# Range of the input registers the inverters answer, other ranges are refused
+# with exception code 2 (illegal data address)
+FIRST_REGISTER = 3000
+LAST_REGISTER = 3199
+MAX_REGISTERS_PER_READ = 125
+
+ILLEGAL_FUNCTION = 1
+ILLEGAL_DATA_ADDRESS = 2
+ILLEGAL_DATA_VALUE = 3
+
+_REQUEST_STRUCT = struct.Struct(">BBHH")
+_CRC_STRUCT = struct.Struct("<H")
+
+
+def _build_crc_table():
+    table = []
+    for byte in range(256):
+        crc = byte
+        for _ in range(8):
+            crc = (crc >> 1) ^ 0xA001 if crc & 1 else crc >> 1
+        table.append(crc)
+    return tuple(table)
+
+
+_CRC_TABLE = _build_crc_table()
+
+
+def crc16(data):
+    """Return the CRC-16/Modbus of *data*."""
+    crc = 0xFFFF
+    for byte in data:
+        crc = (crc >> 8) ^ _CRC_TABLE[(crc ^ byte) & 0xFF]
+    return crc
+
+
+def with_crc(frame):
+    """Return *frame* with its CRC appended."""
+    return frame + _CRC_STRUCT.pack(crc16(frame))
+
+
+@dataclass
+class SimulatorStats:
+    """Counters of a simulator run."""
+
+    connections: int = 0
+    rejected_connections: int = 0
+    requests: int = 0
+    responses: int = 0
+    exceptions: int = 0
+    bad_crc: int = 0
+    unknown_slave: int = 0
+    dropped: int = 0
+    split: int = 0
+    corrupted: int = 0
+    bytes_in: int = 0
+    bytes_out: int = 0
+
+
+@dataclass(frozen=True)
+class SimulatedField:
+    """Where a value is in the input registers, and how it is encoded.
+
+    The register value is the value divided by *scale*, rounded; *width* is 1
+    (16 bits) or 2 (32 bits, big endian).
+    """
+
+    key: str
+    address: int
+    width: int = 1
+    signed: bool = False
+    scale: float = 1
+
+
+def default_register_map():
+    """Return the fields of the integration's registers.REGISTERS."""
+    sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+    from custom_components.solaredge_rs485.registers import REGISTERS
+
+    return [
+        SimulatedField(field.key, field.address, field.width, field.signed, field.scale)
+        for field in REGISTERS
+    ]
+
+
+def load_register_map(path):
+    """Return the fields listed in a JSON file, objects like SimulatedField."""
+    with open(path, encoding="utf-8") as file:
+        return [SimulatedField(**field) for field in json.load(file)]
+
+
+class SimulatedInverter:
+    """The input registers of one inverter, generated from the clock.
+
+    Power follows the sun (a sine between 06:00 and 18:00 local time) with some
+    noise, the energy counters grow steadily, and voltages, currents, frequency
+    and temperature fluctuate around realistic values. The values are put in
+    the registers by the register map; fields of the map without a generated
+    value read 0, and where two fields share a register the later one wins.
+    The registers are recalculated at most once per *refresh* seconds.
+
+    Args:
+        unit_id (int): The slave address on the bus.
+        rated_power (int): Peak AC power in W.
+        seed: Seed of the noise, defaults to the unit ID.
+        refresh (float): Seconds a generated set of registers is served.
+        register_map: The :class:`SimulatedField` to serve, by default those
+            of the integration (see :func:`default_register_map`).
+
+    """
+
+    def __init__(
+        self, unit_id, rated_power=5000, seed=None, refresh=1.0, register_map=None
+    ):
+        self.unit_id = unit_id
+        self.rated_power = rated_power
+        self.refresh = refresh
+        self.register_map = (
+            default_register_map() if register_map is None else list(register_map)
+        )
+        self._random = random.Random(unit_id if seed is None else seed)
+        self._started = time.time()
+        self._lifetime_kwh = 10000 + 1000 * unit_id
+        self._registers = None
+        self._values = None
+        self._generated = 0.0
+
+    def power(self, now):
+        """Return the AC power in W at *now* (epoch seconds)."""
+        local = time.localtime(now)
+        hours = local.tm_hour + local.tm_min / 60 + local.tm_sec / 3600
+        sun = math.sin(math.pi * (hours - 6) / 12) if 6 < hours < 18 else 0.0
+        return self.rated_power * sun * self._random.uniform(0.9, 1.0)
+
+    def registers(self, now=None):
+        """Return the register values by address."""
+        if now is None:
+            now = time.time()
+        if self._registers is None or now - self._generated >= self.refresh:
+            self._values = self._generate_values(now)
+            self._registers = self._encode(self._values)
+            self._generated = now
+        return self._registers
+
+    def values(self, now=None):
+        """Return the values in the registers served at *now*, by field key."""
+        self.registers(now)
+        return self._values
+
+    def _generate_values(self, now):
+        """Return the values of the fields at *now*, in their units."""
+        noise = self._random.uniform
+        power = self.power(now)
+        dc_power = power * 1.03
+        produced_kwh = (now - self._started) * self.rated_power / 2 / 3.6e6
+        lifetime_kwh = int(self._lifetime_kwh + produced_kwh)
+        today = int(10 * produced_kwh) % 1000 / 10
+        dc_voltage = 350 + noise(-5, 5) if power else 0.0
+        dc_current = dc_power / 2 / dc_voltage if dc_voltage else 0.0
+        ac_voltage = 230 + noise(-3, 3)
+        ac_current = power / ac_voltage / 3
+        return {
+            "C_SunSpec_DID": 103,  # product model
+            "SN": 1000 + self.unit_id,
+            "ac_power_output": power / 1000,
+            "dc_output_power": dc_power / 1000,
+            "ac_generated_lifetimeproduction": lifetime_kwh,
+            "ac_energy_wh": lifetime_kwh % 4000,
+            "ac_generated_monthenergy": lifetime_kwh % 500,
+            "ac_generated_lastmonth": 450 + self.unit_id,
+            "ac_generated_today": today,
+            "ac_generated_yesterday": 15 + self.unit_id / 10,
+            "ac_generated_yearenergy": lifetime_kwh % 4000,
+            "ac_generated_lastyear": 3800 + self.unit_id,
+            "dc_voltage_1": dc_voltage,
+            "dc_current_1": dc_current,
+            "dc_voltage_2": dc_voltage,
+            "dc_current_2": dc_current,
+            "ac_voltage_ab": ac_voltage * math.sqrt(3),
+            "ac_voltage_bc": (ac_voltage + noise(-1, 1)) * math.sqrt(3),
+            "ac_voltage_ca": (ac_voltage + noise(-1, 1)) * math.sqrt(3),
+            "ac_current_a": ac_current,
+            "ac_current_b": ac_current,
+            "ac_current_c": ac_current,
+            "i_temp_sink": 25 + power / 200 + noise(-0.5, 0.5),
+            "ac_frequency": 50 + noise(-0.05, 0.05),
+            "i_status_vendor": 3 if power else 1,  # generating or off
+            "i_status": 4 if power else 2,  # production or sleeping
+        }
+
+    def _encode(self, values):
+        """Return the registers by address holding *values* by the register map."""
+        registers = dict.fromkeys(range(FIRST_REGISTER, LAST_REGISTER + 1), 0)
+        for field in self.register_map:
+            if field.key not in values:
+                continue
+            value = int(round(values[field.key] / field.scale))
+            if field.signed and value < 0:
+                value += 1 << (16 * field.width)
+            value &= (1 << (16 * field.width)) - 1
+            for index in range(field.width):
+                shift = 16 * (field.width - 1 - index)
+                registers[field.address + index] = (value >> shift) & 0xFFFF
+        return registers
+
+
+class GatewaySimulator:
+    """An asyncio TCP server answering RTU requests for simulated inverters.
+
+    Args:
+        host (str): The address to listen on.
+        port (int): The TCP port, 0 picks a free one (see ``port``).
+        slaves: The unit IDs answering, or :class:`SimulatedInverter` objects.
+        register_map: The register map of the inverters created for unit IDs,
+            see :class:`SimulatedInverter`.
+        latency (float): Seconds between request and answer.
+        jitter (float): Random extra latency, up to this many seconds.
+        drop (float): Probability that a request is not answered.
+        split (float): Probability that an answer is sent in two TCP segments.
+        corrupt (float): Probability that a byte of an answer is flipped.
+        max_connections (int): Connections served at once, further ones are
+            closed right away. 0 means no limit.
+        baudrate (int): Simulated RS485 speed, adds the time to send the
+            request and the answer on the bus. 0 disables it.
+        seed: Seed of the fault injection.
+
+    """
+
+    def __init__(
+        self,
+        host="127.0.0.1",
+        port=0,
+        slaves=(1,),
+        latency=0.0,
+        jitter=0.0,
+        drop=0.0,
+        split=0.0,
+        corrupt=0.0,
+        max_connections=0,
+        baudrate=0,
+        seed=None,
+        register_map=None,
+    ):
+        self.host = host
+        self.port = port
+        self.inverters = {}
+        slaves = list(slaves)
+        if register_map is None and not all(
+            isinstance(slave, SimulatedInverter) for slave in slaves
+        ):
+            register_map = default_register_map()
+        for slave in slaves:
+            if not isinstance(slave, SimulatedInverter):
+                slave = SimulatedInverter(slave, register_map=register_map)
+            self.inverters[slave.unit_id] = slave
+        self.latency = latency
+        self.jitter = jitter
+        self.drop = drop
+        self.split = split
+        self.corrupt = corrupt
+        self.max_connections = max_connections
+        self.baudrate = baudrate
+        self.stats = SimulatorStats()
+        self._random = random.Random(seed)
+        self._server = None
+        self._bus = asyncio.Lock()
+        self._writers = set()
+        self._tasks = set()
+
+    async def __aenter__(self):
+        await self.start()
+        return self
+
+    async def __aexit__(self, *exc_info):
+        await self.stop()
+
+    async def start(self):
+        """Start listening, ``port`` is set to the bound port."""
+        self._server = await asyncio.start_server(
+            self._handle_connection, self.host, self.port
+        )
+        self.port = self._server.sockets[0].getsockname()[1]
+        _LOGGER.info(
+            "Gateway simulator on %s:%s, slaves %s",
+            self.host,
+            self.port,
+            sorted(self.inverters),
+        )
+
+    async def stop(self):
+        """Close the server and all connections."""
+        if self._server is None:
+            return
+        self._server.close()
+        for task in list(self._tasks):
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        await self._server.wait_closed()
+        self._server = None
+
+    async def serve_forever(self):
+        await self.start()
+        async with self._server:
+            await self._server.serve_forever()
+
+    def reset_stats(self):
+        self.stats = SimulatorStats()
+
+    async def _handle_connection(self, reader, writer):
+        if self.max_connections and len(self._writers) >= self.max_connections:
+            self.stats.rejected_connections += 1
+            writer.close()
+            return
+
+        self.stats.connections += 1
+        self._writers.add(writer)
+        task = asyncio.current_task()
+        self._tasks.add(task)
+        try:
+            while True:
+                request = await reader.readexactly(_REQUEST_STRUCT.size + 2)
+                self.stats.bytes_in += len(request)
+                async with self._bus:
+                    await self._transact(request, writer)
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        except asyncio.CancelledError:
+            # The simulator is stopping, end the connection quietly
+            pass
+        finally:
+            self._tasks.discard(task)
+            self._writers.discard(writer)
+            writer.close()
+            with contextlib.suppress(ConnectionError):
+                await writer.wait_closed()
+
+    async def _transact(self, request, writer):
+        self.stats.requests += 1
+        response = self.respond(request)
+        if response is None:
+            return
+
+        delay = self.latency + self._random.uniform(0, self.jitter)
+        if self.baudrate:
+            # 10 bits per byte: start, 8 data and stop bit
+            delay += (len(request) + len(response)) * 10 / self.baudrate
+        if self._random.random() < self.drop:
+            self.stats.dropped += 1
+            return
+        if self._random.random() < self.corrupt:
+            self.stats.corrupted += 1
+            position = self._random.randrange(len(response))
+            response = bytearray(response)
+            response[position] ^= 1 << self._random.randrange(8)
+            response = bytes(response)
+        if delay:
+            await asyncio.sleep(delay)
+
+        if len(response) > 1 and self._random.random() < self.split:
+            self.stats.split += 1
+            cut = self._random.randrange(1, len(response))
+            writer.write(response[:cut])
+            await writer.drain()
+            await asyncio.sleep(0.001)
+            response = response[cut:]
+        writer.write(response)
+        await writer.drain()
+        self.stats.responses += 1
+        self.stats.bytes_out += len(response)
+
+    def respond(self, request):
+        """Return the answer to an RTU *request*, None if there is none."""
+        if crc16(request) != 0:
+            self.stats.bad_crc += 1
+            return None
+
+        slave, functioncode, address, count = _REQUEST_STRUCT.unpack_from(request)
+        inverter = self.inverters.get(slave)
+        if inverter is None:
+            self.stats.unknown_slave += 1
+            return None
+
+        if functioncode not in READ_FUNCTION_CODES:
+            return self._exception(slave, functioncode, ILLEGAL_FUNCTION)
+        if not 1 <= count <= MAX_REGISTERS_PER_READ:
+            return self._exception(slave, functioncode, ILLEGAL_DATA_VALUE)
+        if address < FIRST_REGISTER or address + count - 1 > LAST_REGISTER:
+            return self._exception(slave, functioncode, ILLEGAL_DATA_ADDRESS)
+
+        registers = inverter.registers()
+        values = [registers[register] for register in range(address, address + count)]
+        return with_crc(
+            struct.pack(f">BBB{count}H", slave, functioncode, 2 * count, *values)
+        )
+
+    def _exception(self, slave, functioncode, code):
+        self.stats.exceptions += 1
+        return with_crc(bytes([slave, functioncode | 0x80, code]))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--host", default="0.0.0.0")
+    parser.add_argument("--port", type=int, default=8899)
+    parser.add_argument("--slaves", default="1", help="comma separated unit IDs")
+    parser.add_argument("--latency", type=float, default=0, help="ms")
+    parser.add_argument("--jitter", type=float, default=0, help="ms")
+    parser.add_argument("--drop", type=float, default=0, help="probability")
+    parser.add_argument("--split", type=float, default=0, help="probability")
+    parser.add_argument("--corrupt", type=float, default=0, help="probability")
+    parser.add_argument("--max-connections", type=int, default=0)
+    parser.add_argument("--baudrate", type=int, default=0)
+    parser.add_argument("--seed", type=int)
+    parser.add_argument(
+        "--map", help="JSON file of the register map; default the integration's"
+    )
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    simulator = GatewaySimulator(
+        host=args.host,
+        port=args.port,
+        slaves=[int(slave) for slave in args.slaves.split(",")],
+        latency=args.latency / 1000,
+        jitter=args.jitter / 1000,
+        drop=args.drop,
+        split=args.split,
+        corrupt=args.corrupt,
+        max_connections=args.max_connections,
+        baudrate=args.baudrate,
+        seed=args.seed,
+        register_map=load_register_map(args.map) if args.map else None,
+    )
+    try:
+        asyncio.run(simulator.serve_forever())
+    except KeyboardInterrupt:
+        pass
+    finally:
+        print(asdict(simulator.stats))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,64 @@
+"""Tests of the capture file and its replay."""
+import asyncio
+
+from custom_components.solaredge_rs485 import capture
+from custom_components.solaredge_rs485.capture import (
+    CaptureWriter,
+    ReplayInstrument,
+    read_capture,
+    session_started,
+    split_sessions,
+)
+
+REQUEST = bytes([1, 4, 0x9C, 0x40, 0, 1, 0, 0])
+ANSWER = bytes([1, 4, 2, 0, 1, 0, 0])
+
+
+def record_session(monkeypatch, path, started):
+    """Record one exchange in a new session whose monotonic clock is *started*."""
+    monkeypatch.setattr(capture.time, "monotonic", lambda: started)
+    writer = CaptureWriter(str(path))
+    monkeypatch.setattr(capture.time, "monotonic", lambda: started + 1.0)
+    writer.record_request(REQUEST)
+    writer.record_response(ANSWER)
+    writer.flush()
+
+
+def test_sessions_appended_after_a_restart_replay_in_order(monkeypatch, tmp_path):
+    path = tmp_path / "capture.bin"
+    record_session(monkeypatch, path, 5000.0)
+    # The monotonic clock starts again from a lower base after a restart
+    record_session(monkeypatch, path, 100.0)
+    monkeypatch.undo()
+
+    records = read_capture(str(path))
+    assert [session_started(record) is not None for record in records] == [
+        True,
+        False,
+        False,
+        True,
+        False,
+        False,
+    ]
+
+    replay = ReplayInstrument(records)
+    assert replay.sessions == 2
+    assert [exchange[0] for exchange in replay._exchanges[1]] == [5001.0, 5002.0]
+
+    async def replay_all():
+        return [await replay._communicate(REQUEST) for _ in range(2)]
+
+    assert asyncio.run(replay_all()) == [ANSWER, ANSWER]
+    assert replay.finished
+    assert replay.unused == 0
+
+
+def test_records_before_the_first_session_are_a_session(monkeypatch, tmp_path):
+    path = tmp_path / "capture.bin"
+    record_session(monkeypatch, path, 100.0)
+    monkeypatch.undo()
+    records = read_capture(str(path))
+    # A capture made before there were session records
+    old = records[1:]
+
+    assert split_sessions(old + records) == [old, records]
@@ -0,0 +1,28 @@
+"""Tests of the diagnostics dump."""
+import asyncio
+
+from custom_components.solaredge_rs485.diagnostics import REDACTED, _raw_blocks
+from custom_components.solaredge_rs485.hub import SolarEdgers485MultiHub
+from custom_components.solaredge_rs485.registers import FIELDS_BY_KEY
+
+from .test_hub import FakeClient
+
+
+def test_raw_blocks_redact_the_serial_number():
+    hub = SolarEdgers485MultiHub(None, "test", "gateway", 8899)
+    hub._client = FakeClient()
+    asyncio.run(hub._async_init_solaredge())
+
+    serial = FIELDS_BY_KEY["SN"].address
+    blocks = _raw_blocks(hub.inverters[0])
+    assert blocks
+    for block in blocks:
+        assert block["read_at"] is not None
+        registers = block["registers"].split(" ")
+        assert len(registers) == block["count"]
+        for address, register in enumerate(registers, block["address"]):
+            assert (register == REDACTED) == (address == serial)
+    assert any(
+        block["address"] <= serial < block["address"] + block["count"]
+        for block in blocks
+    )
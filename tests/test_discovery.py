@@ -0,0 +1,66 @@
+"""Tests of the unit ID scan."""
+import asyncio
+import struct
+
+from custom_components.solaredge_rs485.const import DiscoverySettings
+from custom_components.solaredge_rs485.crc import crc16_wide
+from custom_components.solaredge_rs485.discovery import UnitScan
+
+DID = 101
+
+
+def frame(*data):
+    payload = bytes(data)
+    return payload + struct.pack("<H", crc16_wide(payload))
+
+
+async def scan(unit_ids, answers):
+    """Scan *unit_ids* on a gateway answering the probes from *answers*.
+
+    Args:
+        answers (dict): The answers of each unit ID in turn, None for a garbled
+            answer; the units missing do not answer.
+
+    Returns:
+        The inverters found and the probes received by unit ID.
+
+    """
+    probes = {}
+
+    async def handle(reader, writer):
+        try:
+            while True:
+                request = await reader.readexactly(8)
+                unit = request[0]
+                probes[unit] = probes.get(unit, 0) + 1
+                if unit not in answers:
+                    continue
+                turn = min(probes[unit], len(answers[unit])) - 1
+                answer = answers[unit][turn]
+                if answer is None:  # a frame with a wrong CRC
+                    answer = bytes([unit, 4, 2, 0, 0, 0, 0])
+                writer.write(answer)
+                await writer.drain()
+        except (asyncio.IncompleteReadError, ConnectionError):
+            writer.close()
+
+    server = await asyncio.start_server(handle, "127.0.0.1", 0)
+    port = server.sockets[0].getsockname()[1]
+    async with server:
+        found = await UnitScan("127.0.0.1", port, timeout=0.05, window=1).run(
+            unit_ids
+        )
+    return found, probes
+
+
+def test_probe_lost_in_garbled_answer_is_sent_again():
+    answer = frame(5, 4, 2, 0, DID)
+    found, probes = asyncio.run(scan([4, 5, 6], {5: [None, answer]}))
+    assert found == {5: DID}
+    assert probes == {4: 1, 5: 2, 6: 1}
+
+
+def test_garbled_probes_are_sent_again_within_the_retries():
+    found, probes = asyncio.run(scan([4, 5, 6], {5: [None]}))
+    assert found == {}
+    assert probes == {4: 1, 5: 1 + DiscoverySettings.ProbeRetries, 6: 1}
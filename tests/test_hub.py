@@ -0,0 +1,91 @@
+"""Tests of the hub setup and poll cycles."""
+import asyncio
+
+import pytest
+
+from custom_components.solaredge_rs485.hub import (
+    HubInitFailed,
+    SolarEdgers485MultiHub,
+)
+from custom_components.solaredge_rs485.rs485eth import (
+    Instrument,
+    NoResponseError,
+    RegisterBlock,
+    RegisterData,
+)
+
+
+class FakeClient:
+    """Answers every block with zeros, failing the first *failed_reads* model reads."""
+
+    def __init__(self, failed_reads=0):
+        self.failed_reads = failed_reads
+        self.priority = None
+
+    async def read_blocks(self, blocks, partial=False, retries=0, slaveaddress=1):
+        if partial and self.failed_reads:
+            self.failed_reads -= 1
+            error = NoResponseError("no answer")
+            return RegisterData(
+                [None] * len(blocks), {index: error for index in range(len(blocks))}
+            )
+        return RegisterData(
+            [
+                RegisterBlock(
+                    block.address,
+                    block.count,
+                    bytes([slaveaddress, 4, 2 * block.count])
+                    + bytes(2 * block.count + 2),
+                    3,
+                )
+                for block in blocks
+            ]
+        )
+
+    async def close(self):
+        pass
+
+
+class LossyInstrument(Instrument):
+    """Answers every read with zeros, but drops the requests numbered in *drop*."""
+
+    def __init__(self, drop=()):
+        super().__init__("test", 0)
+        self.drop = set(drop)
+        self.sent = 0
+
+    async def _communicate(self, request):
+        self.sent += 1
+        if self.sent in self.drop:
+            raise NoResponseError("dropped")
+        count = int.from_bytes(request[4:6], "big")
+        return bytes([request[0], 4, 2 * count]) + bytes(2 * count + 2)
+
+    def _check_response(self, response):
+        pass
+
+
+def test_failed_model_read_does_not_duplicate_inverters():
+    hub = SolarEdgers485MultiHub(None, "test", "gateway", 8899)
+    hub._client = FakeClient(failed_reads=1)
+
+    with pytest.raises(HubInitFailed):
+        asyncio.run(hub._async_init_solaredge())
+    assert hub.inverters == []
+    assert not hub.initalized
+
+    asyncio.run(hub._async_init_solaredge())
+    assert [inverter.inverter_unit_id for inverter in hub.inverters] == [1]
+    assert hub.initalized
+
+
+def test_cycle_survives_a_dropped_first_frame():
+    hub = SolarEdgers485MultiHub(None, "test", "gateway", 8899)
+    hub._client = LossyInstrument()
+    asyncio.run(hub._async_init_solaredge())
+
+    # The first request of the cycle, to the first block, gets no answer
+    hub._client.drop = {hub._client.sent + 1}
+    assert asyncio.run(hub.async_refresh_rs485_data())
+    assert hub.metrics.failed_blocks == 0
+    assert hub._client.metrics.block_retries == 1
@@ -0,0 +1,37 @@
+"""Tests of the read plans of the poll tiers."""
+import pytest
+
+from custom_components.solaredge_rs485.const import PollTier, ReadPlanSettings
+from custom_components.solaredge_rs485.hub import SolarEdgers485MultiHub
+
+FULL = frozenset([PollTier.FAST, PollTier.MEDIUM, PollTier.SLOW])
+
+
+@pytest.mark.parametrize(
+    "max_registers, max_gap",
+    [
+        (ReadPlanSettings.MaxRegisters, ReadPlanSettings.MaxGap),
+        (50, 10),
+        (50, 0),
+        (125, 0),
+        (20, 5),
+    ],
+)
+def test_tier_plans_need_no_more_requests_than_the_full_plan(max_registers, max_gap):
+    hub = SolarEdgers485MultiHub(
+        None,
+        "test",
+        "gateway",
+        8899,
+        max_read_registers=max_registers,
+        max_read_gap=max_gap,
+    )
+    full = len(hub.model_maps[FULL].blocks)
+    for tiers, model_map in hub.model_maps.items():
+        assert len(model_map.blocks) <= full, sorted(tiers)
+
+
+def test_fast_cycle_reads_in_as_many_requests_as_the_full_read():
+    hub = SolarEdgers485MultiHub(None, "test", "gateway", 8899)
+    fast = hub.model_maps[frozenset([PollTier.FAST])]
+    assert len(fast.blocks) == len(hub.model_maps[FULL].blocks)
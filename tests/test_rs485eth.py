@@ -0,0 +1,135 @@
+"""Tests of the checks on the answers of the gateway and of the block reads."""
+import asyncio
+import struct
+
+import pytest
+
+from custom_components.solaredge_rs485.crc import crc16_wide
+from custom_components.solaredge_rs485.rs485eth import (
+    Instrument,
+    InvalidResponseError,
+    NoResponseError,
+    ReadBlock,
+)
+
+BLOCKS = [ReadBlock(3000, 10), ReadBlock(3020, 10), ReadBlock(3040, 10)]
+
+
+def frame(*data):
+    payload = bytes(data)
+    return payload + struct.pack("<H", crc16_wide(payload))
+
+
+class AnsweringInstrument(Instrument):
+    """Answers every request with *answer* instead of asking a gateway."""
+
+    def __init__(self, answer):
+        super().__init__("test", 0)
+        self.answer = answer
+
+    async def _communicate(self, request):
+        return self.answer
+
+
+@pytest.mark.parametrize("method", ["_generic_command", "read_registers"])
+def test_answer_from_another_slave_is_rejected(method):
+    instrument = AnsweringInstrument(frame(2, 4, 2, 0, 42))
+    with pytest.raises(InvalidResponseError):
+        asyncio.run(getattr(instrument, method)(40000, number_of_registers=1))
+
+
+def test_generic_command_parses_answer_of_its_slave():
+    instrument = AnsweringInstrument(frame(1, 4, 2, 0, 42))
+    value = asyncio.run(
+        instrument._generic_command(
+            40000, number_of_registers=1, payloadformat="register"
+        )
+    )
+    assert value == 42
+
+
+def test_frame_cache_lookups_are_counted():
+    instrument = AnsweringInstrument(frame(1, 4, 2, 0, 42))
+    for _ in range(3):
+        asyncio.run(instrument.read_registers(40000, 1))
+    metrics = instrument.metrics.as_dict()
+    assert metrics["frame_cache_misses"] == 1
+    assert metrics["frame_cache_hits"] == 2
+    assert metrics["frame_cache_hit_rate"] == 2 / 3
+
+
+class BusInstrument(Instrument):
+    """Answers the reads of one slave, failing some of them.
+
+    Args:
+        failures: How many times the read at each address fails, by address.
+        error: The exception class of the failures.
+
+    """
+
+    def __init__(self, failures=None, error=NoResponseError):
+        super().__init__("test", 0)
+        self.failures = dict(failures or {})
+        self.error = error
+        self.addresses = []  # of the requests, in order
+
+    async def _communicate(self, request):
+        address = int.from_bytes(request[2:4], "big")
+        count = int.from_bytes(request[4:6], "big")
+        self.addresses.append(address)
+        if self.failures.get(address):
+            self.failures[address] -= 1
+            raise self.error(f"read at {address} failed")
+        return frame(request[0], 4, 2 * count, *bytes(2 * count))
+
+
+def read_blocks(instrument, retries):
+    return asyncio.run(instrument.read_blocks(BLOCKS, partial=True, retries=retries))
+
+
+def test_first_block_is_retried_at_once():
+    instrument = BusInstrument({3000: 1})
+    data = read_blocks(instrument, retries=1)
+    assert data.complete
+    assert instrument.addresses == [3000, 3000, 3020, 3040]
+    assert instrument.metrics.block_retries == 1
+
+
+def test_absent_slave_costs_the_retries_of_the_first_block_only():
+    instrument = BusInstrument({3000: 10})
+    data = read_blocks(instrument, retries=2)
+    assert instrument.addresses == [3000] * 3
+    assert data.blocks == [None] * 3
+    assert sorted(data.errors) == [0, 1, 2]
+    assert all(isinstance(error, NoResponseError) for error in data.errors.values())
+
+
+def test_without_retries_a_silent_slave_costs_one_request():
+    instrument = BusInstrument({3000: 1})
+    data = read_blocks(instrument, retries=0)
+    assert instrument.addresses == [3000]
+    assert sorted(data.errors) == [0, 1, 2]
+
+
+def test_failed_blocks_are_retried_after_the_sweep():
+    instrument = BusInstrument({3020: 1})
+    data = read_blocks(instrument, retries=1)
+    assert data.complete
+    assert instrument.addresses == [3000, 3020, 3040, 3020]
+
+
+def test_block_failing_beyond_its_retries_keeps_its_error():
+    instrument = BusInstrument({3040: 3})
+    data = read_blocks(instrument, retries=2)
+    assert instrument.addresses == [3000, 3020, 3040, 3040, 3040]
+    assert data.blocks[0] is not None and data.blocks[1] is not None
+    assert data.blocks[2] is None
+    assert list(data.errors) == [2]
+
+
+def test_garbled_first_block_does_not_stop_the_sweep():
+    instrument = BusInstrument({3000: 2}, error=InvalidResponseError)
+    data = read_blocks(instrument, retries=1)
+    assert instrument.addresses == [3000, 3000, 3020, 3040]
+    assert list(data.errors) == [0]
+    assert isinstance(data.errors[0], InvalidResponseError)